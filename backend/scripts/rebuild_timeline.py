@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Script para regenerar el timeline del feed de RafflyWin
+Ejecutar en el VPS: python3 rebuild_timeline.py
+
+Este script:
+1. Recorre todas las publicaciones y rifas activas
+2. Reescribe sus entradas en la colección timeline
+3. Elimina las entradas que ya no corresponden a contenido visible
+
+Útil después de cargar datos directamente en la base de datos
+(por ejemplo con seed_mock_data.py) o de una migración.
+"""
+
+import asyncio
+import os
+import sys
+
+# Permite importar server.py desde la carpeta backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from server import client, rebuild_timeline
+
+
+async def main():
+    print("🔄 Regenerando timeline del feed...")
+    count = await rebuild_timeline()
+    print(f"✅ Timeline regenerado: {count} entradas")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
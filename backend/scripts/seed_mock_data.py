@@ -131,8 +131,8 @@ async def seed_database():
         "role": "super_admin",
         "is_active": True,
         "is_featured": False,
-        "followers": [],
-        "following": [],
+        "followers_count": 0,
+        "following_count": 0,
         "created_at": datetime.now(timezone.utc)
     }
     await db.users.update_one({"email": admin["email"]}, {"$set": admin}, upsert=True)
@@ -153,8 +153,8 @@ async def seed_database():
             "paypal_email": creator_data.get("paypal_email"),
             "rating": round(random.uniform(4.0, 5.0), 1),
             "rating_count": random.randint(10, 100),
-            "followers": [],
-            "following": [],
+            "followers_count": 0,
+            "following_count": 0,
             "created_at": datetime.now(timezone.utc) - timedelta(days=random.randint(30, 180))
         }
         await db.users.update_one({"email": creator["email"]}, {"$set": creator}, upsert=True)
@@ -173,21 +173,44 @@ async def seed_database():
             "full_name": user_data["full_name"],
             "role": "user",
             "is_active": True,
-            "followers": [],
-            "following": [],
+            "followers_count": 0,
+            "following_count": 0,
             "created_at": datetime.now(timezone.utc) - timedelta(days=random.randint(1, 90))
         }
         await db.users.update_one({"email": user["email"]}, {"$set": user}, upsert=True)
         created_users.append(user)
         print(f"   ✅ {user['full_name']} ({user['email']})")
     
-    # Add followers to creators
+    # Add followers to creators (one `follows` edge per relationship plus the
+    # denormalized counts on both users)
     print("\n🔗 Agregando seguidores...")
+    following_counts = {}
     for creator in created_creators:
         num_followers = random.randint(3, len(created_users))
         followers = random.sample([u["id"] for u in created_users], num_followers)
-        await db.users.update_one({"id": creator["id"]}, {"$set": {"followers": followers}})
+        await db.follows.insert_many([
+            {
+                "id": str(uuid4()),
+                "follower_id": follower_id,
+                "following_id": creator["id"],
+                "created_at": (datetime.now(timezone.utc) - timedelta(days=random.randint(0, 30))).isoformat()
+            }
+            for follower_id in followers
+        ])
+        await db.users.update_one({"id": creator["id"]}, {"$set": {"followers_count": num_followers}})
+        for follower_id in followers:
+            following_counts[follower_id] = following_counts.get(follower_id, 0) + 1
         print(f"   ✅ {creator['full_name']}: {num_followers} seguidores")
+    for user_id, count in following_counts.items():
+        await db.users.update_one({"id": user_id}, {"$set": {"following_count": count}})
+    
+    # Unread counters start at zero for every seeded account
+    for account in [admin, *created_creators, *created_users]:
+        await db.user_counters.update_one(
+            {"_id": account["id"]},
+            {"$set": {"unread_notifications": 0, "unread_messages": 0}},
+            upsert=True
+        )
     
     # Create Raffles
     print("\n🎟️ Creando Rifas...")
@@ -1,11 +1,16 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, ReplaceOne, IndexModel
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from bson import Binary
 from passlib.context import CryptContext
 import jwt
 import os
+import socket
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
@@ -13,15 +18,23 @@ from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 import random
+import time
+from collections import OrderedDict
 from enum import Enum
 import base64
 from fastapi.staticfiles import StaticFiles
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import json
+import csv
+import io
 import hmac
 import hashlib
+import secrets
 from urllib.parse import quote_plus
 
 # Paddle SDK
@@ -96,7 +109,15 @@ app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes with a different cost are upgraded transparently on the next login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 security = HTTPBearer()
 SECRET_KEY = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 
@@ -135,8 +156,8 @@ class User(BaseModel):
     cover_image: Optional[str] = None
     description: Optional[str] = None
     interests: List[str] = Field(default_factory=list)
-    followers: List[str] = Field(default_factory=list)
-    following: List[str] = Field(default_factory=list)
+    followers_count: int = 0
+    following_count: int = 0
     rating: float = 0.0
     rating_count: int = 0
     is_active: bool = True
@@ -182,8 +203,11 @@ class Raffle(BaseModel):
     categories: List[str] = Field(default_factory=list)
     status: RaffleStatus = RaffleStatus.ACTIVE
     tickets_sold: int = 0
+    gross_sales: float = 0.0
     winning_number: Optional[int] = None
     winner_id: Optional[str] = None
+    draw_commitment: Optional[str] = None
+    draw_seed: Optional[str] = None
     likes_count: int = 0
     comments_count: int = 0
     creation_fee: Optional[float] = None
@@ -232,6 +256,7 @@ class Notification(BaseModel):
     type: str
     read: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    expires_at: Optional[datetime] = None
 
 class Message(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -241,6 +266,10 @@ class Message(BaseModel):
     subject: str
     content: str
     parent_id: Optional[str] = None
+    conversation_id: Optional[str] = None
+    read: bool = False
+    archived_by: List[str] = Field(default_factory=list)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 # Social Feed Models
 class Post(BaseModel):
@@ -277,14 +306,12 @@ class Comment(BaseModel):
     content: str
     parent_id: Optional[str] = None  # For replies
     likes_count: int = 0
+    replies_count: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class CommentCreate(BaseModel):
     content: str
     parent_id: Optional[str] = None
-    read: bool = False
-    archived_by: List[str] = Field(default_factory=list)
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class MessageCreate(BaseModel):
     to_user_id: str
@@ -347,12 +374,66 @@ class PaymentMethod(BaseModel):
     last_four: Optional[str] = None  # Last 4 digits for cards
     is_default: bool = False
 
+# Password hashing
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 64))
+
+class PasswordHasher:
+    """Runs bcrypt in a bounded thread pool so it never blocks the event loop.
+    
+    Calls beyond `workers + max_queue` pending jobs are rejected with a 503
+    instead of piling up behind a login storm.
+    """
+    
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_pending = workers + max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+    
+    async def run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="El servidor está ocupado, intenta de nuevo en unos segundos",
+                headers={"Retry-After": "1"}
+            )
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+    
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": min(self.pending, self.workers),
+            "queued": max(self.pending - self.workers, 0),
+            "peak_pending": self.peak_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "bcrypt_rounds": BCRYPT_ROUNDS
+        }
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
+
 # Helper functions
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    return await password_hasher.run(pwd_context.hash, password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    """Verify a password, returning (valid, new_hash) where new_hash is set when the hash needs upgrading"""
+    return await password_hasher.run(pwd_context.verify_and_update, plain_password, hashed_password)
 
 def create_token(user_id: str, email: str, role: str) -> str:
     payload = {
@@ -363,19 +444,131 @@ def create_token(user_id: str, email: str, role: str) -> str:
     }
     return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+# EventSource cannot send headers, so the event stream authenticates with a
+# short-lived token in the URL that is good for nothing else
+STREAM_TOKEN_SECONDS = int(os.environ.get('STREAM_TOKEN_SECONDS', 60))
+
+def create_stream_token(user_id: str) -> str:
+    payload = {
+        "user_id": user_id,
+        "purpose": "event_stream",
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=STREAM_TOKEN_SECONDS)
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+
+class TTLCache:
+    """Small in-process LRU cache whose entries expire `ttl` seconds after being stored"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+    
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+    
+    def set(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+    
+    def clear(self):
+        self._entries.clear()
+
+# Validated principals keyed by user id. Writes to a user document must call
+# invalidate_user_caches(); the TTL bounds staleness across worker processes.
+AUTH_CACHE_TTL_SECONDS = float(os.environ.get('AUTH_CACHE_TTL_SECONDS', 60))
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_CACHE_MAX_ENTRIES', 10000))
+principal_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL_SECONDS)
+
+# Slim public creator cards embedded in feed items, cached for a short time
+CREATOR_CARD_PROJECTION = {
+    "_id": 0, "id": 1, "full_name": 1, "profile_image": 1, "role": 1,
+    "is_featured": 1, "rating": 1, "rating_count": 1
+}
+CREATOR_CARD_TTL_SECONDS = float(os.environ.get('CREATOR_CARD_TTL_SECONDS', 30))
+creator_card_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, CREATOR_CARD_TTL_SECONDS)
+
+def invalidate_user_caches(user_id: str):
+    principal_cache.invalidate(user_id)
+    creator_card_cache.invalidate(user_id)
+
+async def get_creator_cards(creator_ids) -> dict:
+    """Get creator cards by id, fetching all cache misses with one $in query"""
+    cards = {}
+    missing = []
+    for creator_id in set(creator_ids):
+        card = creator_card_cache.get(creator_id)
+        if card is None:
+            missing.append(creator_id)
+        else:
+            cards[creator_id] = card
+    
+    if missing:
+        docs = await db.users.find({"id": {"$in": missing}}, CREATOR_CARD_PROJECTION).to_list(None)
+        for doc in docs:
+            creator_card_cache.set(doc["id"], doc)
+            cards[doc["id"]] = doc
+    return cards
+
+class TokenPrincipal(BaseModel):
+    id: str
+    email: str
+    role: UserRole
+
+def decode_token(credentials: HTTPAuthorizationCredentials, purpose: Optional[str] = None) -> dict:
+    """Decode a JWT; single-purpose tokens are only accepted where that purpose is expected"""
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
-        if not user:
-            raise HTTPException(status_code=401, detail="Usuario no encontrado")
-        return User(**user)
+        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=["HS256"])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expirado")
     except Exception as e:
         logger.error(f"Auth error: {type(e).__name__}: {e}")
         raise HTTPException(status_code=401, detail=f"Error de autenticación: {str(e)}")
+    if payload.get("purpose") != purpose:
+        raise HTTPException(status_code=401, detail="Token no válido para esta operación")
+    return payload
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    payload = decode_token(credentials)
+    try:
+        user = principal_cache.get(payload["user_id"])
+        if user is None:
+            user_doc = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
+            if not user_doc:
+                raise HTTPException(status_code=401, detail="Usuario no encontrado")
+            user = User(**user_doc)
+            principal_cache.set(user.id, user)
+        return user
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Auth error: {type(e).__name__}: {e}")
+        raise HTTPException(status_code=401, detail=f"Error de autenticación: {str(e)}")
+
+async def get_token_principal(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenPrincipal:
+    """Resolve the caller from the JWT claims only, without a database lookup.
+    
+    For read endpoints that only need the user id (or the role at login time).
+    """
+    payload = decode_token(credentials)
+    try:
+        return TokenPrincipal(id=payload["user_id"], email=payload["email"], role=payload["role"])
+    except Exception as e:
+        logger.error(f"Auth error: {type(e).__name__}: {e}")
+        raise HTTPException(status_code=401, detail=f"Error de autenticación: {str(e)}")
 
 def prepare_for_mongo(data: dict) -> dict:
     if isinstance(data.get('created_at'), datetime):
@@ -395,15 +588,508 @@ def parse_from_mongo(item: dict) -> dict:
         item['purchased_at'] = datetime.fromisoformat(item['purchased_at'])
     return item
 
-async def create_notification(user_id: str, title: str, message: str, type: str):
+# Keyset pagination: lists are ordered by (sort field, id) and a page starts
+# right after the last (value, id) pair of the previous one, so any page is
+# an index range read instead of skipping over every earlier document. The
+# pair is handed to clients as an opaque base64 token.
+
+def encode_cursor(sort_value, item_id: str) -> str:
+    if isinstance(sort_value, datetime):
+        sort_value = {"$date": sort_value.isoformat()}
+    payload = json.dumps([sort_value, item_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, item_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if isinstance(sort_value, dict) and "$date" in sort_value:
+        sort_value = datetime.fromisoformat(sort_value["$date"])
+    return sort_value, item_id
+
+def keyset_filter(sort_field: str, sort_direction: int, cursor: str) -> dict:
+    """Match the documents that come after `cursor` in (sort_field, id) order"""
+    sort_value, item_id = decode_cursor(cursor)
+    op = "$lt" if sort_direction == -1 else "$gt"
+    if sort_value is None:
+        # Missing values sort first ascending and last descending
+        after_nulls = [] if sort_direction == -1 else [{sort_field: {"$ne": None}}]
+        return {"$or": after_nulls + [{sort_field: None, "id": {op: item_id}}]}
+    return {"$or": [
+        {sort_field: {op: sort_value}},
+        {sort_field: sort_value, "id": {op: item_id}}
+    ]}
+
+async def keyset_page(
+    collection,
+    query: dict,
+    projection: dict,
+    sort_field: str,
+    sort_direction: int,
+    per_page: int,
+    cursor: Optional[str] = None,
+    page: int = 1
+) -> tuple:
+    """Fetch one page ordered by (sort_field, id) and the cursor of the next one.
+    
+    Without a cursor, `page` is honoured as a legacy offset.
+    """
+    skip = 0
+    if cursor:
+        query = {"$and": [query, keyset_filter(sort_field, sort_direction, cursor)]}
+    else:
+        skip = (page - 1) * per_page
+    
+    docs = await collection.find(query, projection).sort(
+        [(sort_field, sort_direction), ("id", sort_direction)]
+    ).skip(skip).limit(per_page + 1).to_list(per_page + 1)
+    
+    next_cursor = None
+    if len(docs) > per_page:
+        docs = docs[:per_page]
+        next_cursor = encode_cursor(docs[-1].get(sort_field), docs[-1]["id"])
+    return docs, next_cursor
+
+def build_notification(user_id: str, title: str, message: str, type: str, **extra_fields) -> dict:
     notification = Notification(
         user_id=user_id,
         title=title,
         message=message,
-        type=type
+        type=type,
+        expires_at=datetime.now(timezone.utc) + timedelta(days=NOTIFICATION_RETENTION_DAYS)
     )
     doc = prepare_for_mongo(notification.model_dump())
-    await db.notifications.insert_one(doc)
+    doc["counted"] = True
+    doc.update(extra_fields)
+    return doc
+
+async def create_notification(user_id: str, title: str, message: str, type: str):
+    await insert_notifications([build_notification(user_id, title, message, type)])
+
+async def insert_notifications(docs: List[dict]):
+    """Write a batch of notifications in a single insert_many"""
+    if not docs:
+        return
+    await db.notifications.insert_many(docs, ordered=False)
+    deltas = {}
+    for doc in docs:
+        deltas[doc["user_id"]] = deltas.get(doc["user_id"], 0) + 1
+    await adjust_counters(("unread_notifications", "notifications_since_trim"), deltas)
+    await publish_notifications(docs)
+    await trim_recipients(list(deltas))
+
+# Retention: notifications expire NOTIFICATION_RETENTION_DAYS after creation
+# and each user keeps at most NOTIFICATION_MAX_PER_USER. Expired ones are
+# deleted by an hourly job (a range read on `expires_at`); the per-user cap is
+# enforced at insert time for the recipients touched: `user_counters` counts
+# each user's notifications since their last trim and once that reaches
+# NOTIFICATION_TRIM_EVERY the user's oldest notifications beyond the cap are
+# deleted, so trimming cost follows churn rather than collection size. Both go
+# through delete_notifications so unread counters follow. The TTL index on
+# `expires_at` only fires a grace period later, as a backstop.
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 90))
+NOTIFICATION_MAX_PER_USER = int(os.environ.get('NOTIFICATION_MAX_PER_USER', 200))
+NOTIFICATION_TRIM_EVERY = int(os.environ.get('NOTIFICATION_TRIM_EVERY', 20))
+NOTIFICATION_TTL_GRACE = timedelta(days=1)
+
+async def delete_notifications(query: dict) -> int:
+    """Delete notifications, keeping their owners' unread counters in step"""
+    unread = await db.notifications.aggregate([
+        {"$match": {**query, "read": False, "counted": True}},
+        {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    result = await db.notifications.delete_many(query)
+    await adjust_counters("unread_notifications", {u["_id"]: -u["count"] for u in unread})
+    return result.deleted_count
+
+async def trim_user_notifications(user_id: str) -> int:
+    """Delete a user's oldest notifications beyond NOTIFICATION_MAX_PER_USER"""
+    oldest_kept = await db.notifications.find(
+        {"user_id": user_id}, {"_id": 0, "created_at": 1}
+    ).sort("created_at", -1).skip(NOTIFICATION_MAX_PER_USER - 1).limit(1).to_list(1)
+    if not oldest_kept:
+        return 0
+    return await delete_notifications({"user_id": user_id, "created_at": {"$lt": oldest_kept[0]["created_at"]}})
+
+async def trim_recipients(user_ids: List[str]) -> int:
+    """Trim the recipients of new notifications that are due for a cap check"""
+    due = await db.user_counters.find(
+        {"_id": {"$in": user_ids}, "notifications_since_trim": {"$gte": NOTIFICATION_TRIM_EVERY}},
+        {"_id": 1}
+    ).to_list(None)
+    trimmed = 0
+    for user in due:
+        # Reset before trimming so concurrent inserts trim each user once
+        claimed = await db.user_counters.update_one(
+            {"_id": user["_id"], "notifications_since_trim": {"$gte": NOTIFICATION_TRIM_EVERY}},
+            {"$set": {"notifications_since_trim": 0}}
+        )
+        if claimed.modified_count:
+            trimmed += await trim_user_notifications(user["_id"])
+    return trimmed
+
+async def trim_notifications() -> dict:
+    """Delete expired notifications"""
+    expired = await delete_notifications({"expires_at": {"$lte": datetime.now(timezone.utc)}})
+    if expired:
+        logger.info(f"Notifications trimmed: {expired} expired")
+    return {"expired": expired}
+
+async def backfill_notification_expiry():
+    """Give notifications created before retention existed their expiry date"""
+    await db.notifications.update_many(
+        {"expires_at": {"$exists": False}},
+        [{"$set": {"expires_at": {"$dateAdd": {
+            "startDate": {"$toDate": "$created_at"},
+            "unit": "day",
+            "amount": NOTIFICATION_RETENTION_DAYS
+        }}}}]
+    )
+
+# ============================================
+# UNREAD COUNTERS
+# ============================================
+
+# Badge counts come from one `user_counters` document per user
+# ({_id: user_id, unread_notifications, unread_messages}), adjusted with $inc
+# whenever a notification or message is created, read or deleted, so reading
+# a badge is a single point lookup instead of a count over the collection.
+# Notifications and messages included in the counters carry `counted: True`;
+# only those decrement them when read or deleted, so the backfill can fold
+# older items in with $inc while live traffic keeps adjusting the counters.
+USER_COUNTER_FIELDS = ("unread_notifications", "unread_messages")
+
+async def adjust_counters(fields, deltas: dict):
+    """Apply {user_id: delta} to one counter field (or a tuple of them) in a single bulk write"""
+    fields = (fields,) if isinstance(fields, str) else fields
+    ops = [
+        UpdateOne({"_id": user_id}, {"$inc": {field: delta for field in fields}}, upsert=True)
+        for user_id, delta in deltas.items() if delta
+    ]
+    if ops:
+        await db.user_counters.bulk_write(ops, ordered=False)
+
+async def get_counters(user_id: str) -> dict:
+    doc = await db.user_counters.find_one({"_id": user_id}) or {}
+    return {field: max(doc.get(field, 0), 0) for field in USER_COUNTER_FIELDS}
+
+async def mark_notifications_read(user_id: str, query: dict) -> int:
+    """Mark a user's notifications read, taking the counted ones off their badge"""
+    query = {**query, "user_id": user_id, "read": False}
+    counted = await db.notifications.update_many({**query, "counted": True}, {"$set": {"read": True}})
+    rest = await db.notifications.update_many(query, {"$set": {"read": True}})
+    await adjust_counters("unread_notifications", {user_id: -counted.modified_count})
+    return counted.modified_count + rest.modified_count
+
+async def backfill_user_counters():
+    """Fold the unread notifications and messages stored before the counters into them.
+    
+    Each user's uncounted unread items are marked `counted` and the number
+    marked is added with $inc, so increments made meanwhile are kept.
+    """
+    for field, collection, user_field in (
+        ("unread_notifications", db.notifications, "user_id"),
+        ("unread_messages", db.messages, "to_user_id")
+    ):
+        uncounted = {"read": False, "counted": {"$ne": True}}
+        users = collection.aggregate([
+            {"$match": uncounted},
+            {"$group": {"_id": f"${user_field}"}}
+        ], allowDiskUse=True)
+        async for user in users:
+            result = await collection.update_many({**uncounted, user_field: user["_id"]}, {"$set": {"counted": True}})
+            await adjust_counters(field, {user["_id"]: result.modified_count})
+
+# ============================================
+# REAL-TIME EVENTS
+# ============================================
+
+# Connected clients get new notifications, messages, draw results and ticket
+# sales pushed over Server-Sent Events instead of polling. Each worker keeps an
+# in-process broker of per-user subscriber queues. With PUSH_BACKEND=local,
+# events are delivered only to clients of the publishing worker (single
+# worker deployments). With PUSH_BACKEND=mongo, events are written to the
+# short-lived `events` collection and every worker relays them to its own
+# subscribers from a change stream (requires a replica set). Unless set
+# explicitly, mongo is used whenever more than one worker is configured.
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+PUSH_BACKEND = os.environ.get('PUSH_BACKEND') or ('mongo' if WEB_CONCURRENCY > 1 else 'local')
+PUSH_HEARTBEAT_SECONDS = int(os.environ.get('PUSH_HEARTBEAT_SECONDS', '15'))
+PUSH_QUEUE_SIZE = int(os.environ.get('PUSH_QUEUE_SIZE', '100'))
+PUSH_EVENT_RETENTION_SECONDS = 60
+
+class EventBroker:
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self.dropped = 0
+    
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+    
+    def dispatch(self, user_ids: List[str], type: str, data: dict):
+        """Deliver an event to this worker's subscribers; slow clients miss events"""
+        for user_id in user_ids:
+            for queue in self._subscribers.get(user_id, ()):
+                try:
+                    queue.put_nowait((type, data))
+                except asyncio.QueueFull:
+                    self.dropped += 1
+    
+    def stats(self) -> dict:
+        return {
+            "users": len(self._subscribers),
+            "connections": sum(len(q) for q in self._subscribers.values()),
+            "dropped_events": self.dropped
+        }
+
+event_broker = EventBroker(PUSH_QUEUE_SIZE)
+
+async def publish_events(events: List[dict]):
+    """Publish events shaped {"user_ids": [...], "type": str, "data": dict}"""
+    if not events:
+        return
+    if PUSH_BACKEND != "mongo":
+        for event in events:
+            event_broker.dispatch(event["user_ids"], event["type"], event["data"])
+        return
+    # Push is best effort: clients resync over HTTP, so never fail the write that triggered it
+    try:
+        created_at = datetime.now(timezone.utc)
+        await db.events.insert_many([{**event, "created_at": created_at} for event in events], ordered=False)
+    except Exception as e:
+        logger.error(f"Event publish failed: {type(e).__name__}: {e}")
+
+async def publish_event(user_ids: List[str], type: str, data: dict):
+    await publish_events([{"user_ids": user_ids, "type": type, "data": data}])
+
+async def publish_notifications(docs: List[dict]):
+    await publish_events([
+        {"user_ids": [doc["user_id"]], "type": "notification", "data": {k: v for k, v in doc.items() if k != "_id"}}
+        for doc in docs
+    ])
+
+async def event_relay():
+    """Feed this worker's broker from the `events` change stream"""
+    resume_token = None
+    while True:
+        try:
+            async with db.events.watch(
+                [{"$match": {"operationType": "insert"}}],
+                resume_after=resume_token
+            ) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    event = change["fullDocument"]
+                    event_broker.dispatch(event["user_ids"], event["type"], event["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Event relay error: {type(e).__name__}: {e}")
+            await asyncio.sleep(1)
+
+@api_router.post("/events/token")
+async def get_stream_token(current_user: User = Depends(get_current_user)):
+    """Issue the short-lived token used to open the event stream"""
+    return {"token": create_stream_token(current_user.id), "expires_in": STREAM_TOKEN_SECONDS}
+
+@api_router.get("/events/stream")
+async def stream_events(request: Request, token: str):
+    """Server-Sent Events stream of the current user's real-time events.
+    
+    `token` is a stream token from POST /events/token, not the session JWT.
+    """
+    payload = decode_token(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token), purpose="event_stream")
+    user_id = payload["user_id"]
+    user_doc = await db.users.find_one({"id": user_id}, {"_id": 0, "is_active": 1})
+    if not user_doc:
+        raise HTTPException(status_code=401, detail="Usuario no encontrado")
+    if not user_doc.get("is_active", True):
+        raise HTTPException(status_code=403, detail="Tu cuenta está desactivada")
+    queue = event_broker.subscribe(user_id)
+    
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event_type, data = await asyncio.wait_for(queue.get(), timeout=PUSH_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+        finally:
+            event_broker.unsubscribe(user_id, queue)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/admin/metrics/push")
+async def get_push_metrics(current_user: User = Depends(get_current_user)):
+    """Real-time connections held by this worker"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    
+    return {"backend": PUSH_BACKEND, "worker_id": WORKER_ID, **event_broker.stats()}
+
+# ============================================
+# NOTIFICATION FAN-OUT WORKER
+# ============================================
+
+# Notifying every follower happens outside the request: endpoints enqueue a
+# job in `fanout_jobs` and a background worker streams the followers in `id`
+# order, writing FANOUT_BATCH_SIZE notifications per insert_many. Progress
+# (`last_follower_id`) is saved after each batch so a job whose lease expires
+# (e.g. the worker crashed) is resumed by any worker from where it stopped.
+# Before writing a batch the worker atomically renews its still-valid lease
+# from the progress it last saved, so a worker that was taken over stops
+# instead of writing the same batch as the new owner.
+FANOUT_BATCH_SIZE = int(os.environ.get('FANOUT_BATCH_SIZE', 500))
+FANOUT_LEASE_SECONDS = int(os.environ.get('FANOUT_LEASE_SECONDS', 60))
+FANOUT_POLL_SECONDS = 5
+FANOUT_JOBS_MAX_LIMIT = 200
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+fanout_wakeup = asyncio.Event()
+
+async def enqueue_follower_notifications(creator_id: str, title: str, message: str, type: str) -> str:
+    """Queue a notification for every follower of a creator"""
+    job = {
+        "id": str(uuid.uuid4()),
+        "creator_id": creator_id,
+        "title": title,
+        "message": message,
+        "type": type,
+        "status": "pending",
+        "last_follower_id": None,
+        "processed": 0,
+        "lease_owner": None,
+        "lease_expires_at": None,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.fanout_jobs.insert_one(job)
+    fanout_wakeup.set()
+    return job["id"]
+
+async def claim_fanout_job() -> Optional[dict]:
+    """Take the oldest pending job, or a running one whose worker stopped renewing its lease"""
+    now = datetime.now(timezone.utc)
+    return await db.fanout_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "pending"},
+            {"status": "running", "lease_expires_at": {"$lt": now}}
+        ]},
+        {"$set": {
+            "status": "running",
+            "lease_owner": WORKER_ID,
+            "lease_expires_at": now + timedelta(seconds=FANOUT_LEASE_SECONDS)
+        }},
+        sort=[("created_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def _write_fanout_batch(job: dict, follower_ids: List[str]) -> bool:
+    """Claim, write and record one batch; False if the job is no longer ours"""
+    now = datetime.now(timezone.utc)
+    claimed = await db.fanout_jobs.find_one_and_update(
+        {
+            "id": job["id"],
+            "lease_owner": WORKER_ID,
+            "lease_expires_at": {"$gt": now},
+            "last_follower_id": job.get("last_follower_id")
+        },
+        {"$set": {"lease_expires_at": now + timedelta(seconds=FANOUT_LEASE_SECONDS)}},
+        projection={"_id": 1}
+    )
+    if not claimed:
+        return False
+    
+    docs = [
+        build_notification(follower_id, job["title"], job["message"], job["type"], fanout_job_id=job["id"])
+        for follower_id in follower_ids
+    ]
+    await insert_notifications(docs)
+    
+    result = await db.fanout_jobs.update_one(
+        {"id": job["id"], "lease_owner": WORKER_ID, "last_follower_id": job.get("last_follower_id")},
+        {
+            "$set": {
+                "last_follower_id": follower_ids[-1],
+                "lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=FANOUT_LEASE_SECONDS)
+            },
+            "$inc": {"processed": len(follower_ids)}
+        }
+    )
+    if result.matched_count != 1:
+        return False
+    job["last_follower_id"] = follower_ids[-1]
+    return True
+
+async def run_fanout_job(job: dict):
+    last_follower_id = job.get("last_follower_id")
+    
+    # Remove notifications of a batch that was written before the previous worker died
+    # but whose progress was never saved, so resuming does not duplicate them
+    stale = {"fanout_job_id": job["id"]}
+    if last_follower_id:
+        stale["user_id"] = {"$gt": last_follower_id}
+    await delete_notifications(stale)
+    
+    query = {"following_id": job["creator_id"]}
+    if last_follower_id:
+        query["follower_id"] = {"$gt": last_follower_id}
+    cursor = db.follows.find(query, {"_id": 0, "follower_id": 1}).sort("follower_id", 1).batch_size(FANOUT_BATCH_SIZE)
+    
+    batch = []
+    async for follow in cursor:
+        batch.append(follow["follower_id"])
+        if len(batch) >= FANOUT_BATCH_SIZE:
+            if not await _write_fanout_batch(job, batch):
+                logger.warning(f"Fan-out job {job['id']} was taken over by another worker")
+                return
+            batch = []
+    if batch and not await _write_fanout_batch(job, batch):
+        logger.warning(f"Fan-out job {job['id']} was taken over by another worker")
+        return
+    
+    await db.fanout_jobs.update_one(
+        {"id": job["id"], "lease_owner": WORKER_ID},
+        {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc).isoformat()}}
+    )
+
+async def fanout_worker():
+    """Background loop that processes fan-out jobs until the app shuts down"""
+    while True:
+        fanout_wakeup.clear()
+        try:
+            job = await claim_fanout_job()
+            if job:
+                await run_fanout_job(job)
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Fan-out worker error: {type(e).__name__}: {e}")
+        
+        try:
+            await asyncio.wait_for(fanout_wakeup.wait(), timeout=FANOUT_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
 
 # Auth endpoints
 @api_router.post("/auth/register")
@@ -412,7 +1098,7 @@ async def register(user_data: UserCreate):
     if existing_user:
         raise HTTPException(status_code=400, detail="El email ya está registrado")
     
-    hashed_pw = hash_password(user_data.password)
+    hashed_pw = await hash_password(user_data.password)
     user = User(
         email=user_data.email,
         full_name=user_data.full_name,
@@ -425,6 +1111,10 @@ async def register(user_data: UserCreate):
     doc = prepare_for_mongo(user_dict)
     
     await db.users.insert_one(doc)
+    await record_metrics(doc["created_at"], {
+        "registrations": 1,
+        "creator_registrations": 1 if user.role == UserRole.CREATOR else 0
+    })
     
     token = create_token(user.id, user.email, user.role)
     return {"token": token, "user": user}
@@ -435,9 +1125,14 @@ async def login(credentials: UserLogin):
     if not user_doc:
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
     
-    if not verify_password(credentials.password, user_doc['password']):
+    valid, new_hash = await verify_and_update_password(credentials.password, user_doc['password'])
+    if not valid:
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
     
+    # Rehash with the current cost factor
+    if new_hash:
+        await db.users.update_one({"id": user_doc["id"]}, {"$set": {"password": new_hash}})
+    
     user_doc = parse_from_mongo(user_doc)
     user = User(**user_doc)
     
@@ -519,16 +1214,16 @@ async def create_raffle(
     
     doc = prepare_for_mongo(raffle.model_dump())
     await db.raffles.insert_one(doc)
+    raffle.draw_commitment = await commit_draw_seed(raffle.id)
+    await timeline_add("raffle", doc)
     
     # Notify followers
-    followers = await db.users.find({"following": current_user.id}, {"_id": 0, "id": 1}).to_list(None)
-    for follower in followers:
-        await create_notification(
-            follower['id'],
-            "Nueva Rifa Disponible",
-            f"{current_user.full_name} ha creado una nueva rifa: {title}",
-            "new_raffle"
-        )
+    await enqueue_follower_notifications(
+        current_user.id,
+        "Nueva Rifa Disponible",
+        f"{current_user.full_name} ha creado una nueva rifa: {title}",
+        "new_raffle"
+    )
     
     return raffle
 
@@ -700,16 +1395,16 @@ async def confirm_raffle_payment(
         {"id": raffle_id},
         {"$set": {"status": "active", "payment_confirmed_at": datetime.now(timezone.utc).isoformat()}}
     )
+    await commit_draw_seed(raffle_id)
+    await timeline_add("raffle", raffle)
     
     # Notify followers
-    followers = await db.users.find({"following": current_user.id}, {"_id": 0, "id": 1}).to_list(None)
-    for follower in followers:
-        await create_notification(
-            follower['id'],
-            "Nueva Rifa Disponible",
-            f"{current_user.full_name} ha creado una nueva rifa: {raffle['title']}",
-            "new_raffle"
-        )
+    await enqueue_follower_notifications(
+        current_user.id,
+        "Nueva Rifa Disponible",
+        f"{current_user.full_name} ha creado una nueva rifa: {raffle['title']}",
+        "new_raffle"
+    )
     
     return {"success": True, "message": "Rifa activada exitosamente"}
 
@@ -744,6 +1439,32 @@ async def get_raffle(raffle_id: str):
         raise HTTPException(status_code=404, detail="Rifa no encontrada")
     return parse_from_mongo(raffle)
 
+@api_router.get("/raffles/{raffle_id}/draw-proof")
+async def get_draw_proof(raffle_id: str):
+    """Get the draw commitment of a raffle and, once drawn, the revealed seed to verify the result"""
+    raffle = await db.raffles.find_one(
+        {"id": raffle_id},
+        {"_id": 0, "id": 1, "ticket_range": 1, "status": 1, "winning_number": 1, "draw_commitment": 1, "draw_seed": 1}
+    )
+    if not raffle:
+        raise HTTPException(status_code=404, detail="Rifa no encontrada")
+    
+    proof = {
+        "raffle_id": raffle_id,
+        "algorithm": DRAW_ALGORITHM,
+        "ticket_range": raffle["ticket_range"],
+        "commitment": raffle.get("draw_commitment"),
+        "seed": raffle.get("draw_seed"),
+        "winning_number": raffle.get("winning_number"),
+        "verified": None
+    }
+    if proof["seed"]:
+        proof["verified"] = (
+            draw_commitment(proof["seed"]) == proof["commitment"]
+            and compute_winning_number(proof["seed"], raffle_id, raffle["ticket_range"]) == proof["winning_number"]
+        )
+    return proof
+
 @api_router.get("/raffles/check-date/{date}")
 async def check_date_availability(date: str, current_user: User = Depends(get_current_user)):
     """Check if a creator can create a raffle on a specific date"""
@@ -773,6 +1494,338 @@ async def check_date_availability(date: str, current_user: User = Depends(get_cu
     except Exception as e:
         raise HTTPException(status_code=400, detail="Fecha inválida")
 
+# ============================================
+# TICKET INVENTORY (BITMAP ALLOCATOR)
+# ============================================
+
+# Each raffle has one document in `ticket_inventory` holding a bitmap of the
+# ticket numbers already taken (bit n-1 set = number n taken). Allocations are
+# compare-and-swap updates guarded by `version`, so two buyers can never get
+# the same number and a purchase only touches `quantity` bits. On a hot
+# raffle concurrent buyers conflict often, so conflicts are retried with
+# jittered exponential backoff until a time budget runs out.
+TICKET_ALLOCATION_TIMEOUT_SECONDS = float(os.environ.get('TICKET_ALLOCATION_TIMEOUT_SECONDS', 5))
+TICKET_ALLOCATION_BACKOFF_SECONDS = 0.005
+TICKET_ALLOCATION_MAX_BACKOFF_SECONDS = 0.25
+
+def _bit_is_set(bitmap: bytearray, number: int) -> bool:
+    return bool(bitmap[(number - 1) >> 3] & (1 << ((number - 1) & 7)))
+
+def _set_bit(bitmap: bytearray, number: int):
+    bitmap[(number - 1) >> 3] |= 1 << ((number - 1) & 7)
+
+def _clear_bit(bitmap: bytearray, number: int):
+    bitmap[(number - 1) >> 3] &= ~(1 << ((number - 1) & 7)) & 0xFF
+
+async def get_ticket_inventory(raffle_id: str, ticket_range: int) -> dict:
+    """Get the inventory document of a raffle, building it from sold tickets on first use"""
+    inventory = await db.ticket_inventory.find_one({"raffle_id": raffle_id}, {"_id": 0})
+    if inventory:
+        return inventory
+    
+    # One-time scan for raffles that sold tickets before the inventory existed
+    sold = await db.tickets.find({"raffle_id": raffle_id}, {"_id": 0, "ticket_number": 1}).to_list(None)
+    bitmap = bytearray((ticket_range + 7) // 8)
+    for ticket in sold:
+        if 1 <= ticket["ticket_number"] <= ticket_range:
+            _set_bit(bitmap, ticket["ticket_number"])
+    
+    inventory = {
+        "raffle_id": raffle_id,
+        "ticket_range": ticket_range,
+        "bitmap": Binary(bytes(bitmap)),
+        "allocated_count": sum(bin(b).count("1") for b in bitmap),
+        "version": 0,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    try:
+        await db.ticket_inventory.insert_one(inventory)
+    except DuplicateKeyError:
+        # Built concurrently by another request
+        return await db.ticket_inventory.find_one({"raffle_id": raffle_id}, {"_id": 0})
+    inventory.pop("_id", None)
+    return inventory
+
+def _pick_free_numbers(bitmap: bytearray, ticket_range: int, quantity: int) -> List[int]:
+    """Pick random free numbers by probing the bitmap, scanning only when it is almost full"""
+    picked = set()
+    attempts = quantity * 4
+    while len(picked) < quantity and attempts > 0:
+        number = random.randint(1, ticket_range)
+        if not _bit_is_set(bitmap, number):
+            picked.add(number)
+        attempts -= 1
+    
+    if len(picked) < quantity:
+        free = [n for n in range(1, ticket_range + 1) if not _bit_is_set(bitmap, n) and n not in picked]
+        if len(free) < quantity - len(picked):
+            raise HTTPException(status_code=400, detail="No hay suficientes tickets disponibles")
+        picked.update(random.sample(free, quantity - len(picked)))
+    
+    return list(picked)
+
+async def _update_ticket_inventory(raffle_id: str, ticket_range: int, mutate):
+    """Apply `mutate(bitmap, allocated_count)` to the inventory with a compare-and-swap.
+    
+    `mutate` edits the bitmap in place and returns (result, allocated_delta). It is
+    retried on version conflicts, so it must not have other side effects.
+    """
+    deadline = time.monotonic() + TICKET_ALLOCATION_TIMEOUT_SECONDS
+    backoff = TICKET_ALLOCATION_BACKOFF_SECONDS
+    while True:
+        inventory = await get_ticket_inventory(raffle_id, ticket_range)
+        bitmap = bytearray(inventory["bitmap"])
+        result, delta = mutate(bitmap, inventory["allocated_count"])
+        if delta == 0:
+            return result
+        
+        updated = await db.ticket_inventory.update_one(
+            {"raffle_id": raffle_id, "version": inventory["version"]},
+            {
+                "$set": {"bitmap": Binary(bytes(bitmap))},
+                "$inc": {"allocated_count": delta, "version": 1}
+            }
+        )
+        if updated.modified_count == 1:
+            return result
+        
+        # Lost the race: back off a random fraction of the current window
+        if time.monotonic() + backoff > deadline:
+            break
+        await asyncio.sleep(random.uniform(0, backoff))
+        backoff = min(backoff * 2, TICKET_ALLOCATION_MAX_BACKOFF_SECONDS)
+    
+    logger.warning(f"Ticket inventory of raffle {raffle_id} still contended after {TICKET_ALLOCATION_TIMEOUT_SECONDS}s")
+    raise HTTPException(status_code=409, detail="Hay muchas compras simultáneas en esta rifa, intenta de nuevo")
+
+async def allocate_ticket_numbers(raffle_id: str, ticket_range: int, quantity: int) -> List[int]:
+    """Atomically reserve `quantity` random free ticket numbers of a raffle"""
+    if quantity < 1:
+        raise HTTPException(status_code=400, detail="Cantidad de tickets inválida")
+    
+    def mutate(bitmap: bytearray, allocated_count: int):
+        if allocated_count + quantity > ticket_range:
+            raise HTTPException(status_code=400, detail="No hay suficientes tickets disponibles")
+        numbers = _pick_free_numbers(bitmap, ticket_range, quantity)
+        for number in numbers:
+            _set_bit(bitmap, number)
+        return numbers, len(numbers)
+    
+    return await _update_ticket_inventory(raffle_id, ticket_range, mutate)
+
+async def release_ticket_numbers(raffle_id: str, ticket_range: int, numbers: List[int]):
+    """Return ticket numbers to the raffle inventory (e.g. when writing the tickets failed)"""
+    def mutate(bitmap: bytearray, allocated_count: int):
+        released = 0
+        for number in set(numbers):
+            if 1 <= number <= ticket_range and _bit_is_set(bitmap, number):
+                _clear_bit(bitmap, number)
+                released += 1
+        return None, -released
+    
+    await _update_ticket_inventory(raffle_id, ticket_range, mutate)
+
+async def claim_ticket_numbers(raffle_id: str, ticket_range: int, numbers: List[int]) -> List[int]:
+    """Atomically take specific ticket numbers, returning the ones that were still free"""
+    def mutate(bitmap: bytearray, allocated_count: int):
+        claimed = []
+        for number in dict.fromkeys(numbers):
+            if 1 <= number <= ticket_range and not _bit_is_set(bitmap, number):
+                _set_bit(bitmap, number)
+                claimed.append(number)
+        return claimed, len(claimed)
+    
+    return await _update_ticket_inventory(raffle_id, ticket_range, mutate)
+
+async def write_tickets(raffle: dict, user_id: str, numbers: List[int], ticket_price: float, **extra_fields) -> List[dict]:
+    """Create all tickets of an order with one ordered insert_many and bump `tickets_sold`.
+    
+    The numbers must already be reserved in the inventory. If the unique
+    (raffle_id, ticket_number) index rejects a ticket, the partial order is
+    removed, the numbers that were not double-sold go back to the inventory and
+    a 409 is raised.
+    """
+    purchased_at = datetime.now(timezone.utc)
+    tickets = []
+    for number in numbers:
+        ticket = Ticket(
+            raffle_id=raffle["id"],
+            user_id=user_id,
+            creator_id=raffle["creator_id"],
+            ticket_number=number,
+            amount=ticket_price,
+            purchased_at=purchased_at
+        )
+        doc = prepare_for_mongo(ticket.model_dump())
+        doc.update(extra_fields)
+        doc["sales_counted"] = True
+        tickets.append(doc)
+    
+    try:
+        await db.tickets.insert_many(tickets, ordered=True)
+    except BulkWriteError as e:
+        taken = {
+            tickets[err["index"]]["ticket_number"]
+            for err in e.details.get("writeErrors", [])
+            if err.get("code") == 11000
+        }
+        logger.error(f"Ticket insert failed for raffle {raffle['id']}, numbers already sold: {sorted(taken)}")
+        await db.tickets.delete_many({"id": {"$in": [t["id"] for t in tickets]}})
+        await release_ticket_numbers(raffle["id"], raffle["ticket_range"], [n for n in numbers if n not in taken])
+        raise HTTPException(status_code=409, detail="Algunos tickets ya fueron vendidos, intenta de nuevo")
+    
+    gross = ticket_price * len(tickets)
+    await db.raffles.update_one(
+        {"id": raffle["id"]},
+        {"$inc": {"tickets_sold": len(tickets), "gross_sales": gross}}
+    )
+    await db.creator_stats.update_one(
+        {"_id": raffle["creator_id"]},
+        {"$inc": {
+            "tickets_sold": len(tickets),
+            "gross": gross,
+            "net": gross * (1 - PLATFORM_COMMISSION / 100)
+        }},
+        upsert=True
+    )
+    await record_metrics(purchased_at, {
+        "tickets_sold": len(tickets),
+        "ticket_revenue": ticket_price * len(tickets)
+    })
+    await publish_event([raffle["creator_id"]], "ticket_sold", {
+        "raffle_id": raffle["id"],
+        "quantity": len(tickets)
+    })
+    
+    for ticket in tickets:
+        ticket.pop("_id", None)
+    return tickets
+
+# ============================================
+# TICKET HOLDS (CHECKOUT RESERVATIONS)
+# ============================================
+
+# A hold reserves specific numbers in the inventory while the buyer pays. The
+# numbers are released by the sweeper job once `expires_at` passes; resolved
+# holds get a `purge_at` date and are removed by a TTL index.
+TICKET_HOLD_MINUTES = int(os.environ.get('TICKET_HOLD_MINUTES', 15))
+TICKET_HOLD_RETENTION = timedelta(hours=24)
+# A capture owns its order while `capturing_since` is younger than the lease;
+# after that the sweeper assumes the worker died and settles the order.
+TICKET_CAPTURE_LEASE_SECONDS = int(os.environ.get('TICKET_CAPTURE_LEASE_SECONDS', 120))
+
+async def create_ticket_hold(raffle: dict, order_id: str, user_id: str, quantity: int) -> dict:
+    """Reserve `quantity` ticket numbers for a pending order"""
+    numbers = await allocate_ticket_numbers(raffle["id"], raffle["ticket_range"], quantity)
+    now = datetime.now(timezone.utc)
+    hold = {
+        "id": str(uuid.uuid4()),
+        "order_id": order_id,
+        "raffle_id": raffle["id"],
+        "user_id": user_id,
+        "ticket_range": raffle["ticket_range"],
+        "ticket_numbers": numbers,
+        "status": "active",
+        "expires_at": now + timedelta(minutes=TICKET_HOLD_MINUTES),
+        "created_at": now.isoformat()
+    }
+    await db.ticket_holds.insert_one(hold)
+    hold.pop("_id", None)
+    return hold
+
+async def convert_ticket_hold(order_id: str) -> Optional[dict]:
+    """Consume the hold of an order, returning it if it had not been released yet"""
+    return await db.ticket_holds.find_one_and_update(
+        {"order_id": order_id, "status": "active"},
+        {"$set": {
+            "status": "converted",
+            "purge_at": datetime.now(timezone.utc) + TICKET_HOLD_RETENTION
+        }},
+        projection={"_id": 0}
+    )
+
+async def sweep_expired_ticket_holds():
+    """Give the numbers of expired holds back to their raffles.
+    
+    Each hold is claimed with find_one_and_update before releasing, so a hold
+    is released at most once even with several sweepers or a racing capture.
+    """
+    now = datetime.now(timezone.utc)
+    released = 0
+    while True:
+        hold = await db.ticket_holds.find_one_and_update(
+            {"status": "active", "expires_at": {"$lte": now}},
+            {"$set": {"status": "expired", "purge_at": now + TICKET_HOLD_RETENTION}},
+            projection={"_id": 0}
+        )
+        if not hold:
+            break
+        await release_ticket_numbers(hold["raffle_id"], hold["ticket_range"], hold["ticket_numbers"])
+        released += 1
+    
+    if released:
+        logger.info(f"Released {released} expired ticket hold(s)")
+    
+    await sweep_stale_ticket_captures()
+
+async def settle_ticket_capture(order: dict):
+    """Finish or roll back a capture that did not complete.
+    
+    If every ticket of the order was written the order is completed; otherwise
+    the partial tickets are removed, the numbers the capture held go back to
+    the raffle and the order returns to pending so the buyer can retry. Each
+    update is fenced on the order's `capturing_since`.
+    """
+    lease = {"id": order["id"], "status": "capturing", "capturing_since": order["capturing_since"]}
+    numbers = order.get("capture_numbers")
+    hold = None
+    if numbers is None:
+        # Crashed between converting the hold and recording its numbers
+        hold = await db.ticket_holds.find_one({"order_id": order["id"], "status": "converted"}, {"_id": 0})
+        numbers = hold["ticket_numbers"] if hold else []
+    
+    written = await db.tickets.count_documents({"order_id": order["id"]})
+    if numbers and written == len(numbers):
+        await db.pending_orders.update_one(lease, {
+            "$set": {"status": "completed", "completed_at": datetime.now(timezone.utc).isoformat(), "ticket_numbers": numbers},
+            "$unset": {"capturing_since": "", "capture_numbers": ""}
+        })
+        return
+    
+    # The insert did not finish, so write_tickets never bumped the counters
+    if written:
+        await db.tickets.delete_many({"order_id": order["id"]})
+    if numbers:
+        raffle = await db.raffles.find_one({"id": order["raffle_id"]}, {"_id": 0, "ticket_range": 1})
+        if raffle:
+            await release_ticket_numbers(order["raffle_id"], raffle["ticket_range"], numbers)
+    if hold:
+        await db.ticket_holds.update_one({"id": hold["id"], "status": "converted"}, {"$set": {"status": "released"}})
+    await db.pending_orders.update_one(lease, {
+        "$set": {"status": "pending"},
+        "$unset": {"capturing_since": "", "capture_numbers": ""}
+    })
+
+async def sweep_stale_ticket_captures():
+    """Settle the orders whose capture outlived its lease"""
+    now = datetime.now(timezone.utc)
+    settled = 0
+    while True:
+        # Taking over the lease keeps a second sweeper off the same order
+        order = await db.pending_orders.find_one_and_update(
+            {"status": "capturing", "capturing_since": {"$lte": now - timedelta(seconds=TICKET_CAPTURE_LEASE_SECONDS)}},
+            {"$set": {"capturing_since": now}},
+            projection={"_id": 0}
+        )
+        if not order:
+            break
+        order["capturing_since"] = now
+        await settle_ticket_capture(order)
+        settled += 1
+    
+    if settled:
+        logger.warning(f"Settled {settled} stale ticket capture(s)")
+
 # Ticket endpoints
 @api_router.post("/tickets/purchase")
 async def purchase_tickets(
@@ -789,43 +1842,12 @@ async def purchase_tickets(
     if raffle_obj.status != RaffleStatus.ACTIVE:
         raise HTTPException(status_code=400, detail="La rifa no está activa")
     
-    # Check if tickets available
-    sold_tickets = await db.tickets.count_documents({"raffle_id": purchase.raffle_id})
-    if sold_tickets + purchase.quantity > raffle_obj.ticket_range:
-        raise HTTPException(status_code=400, detail="No hay suficientes tickets disponibles")
-    
-    # Get existing ticket numbers
-    existing = await db.tickets.find({"raffle_id": purchase.raffle_id}, {"_id": 0, "ticket_number": 1}).to_list(None)
-    used_numbers = set([t['ticket_number'] for t in existing])
-    
-    # Generate random ticket numbers
-    available = [n for n in range(1, raffle_obj.ticket_range + 1) if n not in used_numbers]
-    if len(available) < purchase.quantity:
-        raise HTTPException(status_code=400, detail="No hay suficientes tickets disponibles")
-    
-    selected_numbers = random.sample(available, purchase.quantity)
+    # Reserve random ticket numbers atomically in the raffle inventory
+    selected_numbers = await allocate_ticket_numbers(purchase.raffle_id, raffle_obj.ticket_range, purchase.quantity)
     
     # Create tickets
-    tickets = []
     total_amount = purchase.quantity * raffle_obj.ticket_price
-    
-    for number in selected_numbers:
-        ticket = Ticket(
-            raffle_id=purchase.raffle_id,
-            user_id=current_user.id,
-            creator_id=raffle_obj.creator_id,
-            ticket_number=number,
-            amount=raffle_obj.ticket_price
-        )
-        doc = prepare_for_mongo(ticket.model_dump())
-        await db.tickets.insert_one(doc)
-        tickets.append(ticket)
-    
-    # Update raffle tickets sold
-    await db.raffles.update_one(
-        {"id": purchase.raffle_id},
-        {"$set": {"tickets_sold": sold_tickets + purchase.quantity}}
-    )
+    tickets = await write_tickets(raffle, current_user.id, selected_numbers, raffle_obj.ticket_price)
     
     # Notify user
     await create_notification(
@@ -835,15 +1857,15 @@ async def purchase_tickets(
         "purchase"
     )
     
-    return {"tickets": tickets, "total": total_amount}
+    return {"tickets": [parse_from_mongo(t) for t in tickets], "total": total_amount}
 
 @api_router.get("/tickets/my-tickets", response_model=List[Ticket])
-async def get_my_tickets(current_user: User = Depends(get_current_user)):
+async def get_my_tickets(current_user: TokenPrincipal = Depends(get_token_principal)):
     tickets = await db.tickets.find({"user_id": current_user.id}, {"_id": 0}).to_list(None)
     return [parse_from_mongo(t) for t in tickets]
 
 @api_router.get("/tickets/raffle/{raffle_id}")
-async def get_raffle_tickets(raffle_id: str, current_user: User = Depends(get_current_user)):
+async def get_raffle_tickets(raffle_id: str, current_user: TokenPrincipal = Depends(get_token_principal)):
     tickets = await db.tickets.find({"raffle_id": raffle_id, "user_id": current_user.id}, {"_id": 0}).to_list(None)
     return [parse_from_mongo(t) for t in tickets]
 
@@ -899,38 +1921,120 @@ async def get_creators():
 # Note: Static /users/ routes are defined later to avoid path conflicts
 # See: /users/profile, /users/privacy, /users/blocked, /users/payment-methods, etc.
 
+# Follows are edges in the `follows` collection ({follower_id, following_id})
+# instead of arrays embedded in both user documents, with followers_count and
+# following_count denormalized on the users.
+
+async def _adjust_follow_counts(follower_id: str, following_id: str, delta: int):
+    await db.users.bulk_write([
+        UpdateOne({"id": follower_id}, {"$inc": {"following_count": delta}}),
+        UpdateOne({"id": following_id}, {"$inc": {"followers_count": delta}})
+    ], ordered=False)
+    invalidate_user_caches(follower_id)
+    invalidate_user_caches(following_id)
+
 @api_router.post("/users/{user_id}/follow")
 async def follow_user(user_id: str, current_user: User = Depends(get_current_user)):
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="No puedes seguirte a ti mismo")
     
-    # Add to following
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$addToSet": {"following": user_id}}
-    )
+    if not await db.users.find_one({"id": user_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
-    # Add to followers
-    await db.users.update_one(
-        {"id": user_id},
-        {"$addToSet": {"followers": current_user.id}}
-    )
+    try:
+        await db.follows.insert_one({
+            "id": str(uuid.uuid4()),
+            "follower_id": current_user.id,
+            "following_id": user_id,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+    except DuplicateKeyError:
+        # Already following
+        return {"message": "Siguiendo exitosamente"}
     
+    await _adjust_follow_counts(current_user.id, user_id, 1)
     return {"message": "Siguiendo exitosamente"}
 
 @api_router.post("/users/{user_id}/unfollow")
 async def unfollow_user(user_id: str, current_user: User = Depends(get_current_user)):
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$pull": {"following": user_id}}
-    )
+    result = await db.follows.delete_one({"follower_id": current_user.id, "following_id": user_id})
+    if result.deleted_count:
+        await _adjust_follow_counts(current_user.id, user_id, -1)
     
-    await db.users.update_one(
-        {"id": user_id},
-        {"$pull": {"followers": current_user.id}}
+    return {"message": "Dejaste de seguir"}
+
+@api_router.get("/users/{user_id}/follow-status")
+async def get_follow_status(user_id: str, current_user: TokenPrincipal = Depends(get_token_principal)):
+    follow = await db.follows.find_one({"follower_id": current_user.id, "following_id": user_id}, {"_id": 1})
+    return {"following": follow is not None}
+
+async def _follow_list(query: dict, user_field: str, per_page: int, cursor: Optional[str]) -> dict:
+    follows, next_cursor = await keyset_page(
+        db.follows, query, {"_id": 0}, "created_at", -1, per_page, cursor
     )
+    users = await get_creator_cards(f[user_field] for f in follows)
+    return {
+        "users": [users[f[user_field]] for f in follows if f[user_field] in users],
+        "has_more": next_cursor is not None,
+        "next_cursor": next_cursor
+    }
+
+@api_router.get("/users/{user_id}/followers")
+async def get_followers(user_id: str, per_page: int = 20, cursor: Optional[str] = None):
+    """Get the users following a user, most recent first"""
+    return await _follow_list({"following_id": user_id}, "follower_id", per_page, cursor)
+
+@api_router.get("/users/{user_id}/following")
+async def get_following(user_id: str, per_page: int = 20, cursor: Optional[str] = None):
+    """Get the users a user follows, most recent first"""
+    return await _follow_list({"follower_id": user_id}, "following_id", per_page, cursor)
+
+async def migrate_follow_arrays():
+    """Move the embedded followers/following arrays into follow edges and counts.
     
-    return {"message": "Dejaste de seguir"}
+    A relationship may be recorded on either side only, so both arrays are
+    read; the (follower_id, following_id) upsert key deduplicates them.
+    """
+    users = db.users.find(
+        {"$or": [{"following.0": {"$exists": True}}, {"followers.0": {"$exists": True}}]},
+        {"_id": 0, "id": 1, "following": 1, "followers": 1}
+    )
+    created_at = datetime.now(timezone.utc).isoformat()
+    pairs = set()
+    
+    async def flush():
+        await db.follows.bulk_write([
+            UpdateOne(
+                {"follower_id": follower_id, "following_id": following_id},
+                {"$setOnInsert": {"id": str(uuid.uuid4()), "created_at": created_at}},
+                upsert=True
+            )
+            for follower_id, following_id in pairs
+        ], ordered=False)
+        pairs.clear()
+    
+    async for user in users:
+        pairs.update((user["id"], following_id) for following_id in user.get("following") or [])
+        pairs.update((follower_id, user["id"]) for follower_id in user.get("followers") or [])
+        pairs.difference_update({(user["id"], user["id"])})
+        if len(pairs) >= NOTIFICATION_BATCH_SIZE:
+            await flush()
+    if pairs:
+        await flush()
+    
+    # Counts are recomputed from the edges, then the arrays are dropped
+    await db.users.update_many({}, {"$set": {"followers_count": 0, "following_count": 0}})
+    for field, count_field in (("following_id", "followers_count"), ("follower_id", "following_count")):
+        counts = await db.follows.aggregate([
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}}
+        ], allowDiskUse=True).to_list(None)
+        for chunk in _chunks(counts, NOTIFICATION_BATCH_SIZE):
+            await db.users.bulk_write([
+                UpdateOne({"id": c["_id"]}, {"$set": {count_field: c["count"]}}) for c in chunk
+            ], ordered=False)
+    await db.users.update_many({}, {"$unset": {"followers": "", "following": ""}})
+    principal_cache.clear()
+    creator_card_cache.clear()
 
 @api_router.post("/users/{creator_id}/rate")
 async def rate_creator(
@@ -975,6 +2079,7 @@ async def rate_creator(
         {"id": creator_id},
         {"$set": {"rating": avg_rating, "rating_count": len(ratings)}}
     )
+    invalidate_user_caches(creator_id)
     
     return {"message": "Calificación enviada exitosamente"}
 
@@ -1001,6 +2106,7 @@ async def update_profile(profile_data: UserProfileUpdate, current_user: User = D
             {"id": current_user.id},
             {"$set": update_data}
         )
+        invalidate_user_caches(current_user.id)
     
     updated_user = await db.users.find_one({"id": current_user.id}, {"_id": 0, "password": 0})
     return parse_from_mongo(updated_user)
@@ -1015,6 +2121,7 @@ async def update_privacy_settings(settings: UserPrivacySettings, current_user: U
             {"id": current_user.id},
             {"$set": update_data}
         )
+        invalidate_user_caches(current_user.id)
     
     return {"message": "Configuración actualizada exitosamente"}
 
@@ -1039,6 +2146,7 @@ async def update_paypal_config(config: PayPalConfigUpdate, current_user: User =
         {"id": current_user.id},
         {"$set": {"paypal_email": config.paypal_email}}
     )
+    invalidate_user_caches(current_user.id)
     
     return {"message": "PayPal configurado exitosamente", "paypal_email": config.paypal_email}
 
@@ -1049,10 +2157,11 @@ async def remove_paypal_config(current_user: User = Depends(get_current_user)):
         {"id": current_user.id},
         {"$set": {"paypal_email": None}}
     )
+    invalidate_user_caches(current_user.id)
     return {"message": "Configuración de PayPal eliminada"}
 
 @api_router.get("/users/paypal-config")
-async def get_paypal_config(current_user: User = Depends(get_current_user)):
+async def get_paypal_config(current_user: TokenPrincipal = Depends(get_token_principal)):
     """Get current user's PayPal configuration"""
     user = await db.users.find_one({"id": current_user.id}, {"_id": 0, "paypal_email": 1})
     return {"paypal_email": user.get("paypal_email") if user else None}
@@ -1081,16 +2190,14 @@ async def create_paypal_ticket_order(
     if not creator or not creator.get("paypal_email"):
         raise HTTPException(status_code=400, detail="El creador no tiene PayPal configurado")
     
-    # Check ticket availability
-    sold_tickets = await db.tickets.count_documents({"raffle_id": purchase.raffle_id})
-    if sold_tickets + purchase.quantity > raffle["ticket_range"]:
-        raise HTTPException(status_code=400, detail="No hay suficientes tickets disponibles")
-    
     # Calculate total
     total_amount = raffle["ticket_price"] * purchase.quantity
     
-    # Create pending order in database
+    # Hold the ticket numbers while the buyer pays
     order_id = str(uuid.uuid4())
+    hold = await create_ticket_hold(raffle, order_id, current_user.id, purchase.quantity)
+    
+    # Create pending order in database
     pending_order = {
         "id": order_id,
         "raffle_id": purchase.raffle_id,
@@ -1101,6 +2208,8 @@ async def create_paypal_ticket_order(
         "ticket_price": raffle["ticket_price"],
         "status": "pending",
         "payment_method": "paypal",
+        "ticket_numbers": hold["ticket_numbers"],
+        "hold_expires_at": hold["expires_at"].isoformat(),
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.pending_orders.insert_one(pending_order)
@@ -1111,6 +2220,8 @@ async def create_paypal_ticket_order(
         "raffle_id": purchase.raffle_id,
         "raffle_title": raffle["title"],
         "quantity": purchase.quantity,
+        "ticket_numbers": hold["ticket_numbers"],
+        "hold_expires_at": hold["expires_at"].isoformat(),
         "ticket_price": raffle["ticket_price"],
         "total_amount": total_amount,
         "creator_paypal_email": creator["paypal_email"],
@@ -1134,53 +2245,71 @@ async def capture_paypal_ticket_order(
     if pending_order["user_id"] != current_user.id:
         raise HTTPException(status_code=403, detail="No tienes permiso para esta orden")
     
-    if pending_order["status"] != "pending":
-        raise HTTPException(status_code=400, detail="Esta orden ya fue procesada")
-    
-    # Get raffle
-    raffle = await db.raffles.find_one({"id": pending_order["raffle_id"]}, {"_id": 0})
-    if not raffle:
-        raise HTTPException(status_code=404, detail="Rifa no encontrada")
-    
-    # Get existing ticket numbers
-    existing = await db.tickets.find({"raffle_id": pending_order["raffle_id"]}, {"_id": 0, "ticket_number": 1}).to_list(None)
-    used_numbers = set([t['ticket_number'] for t in existing])
-    
-    # Generate random ticket numbers
-    available = [n for n in range(1, raffle["ticket_range"] + 1) if n not in used_numbers]
-    if len(available) < pending_order["quantity"]:
-        raise HTTPException(status_code=400, detail="No hay suficientes tickets disponibles")
-    
-    selected_numbers = random.sample(available, pending_order["quantity"])
-    
-    # Create tickets
-    tickets = []
-    for number in selected_numbers:
-        ticket = {
-            "id": str(uuid.uuid4()),
-            "raffle_id": pending_order["raffle_id"],
-            "user_id": current_user.id,
-            "creator_id": pending_order["creator_id"],
-            "ticket_number": number,
-            "amount": pending_order["ticket_price"],
-            "payment_method": "paypal",
-            "paypal_order_id": paypal_order_id,
-            "purchased_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.tickets.insert_one(ticket)
-        tickets.append(ticket)
-    
-    # Update raffle tickets sold
-    sold_tickets = await db.tickets.count_documents({"raffle_id": pending_order["raffle_id"]})
-    await db.raffles.update_one(
-        {"id": pending_order["raffle_id"]},
-        {"$set": {"tickets_sold": sold_tickets}}
+    # Claim the order before doing any work so a client retry racing the
+    # redirect (or a second tab) cannot write a second set of tickets
+    capturing_since = datetime.now(timezone.utc)
+    claimed = await db.pending_orders.find_one_and_update(
+        {"id": order_id, "status": "pending"},
+        {"$set": {"status": "capturing", "capturing_since": capturing_since}},
+        projection={"_id": 0}
     )
+    if not claimed:
+        current = await db.pending_orders.find_one({"id": order_id}, {"_id": 0})
+        if current and current["status"] == "completed":
+            return {
+                "success": True,
+                "tickets": current.get("ticket_numbers", []),
+                "total": current["amount"],
+                "message": "Esta orden ya fue procesada"
+            }
+        raise HTTPException(status_code=409, detail="Esta orden ya se está procesando")
+    claimed["capturing_since"] = capturing_since
+    
+    try:
+        # Get raffle
+        raffle = await db.raffles.find_one({"id": pending_order["raffle_id"]}, {"_id": 0})
+        if not raffle:
+            raise HTTPException(status_code=404, detail="Rifa no encontrada")
+        
+        # Use the numbers held for this order; if the hold already expired, assign whatever is still free
+        hold = await convert_ticket_hold(order_id)
+        if hold:
+            selected_numbers = hold["ticket_numbers"]
+        else:
+            selected_numbers = await allocate_ticket_numbers(pending_order["raffle_id"], raffle["ticket_range"], pending_order["quantity"])
+        # Record what the capture holds so a failed or abandoned one can give it back
+        await db.pending_orders.update_one(
+            {"id": order_id, "status": "capturing", "capturing_since": capturing_since},
+            {"$set": {"capture_numbers": selected_numbers}}
+        )
+        claimed["capture_numbers"] = selected_numbers
+        
+        # Create tickets
+        await write_tickets(
+            raffle,
+            current_user.id,
+            selected_numbers,
+            pending_order["ticket_price"],
+            payment_method="paypal",
+            paypal_order_id=paypal_order_id,
+            order_id=order_id
+        )
+    except HTTPException:
+        # Nothing is held: write_tickets already released the numbers on a
+        # conflict. Hand the order back so the capture can be retried
+        await db.pending_orders.update_one(
+            {"id": order_id, "status": "capturing", "capturing_since": capturing_since},
+            {"$set": {"status": "pending"}, "$unset": {"capturing_since": "", "capture_numbers": ""}}
+        )
+        raise
+    except Exception:
+        await settle_ticket_capture(claimed)
+        raise
     
     # Update order status
     await db.pending_orders.update_one(
-        {"id": order_id},
-        {"$set": {
+        {"id": order_id, "status": "capturing", "capturing_since": capturing_since},
+        {"$unset": {"capturing_since": "", "capture_numbers": ""}, "$set": {
             "status": "completed",
             "paypal_order_id": paypal_order_id,
             "completed_at": datetime.now(timezone.utc).isoformat(),
@@ -1236,6 +2365,7 @@ async def block_user(request: BlockUserRequest, current_user: User = Depends(get
         {"id": current_user.id},
         {"$addToSet": {"blocked_users": request.user_id_to_block}}
     )
+    invalidate_user_caches(current_user.id)
     
     return {"message": "Usuario bloqueado exitosamente"}
 
@@ -1246,6 +2376,7 @@ async def unblock_user(user_id: str, current_user: User = Depends(get_current_us
         {"id": current_user.id},
         {"$pull": {"blocked_users": user_id}}
     )
+    invalidate_user_caches(current_user.id)
     
     return {"message": "Usuario desbloqueado exitosamente"}
 
@@ -1284,6 +2415,7 @@ async def add_payment_method(payment_method: PaymentMethod, current_user: User =
         {"id": current_user.id},
         {"$set": {"payment_methods": payment_methods}}
     )
+    invalidate_user_caches(current_user.id)
     
     return {"message": "Método de pago agregado exitosamente"}
 
@@ -1299,12 +2431,13 @@ async def delete_payment_method(index: int, current_user: User = Depends(get_cur
             {"id": current_user.id},
             {"$set": {"payment_methods": payment_methods}}
         )
+        invalidate_user_caches(current_user.id)
         return {"message": "Método de pago eliminado exitosamente"}
     
     raise HTTPException(status_code=404, detail="Método de pago no encontrado")
 
 @api_router.get("/users/payment-methods")
-async def get_payment_methods(current_user: User = Depends(get_current_user)):
+async def get_payment_methods(current_user: TokenPrincipal = Depends(get_token_principal)):
     """Get user's payment methods"""
     user = await db.users.find_one({"id": current_user.id}, {"_id": 0, "payment_methods": 1})
     if not user:
@@ -1334,6 +2467,7 @@ async def upload_profile_image(file: UploadFile = File(...), current_user: User
         {"id": current_user.id},
         {"$set": {"profile_image": image_url}}
     )
+    invalidate_user_caches(current_user.id)
     
     return {"image_url": image_url, "message": "Imagen de perfil actualizada exitosamente"}
 
@@ -1360,6 +2494,7 @@ async def upload_cover_image(file: UploadFile = File(...), current_user: User =
         {"id": current_user.id},
         {"$set": {"cover_image": image_url}}
     )
+    invalidate_user_caches(current_user.id)
     
     return {"image_url": image_url, "message": "Imagen de portada actualizada exitosamente"}
 
@@ -1401,19 +2536,34 @@ async def get_user(user_id: str, current_user: User = Depends(get_current_user))
 
 # Notifications
 @api_router.get("/notifications", response_model=List[Notification])
-async def get_notifications(current_user: User = Depends(get_current_user)):
+async def get_notifications(current_user: TokenPrincipal = Depends(get_token_principal)):
     notifications = await db.notifications.find(
         {"user_id": current_user.id},
         {"_id": 0}
-    ).sort("created_at", -1).to_list(50)
+    ).sort("created_at", -1).limit(50).to_list(50)
     return [parse_from_mongo(n) for n in notifications]
 
+@api_router.get("/notifications/unread-count")
+async def get_unread_notifications_count(current_user: TokenPrincipal = Depends(get_token_principal)):
+    counters = await get_counters(current_user.id)
+    return {"count": counters["unread_notifications"]}
+
+class MarkNotificationsReadRequest(BaseModel):
+    ids: List[str]
+
+@api_router.post("/notifications/read")
+async def mark_many_read(request: MarkNotificationsReadRequest, current_user: TokenPrincipal = Depends(get_token_principal)):
+    updated = await mark_notifications_read(current_user.id, {"id": {"$in": request.ids}})
+    return {"message": "Notificaciones marcadas como leídas", "updated": updated}
+
+@api_router.post("/notifications/read-all")
+async def mark_all_read(current_user: TokenPrincipal = Depends(get_token_principal)):
+    updated = await mark_notifications_read(current_user.id, {})
+    return {"message": "Notificaciones marcadas como leídas", "updated": updated}
+
 @api_router.post("/notifications/{notification_id}/read")
-async def mark_read(notification_id: str, current_user: User = Depends(get_current_user)):
-    await db.notifications.update_one(
-        {"id": notification_id, "user_id": current_user.id},
-        {"$set": {"read": True}}
-    )
+async def mark_read(notification_id: str, current_user: TokenPrincipal = Depends(get_token_principal)):
+    await mark_notifications_read(current_user.id, {"id": notification_id})
     return {"message": "Notificación marcada como leída"}
 
 # Admin endpoints
@@ -1422,104 +2572,434 @@ async def manual_draw(current_user: User = Depends(get_current_user)):
     if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
         raise HTTPException(status_code=403, detail="Solo administradores")
     
-    await run_daily_draw()
-    return {"message": "Sorteo ejecutado"}
+    # Fenced like the scheduled run, so a newer leader's draw wins over this one
+    fencing_token = await scheduler_lease.current_token()
+    if fencing_token is None:
+        raise HTTPException(status_code=503, detail="El programador de sorteos no está disponible, intenta de nuevo")
+    stats = await run_daily_draw(fencing_token=fencing_token)
+    return {"message": "Sorteo ejecutado", "stats": stats}
 
-# Draw function
-async def run_daily_draw():
-    now = datetime.now(timezone.utc)
-    
-    # Get active raffles for today
-    raffles = await db.raffles.find({
-        "status": RaffleStatus.ACTIVE,
-        "raffle_date": {"$lte": now.isoformat()}
-    }, {"_id": 0}).to_list(None)
+# ============================================
+# DAILY DRAW ENGINE
+# ============================================
+
+# Due raffles are drawn in batches: one aggregation resolves the winners and
+# participants of a whole batch, one bulk_write stores the results and the
+# notifications go out with insert_many. Batches run with bounded concurrency.
+#
+# Runs are fenced with the scheduler lease's fencing token: each batch first
+# stamps its raffles with the token (never lowering a newer one) and the
+# result write only matches raffles still stamped with it, so a stale leader
+# cannot write after a newer one has started drawing the same raffles.
+DAILY_DRAW_HOUR = 18
+DRAW_BATCH_SIZE = int(os.environ.get('DRAW_BATCH_SIZE', 50))
+DRAW_CONCURRENCY = int(os.environ.get('DRAW_CONCURRENCY', 4))
+NOTIFICATION_BATCH_SIZE = int(os.environ.get('NOTIFICATION_BATCH_SIZE', 500))
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# Verifiable draw: when a raffle is activated a random seed is generated and
+# only its SHA-256 commitment is published on the raffle. At draw time the
+# seed is revealed and the winning number is
+#   int(HMAC-SHA256(seed, raffle_id)) % ticket_range + 1
+# so anyone can check both the commitment and the result.
+DRAW_ALGORITHM = "hmac-sha256(seed, raffle_id) mod ticket_range + 1"
+
+def draw_commitment(seed: str) -> str:
+    return hashlib.sha256(seed.encode()).hexdigest()
+
+def compute_winning_number(seed: str, raffle_id: str, ticket_range: int) -> int:
+    digest = hmac.new(seed.encode(), raffle_id.encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest, "big") % ticket_range + 1
+
+async def commit_draw_seed(raffle_id: str) -> str:
+    """Generate (once) the secret draw seed of a raffle and publish its commitment"""
+    seed = secrets.token_hex(32)
+    await db.draw_seeds.update_one(
+        {"raffle_id": raffle_id},
+        {"$setOnInsert": {
+            "raffle_id": raffle_id,
+            "seed": seed,
+            "commitment": draw_commitment(seed),
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }},
+        upsert=True
+    )
+    stored = await db.draw_seeds.find_one({"raffle_id": raffle_id}, {"_id": 0})
+    await db.raffles.update_one(
+        {"id": raffle_id},
+        {"$set": {"draw_commitment": stored["commitment"]}}
+    )
+    return stored["commitment"]
+
+async def _load_draw_seeds(raffles: List[dict]) -> dict:
+    seeds = await db.draw_seeds.find(
+        {"raffle_id": {"$in": [r["id"] for r in raffles]}},
+        {"_id": 0, "raffle_id": 1, "seed": 1}
+    ).to_list(None)
+    seeds = {s["raffle_id"]: s["seed"] for s in seeds}
     
-    # Group by ticket range
-    winning_numbers = {
-        100: random.randint(1, 100),
-        300: random.randint(1, 300),
-        500: random.randint(1, 500),
-        1000: random.randint(1, 1000)
-    }
+    # Raffles activated before commitments existed get one at draw time
+    for raffle in raffles:
+        if raffle["id"] not in seeds:
+            await commit_draw_seed(raffle["id"])
+            stored = await db.draw_seeds.find_one({"raffle_id": raffle["id"]}, {"_id": 0, "seed": 1})
+            seeds[raffle["id"]] = stored["seed"]
+    return seeds
+
+async def _resolve_draw_batch(raffles: List[dict]):
+    """Get the winner and the participants of each raffle in a batch.
     
+    Winners come from one query whose $or branches are point lookups on the
+    unique (raffle_id, ticket_number) index; participants from one $group.
+    """
+    winner_tickets = await db.tickets.find(
+        {"$or": [{"raffle_id": r["id"], "ticket_number": r["winning_number"]} for r in raffles]},
+        {"_id": 0, "raffle_id": 1, "user_id": 1}
+    ).to_list(None)
+    winners = {t["raffle_id"]: t["user_id"] for t in winner_tickets}
+    
+    groups = await db.tickets.aggregate([
+        {"$match": {"raffle_id": {"$in": [r["id"] for r in raffles]}}},
+        {"$group": {"_id": "$raffle_id", "user_ids": {"$addToSet": "$user_id"}}}
+    ]).to_list(None)
+    participants = {g["_id"]: g["user_ids"] for g in groups}
+    return winners, participants
+
+async def _draw_batch(raffles: List[dict], stats: dict, fencing_token: Optional[int] = None):
+    started = time.perf_counter()
+    seeds = await _load_draw_seeds(raffles)
     for raffle in raffles:
-        raffle = parse_from_mongo(raffle)
-        raffle_obj = Raffle(**raffle)
-        
-        winning_num = winning_numbers[raffle_obj.ticket_range]
-        
-        # Find winner
-        winner_ticket = await db.tickets.find_one({
-            "raffle_id": raffle_obj.id,
-            "ticket_number": winning_num
-        }, {"_id": 0})
-        
-        winner_id = winner_ticket['user_id'] if winner_ticket else None
-        
-        # Update raffle
-        await db.raffles.update_one(
-            {"id": raffle_obj.id},
+        raffle["winning_number"] = compute_winning_number(seeds[raffle["id"]], raffle["id"], raffle["ticket_range"])
+    winners, participants = await _resolve_draw_batch(raffles)
+    resolved = time.perf_counter()
+    
+    fence = {}
+    if fencing_token is not None:
+        await db.raffles.update_many(
+            {
+                "id": {"$in": [r["id"] for r in raffles]},
+                "status": RaffleStatus.ACTIVE,
+                "draw_fencing_token": {"$not": {"$gt": fencing_token}}
+            },
+            {"$set": {"draw_fencing_token": fencing_token}}
+        )
+        fence = {"draw_fencing_token": fencing_token}
+    
+    drawn_at = datetime.now(timezone.utc).isoformat()
+    await db.raffles.bulk_write([
+        UpdateOne(
+            {"id": raffle["id"], "status": RaffleStatus.ACTIVE, **fence},
             {"$set": {
                 "status": RaffleStatus.COMPLETED,
-                "winning_number": winning_num,
-                "winner_id": winner_id
+                "winning_number": raffle["winning_number"],
+                "winner_id": winners.get(raffle["id"]),
+                "draw_seed": seeds[raffle["id"]],
+                "drawn_at": drawn_at,
+                "draw_run_id": stats["id"]
             }}
         )
-        
-        # Notify participants
-        participants = await db.tickets.find({"raffle_id": raffle_obj.id}, {"_id": 0, "user_id": 1}).to_list(None)
-        unique_users = list(set([p['user_id'] for p in participants]))
-        
-        for user_id in unique_users:
-            if winner_id and user_id == winner_id:
-                await create_notification(
+        for raffle in raffles
+    ], ordered=False)
+    
+    # Only raffles this run moved to completed are announced; an overlapping
+    # run that lost the status guard must not send a second, conflicting result
+    completed = set(await db.raffles.distinct(
+        "id", {"id": {"$in": [r["id"] for r in raffles]}, "draw_run_id": stats["id"]}
+    ))
+    raffles = [raffle for raffle in raffles if raffle["id"] in completed]
+    winners = {raffle_id: user_id for raffle_id, user_id in winners.items() if raffle_id in completed}
+    await timeline_remove("raffle", [raffle["id"] for raffle in raffles])
+    written = time.perf_counter()
+    
+    notifications = []
+    for raffle in raffles:
+        winning_num = raffle["winning_number"]
+        winner_id = winners.get(raffle["id"])
+        for user_id in participants.get(raffle["id"], []):
+            if user_id == winner_id:
+                notifications.append(build_notification(
                     user_id,
                     "¡Ganaste!",
-                    f"¡Felicidades! Ganaste la rifa '{raffle_obj.title}' con el número {winning_num}",
+                    f"¡Felicidades! Ganaste la rifa '{raffle['title']}' con el número {winning_num}",
                     "winner"
-                )
+                ))
             else:
-                await create_notification(
+                notifications.append(build_notification(
                     user_id,
                     "Resultados del Sorteo",
-                    f"El número ganador de '{raffle_obj.title}' fue {winning_num}",
+                    f"El número ganador de '{raffle['title']}' fue {winning_num}",
                     "draw_result"
-                )
-        
-        # Notify creator
-        await create_notification(
-            raffle_obj.creator_id,
+                ))
+        notifications.append(build_notification(
+            raffle["creator_id"],
             "Rifa Completada",
-            f"Tu rifa '{raffle_obj.title}' ha finalizado. Número ganador: {winning_num}",
+            f"Tu rifa '{raffle['title']}' ha finalizado. Número ganador: {winning_num}",
             "raffle_completed"
+        ))
+    for chunk in _chunks(notifications, NOTIFICATION_BATCH_SIZE):
+        await insert_notifications(chunk)
+    await publish_events([
+        {
+            "user_ids": [*participants.get(raffle["id"], []), raffle["creator_id"]],
+            "type": "draw_result",
+            "data": {
+                "raffle_id": raffle["id"],
+                "winning_number": raffle["winning_number"],
+                "winner_id": winners.get(raffle["id"])
+            }
+        }
+        for raffle in raffles
+    ])
+    notified = time.perf_counter()
+    
+    stats["raffles_drawn"] += len(raffles)
+    stats["winners"] += len(winners)
+    stats["notifications"] += len(notifications)
+    stats["resolve_ms"] += round((resolved - started) * 1000, 1)
+    stats["write_ms"] += round((written - resolved) * 1000, 1)
+    stats["notify_ms"] += round((notified - written) * 1000, 1)
+
+def last_draw_slot(now: datetime) -> datetime:
+    """The most recent scheduled draw time at or before `now`"""
+    slot = now.replace(hour=DAILY_DRAW_HOUR, minute=0, second=0, microsecond=0)
+    if slot > now:
+        slot -= timedelta(days=1)
+    return slot
+
+async def catch_up_daily_draw(fencing_token: int):
+    """Run the last scheduled draw if it was missed (e.g. during a leader failover).
+    
+    The catch-up only draws raffles due by the missed slot's time, never ones
+    whose date came after it. Without any recorded run (first deploy) the
+    current slot is taken as done instead of firing a draw.
+    """
+    slot = last_draw_slot(datetime.now(timezone.utc))
+    state = await db.scheduler_state.find_one_and_update(
+        {"_id": "daily_draw"},
+        {"$setOnInsert": {"last_completed_slot": slot.date().isoformat()}},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    if state is None:
+        return
+    if state.get("last_completed_slot", "") < slot.date().isoformat():
+        logger.warning(f"Daily draw for {slot.date().isoformat()} was missed, running it now")
+        await run_daily_draw(fencing_token=fencing_token, cutoff=slot)
+
+async def run_daily_draw(fencing_token: Optional[int] = None, cutoff: Optional[datetime] = None):
+    """Draw every active raffle whose date has passed and record the run's timing stats.
+    
+    Scheduled and manual runs pass the scheduler lease's fencing token so a
+    worker that lost leadership mid-run cannot write results. `cutoff`
+    (default now) is the time raffles must be due by.
+    """
+    now = datetime.now(timezone.utc)
+    cutoff = cutoff or now
+    started = time.perf_counter()
+    
+    raffles = await db.raffles.find(
+        {"status": RaffleStatus.ACTIVE, "raffle_date": {"$lte": cutoff.isoformat()}},
+        {"_id": 0, "id": 1, "title": 1, "creator_id": 1, "ticket_range": 1}
+    ).to_list(None)
+    
+    stats = {
+        "id": str(uuid.uuid4()),
+        "worker_id": WORKER_ID,
+        "fencing_token": fencing_token,
+        "started_at": now.isoformat(),
+        "cutoff": cutoff.isoformat(),
+        "due_raffles": len(raffles),
+        "batches": 0,
+        "raffles_drawn": 0,
+        "winners": 0,
+        "notifications": 0,
+        "fetch_ms": round((time.perf_counter() - started) * 1000, 1),
+        "resolve_ms": 0,
+        "write_ms": 0,
+        "notify_ms": 0,
+        "failed_batches": 0
+    }
+    
+    semaphore = asyncio.Semaphore(DRAW_CONCURRENCY)
+    
+    async def run_batch(batch):
+        async with semaphore:
+            try:
+                await _draw_batch(batch, stats, fencing_token)
+                stats["batches"] += 1
+            except Exception as e:
+                stats["failed_batches"] += 1
+                logger.error(f"Draw batch failed ({len(batch)} raffles): {type(e).__name__}: {e}")
+    
+    await asyncio.gather(*(run_batch(batch) for batch in _chunks(raffles, DRAW_BATCH_SIZE)))
+    
+    stats["finished_at"] = datetime.now(timezone.utc).isoformat()
+    stats["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    await db.draw_runs.insert_one(stats)
+    stats.pop("_id", None)
+    if not stats["failed_batches"]:
+        await db.scheduler_state.update_one(
+            {"_id": "daily_draw"},
+            {"$max": {"last_completed_slot": last_draw_slot(cutoff).date().isoformat()}, "$set": {"completed_at": stats["finished_at"]}},
+            upsert=True
         )
+    logger.info(f"Daily draw finished: {stats['raffles_drawn']}/{stats['due_raffles']} raffles in {stats['duration_ms']}ms")
+    return stats
 
 # Dashboard stats
+# Sales totals per creator live in `creator_stats` ({_id: creator_id,
+# tickets_sold, gross, net}) and per raffle in `raffles.gross_sales`, both
+# bumped by write_tickets, so the dashboard never loads ticket documents.
+# Tickets counted live carry `sales_counted: True`; the sales_counters
+# migration adds every ticket without it (sold before the counters existed,
+# or by a worker still on the old release) with $inc. Until it completes,
+# deletes only take counted tickets off the counters.
+_sales_counters_ready = False
+
+async def sales_counters_ready() -> bool:
+    """Whether the backfill has folded pre-counter sales into the counters"""
+    global _sales_counters_ready
+    if not _sales_counters_ready:
+        _sales_counters_ready = await db.schema_migrations.find_one(
+            {"_id": "sales_counters", "completed_at": {"$exists": True}}, {"_id": 1}
+        ) is not None
+    return _sales_counters_ready
+
+async def compute_creator_sales(creator_id: str) -> dict:
+    """Sum a creator's sales from the tickets themselves"""
+    totals = await db.tickets.aggregate([
+        {"$match": {"creator_id": creator_id}},
+        {"$group": {"_id": None, "tickets_sold": {"$sum": 1}, "gross": {"$sum": "$amount"}}}
+    ]).to_list(1)
+    tickets_sold = totals[0]["tickets_sold"] if totals else 0
+    gross = totals[0]["gross"] if totals else 0
+    return {"tickets_sold": tickets_sold, "gross": gross, "net": gross * (1 - PLATFORM_COMMISSION / 100)}
+
+async def backfill_sales_counters():
+    """Add the sales made before live counting started to creator_stats and raffles.gross_sales.
+    
+    Each document is folded in once (guarded by `sales_backfilled`), so a
+    re-run after a crash does not count twice.
+    """
+    def totals_by(field: str):
+        return db.tickets.aggregate([
+            {"$match": {"sales_counted": {"$ne": True}}},
+            {"$group": {"_id": f"${field}", "tickets_sold": {"$sum": 1}, "gross": {"$sum": "$amount"}}}
+        ], allowDiskUse=True).to_list(None)
+    
+    for chunk in _chunks(await totals_by("creator_id"), NOTIFICATION_BATCH_SIZE):
+        await db.creator_stats.bulk_write([
+            UpdateOne({"_id": t["_id"]}, {"$setOnInsert": {"tickets_sold": 0, "gross": 0, "net": 0}}, upsert=True)
+            for t in chunk
+        ], ordered=False)
+        await db.creator_stats.bulk_write([
+            UpdateOne({"_id": t["_id"], "sales_backfilled": {"$ne": True}}, {
+                "$inc": {
+                    "tickets_sold": t["tickets_sold"],
+                    "gross": t["gross"],
+                    "net": t["gross"] * (1 - PLATFORM_COMMISSION / 100)
+                },
+                "$set": {"sales_backfilled": True}
+            })
+            for t in chunk
+        ], ordered=False)
+    
+    for chunk in _chunks(await totals_by("raffle_id"), NOTIFICATION_BATCH_SIZE):
+        await db.raffles.bulk_write([
+            UpdateOne(
+                {"id": t["_id"], "sales_backfilled": {"$ne": True}},
+                {"$inc": {"gross_sales": t["gross"]}, "$set": {"sales_backfilled": True}}
+            )
+            for t in chunk
+        ], ordered=False)
+
+async def delete_tickets(query: dict) -> int:
+    """Delete tickets, taking their sales off the raffle and creator counters.
+    
+    Before the sales_counters backfill completes, tickets it has not folded in
+    yet (no `sales_counted`) only come off `tickets_sold`: they were never
+    added to the sales counters, and once deleted the backfill won't add them.
+    """
+    counters_ready = await sales_counters_ready()
+    groups = await db.tickets.aggregate([
+        {"$match": query},
+        {"$group": {
+            "_id": {
+                "raffle_id": "$raffle_id",
+                "creator_id": "$creator_id",
+                "counted": {"$eq": ["$sales_counted", True]}
+            },
+            "count": {"$sum": 1},
+            "gross": {"$sum": "$amount"}
+        }}
+    ]).to_list(None)
+    result = await db.tickets.delete_many(query)
+    if groups:
+        await db.raffles.bulk_write([
+            UpdateOne({"id": g["_id"]["raffle_id"]}, {"$inc": {"tickets_sold": -g["count"]}})
+            for g in groups
+        ], ordered=False)
+    sold = [g for g in groups if counters_ready or g["_id"]["counted"]]
+    if sold:
+        await db.raffles.bulk_write([
+            UpdateOne({"id": g["_id"]["raffle_id"]}, {"$inc": {"gross_sales": -g["gross"]}})
+            for g in sold
+        ], ordered=False)
+        await db.creator_stats.bulk_write([
+            UpdateOne({"_id": g["_id"]["creator_id"]}, {"$inc": {
+                "tickets_sold": -g["count"],
+                "gross": -g["gross"],
+                "net": -g["gross"] * (1 - PLATFORM_COMMISSION / 100)
+            }})
+            for g in sold
+        ], ordered=False)
+    return result.deleted_count
+
 @api_router.get("/dashboard/creator-stats")
-async def get_creator_stats(current_user: User = Depends(get_current_user)):
+async def get_creator_stats(breakdown: bool = False, current_user: User = Depends(get_current_user)):
     if current_user.role not in [UserRole.CREATOR, UserRole.ADMIN, UserRole.SUPER_ADMIN]:
         raise HTTPException(status_code=403, detail="Solo creadores")
     
-    raffles = await db.raffles.find({"creator_id": current_user.id}, {"_id": 0}).to_list(None)
-    tickets = await db.tickets.find({"creator_id": current_user.id}, {"_id": 0}).to_list(None)
-    
-    total_earnings = sum([t['amount'] for t in tickets])
-    commission = total_earnings * 0.01
-    net_earnings = total_earnings - commission
-    
-    active_raffles = len([r for r in raffles if r['status'] == RaffleStatus.ACTIVE])
-    completed_raffles = len([r for r in raffles if r['status'] == RaffleStatus.COMPLETED])
-    
-    return {
-        "total_raffles": len(raffles),
-        "active_raffles": active_raffles,
-        "completed_raffles": completed_raffles,
-        "total_tickets_sold": len(tickets),
+    statuses, sales = await asyncio.gather(
+        db.raffles.aggregate([
+            {"$match": {"creator_id": current_user.id}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(None),
+        db.creator_stats.find_one({"_id": current_user.id})
+    )
+    counters_ready = await sales_counters_ready()
+    if sales is None or not counters_ready:
+        # Counters not backfilled yet: fall back to a $group over their tickets
+        sales = await compute_creator_sales(current_user.id)
+    
+    by_status = {group["_id"]: group["count"] for group in statuses}
+    total_earnings = sales.get("gross", 0)
+    
+    stats = {
+        "total_raffles": sum(by_status.values()),
+        "active_raffles": by_status.get(RaffleStatus.ACTIVE, 0),
+        "completed_raffles": by_status.get(RaffleStatus.COMPLETED, 0),
+        "total_tickets_sold": sales.get("tickets_sold", 0),
         "total_earnings": total_earnings,
-        "commission": commission,
-        "net_earnings": net_earnings
+        "commission": total_earnings - sales.get("net", 0),
+        "net_earnings": sales.get("net", 0)
     }
+    
+    if breakdown:
+        raffles = await db.raffles.find(
+            {"creator_id": current_user.id},
+            {"_id": 0, "id": 1, "title": 1, "status": 1, "ticket_price": 1, "ticket_range": 1, "tickets_sold": 1, "gross_sales": 1}
+        ).sort("created_at", -1).to_list(None)
+        for raffle in raffles:
+            if not counters_ready or "gross_sales" not in raffle:
+                raffle["gross_sales"] = raffle.get("tickets_sold", 0) * raffle.get("ticket_price", 0)
+            raffle["net_sales"] = raffle["gross_sales"] * (1 - PLATFORM_COMMISSION / 100)
+        stats["raffles"] = raffles
+    
+    return stats
 
 @api_router.get("/dashboard/admin-stats")
 async def get_admin_stats(current_user: User = Depends(get_current_user)):
@@ -1531,9 +3011,11 @@ async def get_admin_stats(current_user: User = Depends(get_current_user)):
     total_raffles = await db.raffles.count_documents({})
     active_raffles = await db.raffles.count_documents({"status": "active"})
     
-    tickets = await db.tickets.find({}, {"_id": 0, "amount_paid": 1}).to_list(None)
-    total_revenue = sum([t.get('amount_paid', 0) for t in tickets])
-    commission_revenue = total_revenue * 0.01
+    totals = await db.daily_metrics.aggregate([
+        {"$group": {"_id": None, "ticket_revenue": {"$sum": "$ticket_revenue"}}}
+    ]).to_list(1)
+    total_revenue = totals[0]["ticket_revenue"] if totals else 0
+    commission_revenue = total_revenue * PLATFORM_COMMISSION / 100
     
     return {
         "total_users": total_users,
@@ -1545,65 +3027,87 @@ async def get_admin_stats(current_user: User = Depends(get_current_user)):
     }
 
 # New Admin Endpoints
+COMMISSION_EXPORT_FIELDS = ["creator_id", "creator_name", "tickets_count", "total_sales", "commission"]
+
+def parse_date_bound(value: str) -> str:
+    """Normalize a client date/datetime to the UTC ISO string format tickets are stored in"""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Fecha inválida: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
 @api_router.get("/admin/commissions")
 async def get_commissions(
     creator_id: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    format: str = "json",  # json, csv, ndjson
     current_user: User = Depends(get_current_user)
 ):
+    """Commissions per creator over an optional purchase date range.
+    
+    `format=csv` or `format=ndjson` streams the rows as a file export.
+    """
     if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
         raise HTTPException(status_code=403, detail="Solo administradores")
+    if format not in ("json", "csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Formato inválido")
     
     query = {}
     if creator_id:
         query["creator_id"] = creator_id
-    
-    tickets = await db.tickets.find(query, {"_id": 0}).to_list(None)
-    
-    # Filter by date if provided
     if start_date or end_date:
-        filtered_tickets = []
-        for ticket in tickets:
-            ticket = parse_from_mongo(ticket)
-            ticket_date = ticket['purchased_at']
-            
-            if start_date:
-                start = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-                if ticket_date < start:
-                    continue
-            
-            if end_date:
-                end = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-                if ticket_date > end:
-                    continue
-            
-            filtered_tickets.append(ticket)
-        tickets = filtered_tickets
+        query["purchased_at"] = {}
+        if start_date:
+            query["purchased_at"]["$gte"] = parse_date_bound(start_date)
+        if end_date:
+            query["purchased_at"]["$lte"] = parse_date_bound(end_date)
     
-    # Group by creator
-    commissions_by_creator = {}
-    for ticket in tickets:
-        creator_id = ticket['creator_id']
-        if creator_id not in commissions_by_creator:
-            commissions_by_creator[creator_id] = {
-                "creator_id": creator_id,
-                "total_sales": 0,
-                "commission": 0,
-                "tickets_count": 0
-            }
-        
-        commissions_by_creator[creator_id]["total_sales"] += ticket['amount']
-        commissions_by_creator[creator_id]["commission"] += ticket['amount'] * 0.01
-        commissions_by_creator[creator_id]["tickets_count"] += 1
+    # Match on the indexed purchase range, group per creator and join names in one pass
+    pipeline = [
+        {"$match": query},
+        {"$group": {"_id": "$creator_id", "total_sales": {"$sum": "$amount"}, "tickets_count": {"$sum": 1}}},
+        {"$lookup": {
+            "from": "users",
+            "localField": "_id",
+            "foreignField": "id",
+            "pipeline": [{"$project": {"_id": 0, "full_name": 1}}],
+            "as": "creator"
+        }},
+        {"$project": {
+            "_id": 0,
+            "creator_id": "$_id",
+            "creator_name": {"$first": "$creator.full_name"},
+            "tickets_count": 1,
+            "total_sales": 1,
+            "commission": {"$multiply": ["$total_sales", PLATFORM_COMMISSION / 100]}
+        }},
+        {"$sort": {"total_sales": -1}}
+    ]
     
-    # Get creator names
-    for commission in commissions_by_creator.values():
-        creator = await db.users.find_one({"id": commission["creator_id"]}, {"_id": 0, "full_name": 1})
-        if creator:
-            commission["creator_name"] = creator["full_name"]
+    if format == "json":
+        return await db.tickets.aggregate(pipeline, allowDiskUse=True).to_list(None)
+    
+    async def export():
+        if format == "csv":
+            yield ",".join(COMMISSION_EXPORT_FIELDS) + "\r\n"
+        async for row in db.tickets.aggregate(pipeline, allowDiskUse=True):
+            if format == "csv":
+                buffer = io.StringIO()
+                csv.writer(buffer).writerow([row.get(field, "") for field in COMMISSION_EXPORT_FIELDS])
+                yield buffer.getvalue()
+            else:
+                yield json.dumps(row) + "\n"
     
-    return list(commissions_by_creator.values())
+    filename = f"commissions_{datetime.now(timezone.utc).strftime('%Y%m%d')}.{format}"
+    return StreamingResponse(
+        export(),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @api_router.post("/admin/users/{user_id}/toggle-active")
 async def toggle_user_active(user_id: str, current_user: User = Depends(get_current_user)):
@@ -1619,6 +3123,11 @@ async def toggle_user_active(user_id: str, current_user: User = Depends(get_curr
         {"id": user_id},
         {"$set": {"is_active": new_status}}
     )
+    invalidate_user_caches(user_id)
+    if new_status:
+        await rebuild_timeline(creator_id=user_id)
+    else:
+        await timeline_remove_creator(user_id)
     
     return {"message": f"Usuario {'activado' if new_status else 'desactivado'}", "is_active": new_status}
 
@@ -1629,19 +3138,73 @@ async def delete_user(user_id: str, current_user: User = Depends(get_current_use
     
     # Delete user's raffles, tickets, ratings, notifications, messages
     await db.raffles.delete_many({"creator_id": user_id})
-    await db.tickets.delete_many({"user_id": user_id})
+    await timeline_remove_creator(user_id)
+    await delete_tickets({"user_id": user_id})
     await db.ratings.delete_many({"user_id": user_id})
     await db.notifications.delete_many({"user_id": user_id})
+    unread_sent = await db.messages.aggregate([
+        {"$match": {"from_user_id": user_id, "read": False, "counted": True}},
+        {"$group": {"_id": "$to_user_id", "count": {"$sum": 1}}}
+    ]).to_list(None)
     await db.messages.delete_many({"$or": [{"from_user_id": user_id}, {"to_user_id": user_id}]})
+    await adjust_counters("unread_messages", {m["_id"]: -m["count"] for m in unread_sent})
+    await db.conversations.delete_many({"$or": [{"owner_id": user_id}, {"other_user_id": user_id}]})
+    await db.user_counters.delete_one({"_id": user_id})
+    await db.creator_stats.delete_one({"_id": user_id})
+    
+    # Drop the user's follow edges and the counts they contributed to
+    following_ids = await db.follows.distinct("following_id", {"follower_id": user_id})
+    follower_ids = await db.follows.distinct("follower_id", {"following_id": user_id})
+    await db.follows.delete_many({"$or": [{"follower_id": user_id}, {"following_id": user_id}]})
+    await db.users.update_many({"id": {"$in": following_ids}}, {"$inc": {"followers_count": -1}})
+    await db.users.update_many({"id": {"$in": follower_ids}}, {"$inc": {"following_count": -1}})
+    for other_id in following_ids + follower_ids:
+        invalidate_user_caches(other_id)
     
     # Delete user
     result = await db.users.delete_one({"id": user_id})
+    invalidate_user_caches(user_id)
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
     return {"message": "Usuario eliminado exitosamente"}
 
+@api_router.get("/admin/metrics/password-hashing")
+async def get_password_hashing_metrics(current_user: User = Depends(get_current_user)):
+    """Get queue depth and throughput of the password hashing pool"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    
+    return password_hasher.stats()
+
+@api_router.get("/admin/fanout-jobs")
+async def get_fanout_jobs(
+    status: Optional[str] = None,
+    limit: int = 50,
+    current_user: User = Depends(get_current_user)
+):
+    """Get the most recent follower notification fan-out jobs and their progress"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    
+    limit = max(1, min(limit, FANOUT_JOBS_MAX_LIMIT))
+    query = {}
+    if status:
+        query["status"] = status
+    
+    jobs = await db.fanout_jobs.find(query, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+    return jobs
+
+@api_router.get("/admin/draw-runs")
+async def get_draw_runs(limit: int = 30, current_user: User = Depends(get_current_user)):
+    """Get timing stats of the most recent draw runs"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    
+    runs = await db.draw_runs.find({}, {"_id": 0}).sort("started_at", -1).limit(limit).to_list(limit)
+    return runs
+
 @api_router.get("/admin/creator/{creator_id}/raffles-count")
 async def get_creator_raffles_count(creator_id: str):
     count = await db.raffles.count_documents({"creator_id": creator_id})
@@ -1665,6 +3228,7 @@ async def get_admin_creators(
     sort_order: str = "desc",
     page: int = 1,
     per_page: int = 10,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     """Get all creators with search, filter and pagination"""
@@ -1688,22 +3252,22 @@ async def get_admin_creators(
     sort_direction = -1 if sort_order == "desc" else 1
     
     # Get paginated results
-    skip = (page - 1) * per_page
-    creators_cursor = db.users.find(query, {"_id": 0, "password": 0}).sort(sort_field, sort_direction).skip(skip).limit(per_page)
-    creators = await creators_cursor.to_list(per_page)
+    creators, next_cursor = await keyset_page(
+        db.users, query, {"_id": 0, "password": 0}, sort_field, sort_direction, per_page, cursor, page
+    )
     
     # Add raffle counts for each creator
     for creator in creators:
         creator["total_raffles"] = await db.raffles.count_documents({"creator_id": creator["id"]})
         creator["active_raffles"] = await db.raffles.count_documents({"creator_id": creator["id"], "status": "active"})
-        creator["followers_count"] = len(creator.get("followers", []))
     
     return {
         "data": [parse_from_mongo(c) for c in creators],
         "total": total,
         "page": page,
         "per_page": per_page,
-        "total_pages": (total + per_page - 1) // per_page
+        "total_pages": (total + per_page - 1) // per_page,
+        "next_cursor": next_cursor
     }
 
 @api_router.get("/admin/raffles")
@@ -1716,6 +3280,7 @@ async def get_admin_raffles(
     max_value: Optional[float] = None,
     page: int = 1,
     per_page: int = 10,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     """Get all raffles with search, filter and pagination"""
@@ -1749,16 +3314,17 @@ async def get_admin_raffles(
     sort_direction = -1 if sort_order == "desc" else 1
     
     # Get paginated results
-    skip = (page - 1) * per_page
-    raffles_cursor = db.raffles.find(query, {"_id": 0}).sort(sort_field, sort_direction).skip(skip).limit(per_page)
-    raffles = await raffles_cursor.to_list(per_page)
+    raffles, next_cursor = await keyset_page(
+        db.raffles, query, {"_id": 0}, sort_field, sort_direction, per_page, cursor, page
+    )
     
     return {
         "data": [parse_from_mongo(r) for r in raffles],
         "total": total,
         "page": page,
         "per_page": per_page,
-        "total_pages": (total + per_page - 1) // per_page
+        "total_pages": (total + per_page - 1) // per_page,
+        "next_cursor": next_cursor
     }
 
 @api_router.get("/admin/raffles/calendar")
@@ -1822,18 +3388,16 @@ async def suspend_user(
         update_data["suspended_until"] = None  # Permanent
     
     await db.users.update_one({"id": user_id}, {"$set": update_data})
+    invalidate_user_caches(user_id)
+    await timeline_remove_creator(user_id)
     
     # Create notification for user
-    notification = {
-        "id": str(uuid.uuid4()),
-        "user_id": user_id,
-        "type": "account_suspended",
-        "title": "Cuenta Suspendida",
-        "message": f"Tu cuenta ha sido suspendida. Razón: {request.reason}",
-        "read": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.notifications.insert_one(notification)
+    await create_notification(
+        user_id,
+        "Cuenta Suspendida",
+        f"Tu cuenta ha sido suspendida. Razón: {request.reason}",
+        "account_suspended"
+    )
     
     return {"message": "Usuario suspendido exitosamente"}
 
@@ -1851,9 +3415,146 @@ async def unsuspend_user(user_id: str, current_user: User = Depends(get_current_
             "suspension_reason": None
         }}
     )
+    invalidate_user_caches(user_id)
+    await rebuild_timeline(creator_id=user_id)
     
     return {"message": "Suspensión removida exitosamente"}
 
+# ============================================
+# DAILY METRICS ROLLUP
+# ============================================
+
+# Admin dashboards read `daily_metrics`, one row per UTC day ({_id: "YYYY-MM-DD"})
+# holding registrations, ticket sales and creation fees. Rows are bumped with
+# $inc as events happen and the last METRICS_RECONCILE_DAYS are recomputed
+# from the raw collections every night, which also corrects anything the
+# incremental path missed (e.g. role changes after registration).
+METRICS_RECONCILE_DAYS = int(os.environ.get('METRICS_RECONCILE_DAYS', 35))
+FEE_TIERS = (1, 2, 3, 5, 10)
+
+# Tickets store `amount`; very old ones carried `amount_paid`
+TICKET_AMOUNT_EXPR = {"$ifNull": ["$amount", {"$ifNull": ["$amount_paid", 0]}]}
+
+def day_bucket(field: str) -> dict:
+    """Aggregation expression for the UTC day ("YYYY-MM-DD") of a date field.
+    
+    The field may hold an ISO string or a BSON date (seeded users, for one).
+    """
+    return {"$dateToString": {
+        "format": "%Y-%m-%d",
+        "date": {"$dateTrunc": {"date": {"$toDate": f"${field}"}, "unit": "day"}}
+    }}
+
+def _empty_metrics(day: str) -> dict:
+    return {
+        "_id": day,
+        "registrations": 0,
+        "creator_registrations": 0,
+        "tickets_sold": 0,
+        "ticket_revenue": 0,
+        "fee_count": 0,
+        "fee_total": 0,
+        "fee_tiers": {}
+    }
+
+def metrics_day(at) -> str:
+    """UTC day ("YYYY-MM-DD") of a datetime or ISO string, naive values being UTC"""
+    if not isinstance(at, datetime):
+        at = datetime.fromisoformat(at.replace('Z', '+00:00'))
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc)
+    return at.strftime("%Y-%m-%d")
+
+async def record_metrics(at, increments: dict):
+    """Add to the rollup row of the UTC day `at` (datetime or ISO string) falls on"""
+    day = metrics_day(at)
+    await db.daily_metrics.update_one(
+        {"_id": day},
+        {"$inc": increments, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+def fee_metrics(amount: float) -> dict:
+    increments = {"fee_count": 1, "fee_total": amount}
+    if amount in FEE_TIERS:
+        increments[f"fee_tiers.{int(amount)}"] = amount
+    return increments
+
+async def rebuild_daily_metrics(since: Optional[datetime] = None):
+    """Recompute rollup rows from the raw collections, for every day or from `since` on"""
+    since_day = since.strftime("%Y-%m-%d") if since else None
+    
+    def match(field: str, query: Optional[dict] = None) -> dict:
+        # Range queries only compare within a BSON type, so strings and dates
+        # each get their own bound
+        query = dict(query or {})
+        if since_day:
+            query["$or"] = [{field: {"$gte": since_day}}, {field: {"$gte": since}}]
+        else:
+            query[field] = {"$type": ["string", "date"]}
+        return {"$match": query}
+    
+    registrations, sales, fees = await asyncio.gather(
+        db.users.aggregate([
+            match("created_at"),
+            {"$group": {
+                "_id": day_bucket("created_at"),
+                "registrations": {"$sum": 1},
+                "creator_registrations": {"$sum": {"$cond": [{"$eq": ["$role", "creator"]}, 1, 0]}}
+            }}
+        ], allowDiskUse=True).to_list(None),
+        db.tickets.aggregate([
+            match("purchased_at"),
+            {"$group": {
+                "_id": day_bucket("purchased_at"),
+                "tickets_sold": {"$sum": 1},
+                "ticket_revenue": {"$sum": TICKET_AMOUNT_EXPR}
+            }}
+        ], allowDiskUse=True).to_list(None),
+        db.fee_payments.aggregate([
+            match("completed_at", {"status": "completed", "type": "creation_fee"}),
+            {"$group": {
+                "_id": {"day": day_bucket("completed_at"), "amount": "$amount"},
+                "count": {"$sum": 1},
+                "total": {"$sum": "$amount"}
+            }}
+        ], allowDiskUse=True).to_list(None)
+    )
+    
+    rows = {}
+    for group in registrations + sales:
+        row = rows.setdefault(group["_id"], _empty_metrics(group["_id"]))
+        row.update({k: v for k, v in group.items() if k != "_id"})
+    for group in fees:
+        row = rows.setdefault(group["_id"]["day"], _empty_metrics(group["_id"]["day"]))
+        row["fee_count"] += group["count"]
+        row["fee_total"] += group["total"]
+        if group["_id"]["amount"] in FEE_TIERS:
+            row["fee_tiers"][str(int(group["_id"]["amount"]))] = group["total"]
+    
+    updated_at = datetime.now(timezone.utc)
+    for chunk in _chunks(list(rows.values()), NOTIFICATION_BATCH_SIZE):
+        await db.daily_metrics.bulk_write([
+            ReplaceOne({"_id": row["_id"]}, {**row, "updated_at": updated_at}, upsert=True) for row in chunk
+        ], ordered=False)
+    
+    # Days in the range with nothing left in the raw data
+    stale = {"_id": {"$nin": list(rows)}}
+    if since_day:
+        stale["_id"]["$gte"] = since_day
+    await db.daily_metrics.delete_many(stale)
+    return len(rows)
+
+async def reconcile_daily_metrics():
+    since = datetime.now(timezone.utc) - timedelta(days=METRICS_RECONCILE_DAYS)
+    days = await rebuild_daily_metrics(since.replace(hour=0, minute=0, second=0, microsecond=0))
+    logger.info(f"Daily metrics reconciled: {days} days since {since.date()}")
+
+async def load_daily_metrics(since: Optional[datetime] = None) -> List[dict]:
+    """Rollup rows from the UTC day of `since` on (all of them if None), oldest first"""
+    query = {"_id": {"$gte": since.strftime("%Y-%m-%d")}} if since else {}
+    return await db.daily_metrics.find(query).sort("_id", 1).to_list(None)
+
 @api_router.get("/admin/statistics")
 async def get_admin_statistics(
     period: str = "month",  # day, week, month, year
@@ -1874,55 +3575,37 @@ async def get_admin_statistics(
     }
     
     start_date = periods.get(period, periods["month"])
+    days = 30 if period in ["month", "year"] else 7
+    first_day = now - timedelta(days=days - 1)
     
-    # Get user registrations
-    all_users = await db.users.find({}, {"_id": 0, "created_at": 1, "role": 1}).to_list(None)
+    # Periods are counted in whole UTC days from the rollups
+    rows = await load_daily_metrics(min(start_date, first_day))
+    start_day = start_date.strftime("%Y-%m-%d")
     
     # Count registrations by period
     registrations = {"users": 0, "creators": 0, "total": 0}
-    for user in all_users:
-        user = parse_from_mongo(user)
-        created = user.get("created_at")
-        if created and created >= start_date:
-            registrations["total"] += 1
-            if user.get("role") == "creator":
-                registrations["creators"] += 1
-            else:
-                registrations["users"] += 1
-    
-    # Get revenue statistics
-    tickets = await db.tickets.find({}, {"_id": 0, "amount_paid": 1, "purchased_at": 1}).to_list(None)
-    
-    revenue = {"total": 0, "commission": 0}
-    for ticket in tickets:
-        ticket = parse_from_mongo(ticket)
-        purchased = ticket.get("purchased_at")
-        if purchased and purchased >= start_date:
-            amount = ticket.get("amount_paid", 0)
-            revenue["total"] += amount
-            revenue["commission"] += amount * PLATFORM_COMMISSION / 100
+    total_revenue = 0
+    for row in rows:
+        if row["_id"] >= start_day:
+            registrations["total"] += row.get("registrations", 0)
+            registrations["creators"] += row.get("creator_registrations", 0)
+            total_revenue += row.get("ticket_revenue", 0)
+    registrations["users"] = registrations["total"] - registrations["creators"]
+    
+    revenue = {"total": total_revenue, "commission": total_revenue * PLATFORM_COMMISSION / 100}
     
     # Get daily breakdown for charts
     daily_data = {}
-    for i in range(30 if period in ["month", "year"] else 7):
+    for i in range(days):
         date = (now - timedelta(days=i)).strftime("%Y-%m-%d")
         daily_data[date] = {"registrations": 0, "revenue": 0}
     
-    for user in all_users:
-        user = parse_from_mongo(user)
-        created = user.get("created_at")
-        if created:
-            date_str = created.strftime("%Y-%m-%d")
-            if date_str in daily_data:
-                daily_data[date_str]["registrations"] += 1
-    
-    for ticket in tickets:
-        ticket = parse_from_mongo(ticket)
-        purchased = ticket.get("purchased_at")
-        if purchased:
-            date_str = purchased.strftime("%Y-%m-%d")
-            if date_str in daily_data:
-                daily_data[date_str]["revenue"] += ticket.get("amount_paid", 0)
+    for row in rows:
+        if row["_id"] in daily_data:
+            daily_data[row["_id"]] = {
+                "registrations": row.get("registrations", 0),
+                "revenue": row.get("ticket_revenue", 0)
+            }
     
     return {
         "period": period,
@@ -1940,6 +3623,7 @@ async def get_admin_earnings(
     period: str = "month",  # day, week, month, year, all
     page: int = 1,
     per_page: int = 20,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     """Get platform earnings from raffle creation fees (Paddle)"""
@@ -1958,23 +3642,27 @@ async def get_admin_earnings(
         start_date = now - timedelta(days=365)
     else:
         start_date = None  # All time
+    if start_date:
+        # Whole UTC days, the granularity of the rollups the summary comes from
+        start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
     
     # Query for fee payments
     query = {"status": "completed", "type": "creation_fee"}
     if start_date:
         query["completed_at"] = {"$gte": start_date.isoformat()}
     
-    # Get total count and stats
-    all_completed_fees = await db.fee_payments.find(query, {"_id": 0}).to_list(None)
+    # Totals, tiers and the daily chart come from the rollups (whole UTC days)
+    rows = await load_daily_metrics(start_date)
     
-    total_earnings = sum([f.get("amount", 0) for f in all_completed_fees])
-    total_transactions = len(all_completed_fees)
+    total_earnings = sum(row.get("fee_total", 0) for row in rows)
+    total_transactions = sum(row.get("fee_count", 0) for row in rows)
     
-    # Get paginated results with creator info
-    skip = (page - 1) * per_page
-    fee_payments = await db.fee_payments.find(
-        query, {"_id": 0}
-    ).sort("completed_at", -1).skip(skip).limit(per_page).to_list(per_page)
+    # The page and its pagination totals come from the same query; the count
+    # is an index-only scan on (status, type, completed_at)
+    (fee_payments, next_cursor), total_items = await asyncio.gather(
+        keyset_page(db.fee_payments, query, {"_id": 0}, "completed_at", -1, per_page, cursor, page),
+        db.fee_payments.count_documents(query)
+    )
     
     # Enrich with raffle and creator info
     enriched_payments = []
@@ -2000,22 +3688,16 @@ async def get_admin_earnings(
         })
     
     # Calculate earnings by tier
-    earnings_by_tier = {1: 0, 2: 0, 3: 0, 5: 0, 10: 0}
-    for f in all_completed_fees:
-        amount = f.get("amount", 0)
-        if amount in earnings_by_tier:
-            earnings_by_tier[amount] += amount
+    earnings_by_tier = {tier: 0 for tier in FEE_TIERS}
+    for row in rows:
+        for tier, amount in row.get("fee_tiers", {}).items():
+            earnings_by_tier[int(tier)] += amount
     
     # Daily earnings for chart
-    daily_earnings = {}
-    for f in all_completed_fees:
-        completed_at = f.get("completed_at", "")
-        if completed_at:
-            date_str = completed_at[:10] if isinstance(completed_at, str) else completed_at.strftime("%Y-%m-%d")
-            if date_str not in daily_earnings:
-                daily_earnings[date_str] = {"amount": 0, "count": 0}
-            daily_earnings[date_str]["amount"] += f.get("amount", 0)
-            daily_earnings[date_str]["count"] += 1
+    daily_earnings = {
+        row["_id"]: {"amount": row["fee_total"], "count": row["fee_count"]}
+        for row in rows if row.get("fee_count")
+    }
     
     # Get pending fees count
     pending_count = await db.fee_payments.count_documents({"status": "pending"})
@@ -2034,59 +3716,81 @@ async def get_admin_earnings(
         "pagination": {
             "page": page,
             "per_page": per_page,
-            "total": total_transactions,
-            "total_pages": (total_transactions + per_page - 1) // per_page
+            "total": total_items,
+            "total_pages": (total_items + per_page - 1) // per_page,
+            "next_cursor": next_cursor
         }
     }
 
+EARNINGS_SUMMARY_WINDOWS = "today=today,week=7d,month=30d,all_time=all"
+EARNINGS_WINDOW_UNITS = {"h": "hours", "d": "days", "w": "weeks"}
+MAX_EARNINGS_WINDOWS = 12
+
+def parse_earnings_windows(spec: str, now: datetime) -> dict:
+    """Parse "name=span,..." into {name: start datetime or None for all time}.
+    
+    A span is `today` (since UTC midnight), `all`, or a number followed by
+    h, d or w (e.g. 24h, 7d, 12w).
+    """
+    windows = {}
+    for part in spec.split(","):
+        name, _, span = part.strip().partition("=")
+        span = span.strip().lower()
+        if not name or "." in name or name.startswith("$"):
+            raise HTTPException(status_code=400, detail=f"Ventana inválida: {part}")
+        if span == "all":
+            windows[name] = None
+        elif span == "today":
+            windows[name] = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        elif span[:-1].isdigit() and span[-1:] in EARNINGS_WINDOW_UNITS:
+            try:
+                windows[name] = now - timedelta(**{EARNINGS_WINDOW_UNITS[span[-1]]: int(span[:-1])})
+            except OverflowError:
+                raise HTTPException(status_code=400, detail=f"Ventana fuera de rango: {part} (usa 'all')")
+        else:
+            raise HTTPException(status_code=400, detail=f"Ventana inválida: {part}")
+    if not windows or len(windows) > MAX_EARNINGS_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"Se permiten entre 1 y {MAX_EARNINGS_WINDOWS} ventanas")
+    return windows
+
 @api_router.get("/admin/earnings/summary")
-async def get_earnings_summary(current_user: User = Depends(get_current_user)):
-    """Get quick earnings summary for dashboard overview"""
+async def get_earnings_summary(
+    windows: str = EARNINGS_SUMMARY_WINDOWS,
+    current_user: User = Depends(get_current_user)
+):
+    """Get quick earnings summary for dashboard overview.
+    
+    All windows are computed by a single $facet aggregation over the completed
+    fees since the earliest start (or all of them when a window is all-time),
+    so adding periods does not add scans.
+    """
     if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
         raise HTTPException(status_code=403, detail="Solo administradores")
     
-    now = datetime.now(timezone.utc)
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    week_start = now - timedelta(days=7)
-    month_start = now - timedelta(days=30)
-    
-    # Today's earnings
-    today_fees = await db.fee_payments.find({
-        "status": "completed",
-        "type": "creation_fee",
-        "completed_at": {"$gte": today_start.isoformat()}
-    }, {"_id": 0, "amount": 1}).to_list(None)
-    today_total = sum([f.get("amount", 0) for f in today_fees])
-    
-    # This week's earnings
-    week_fees = await db.fee_payments.find({
-        "status": "completed",
-        "type": "creation_fee",
-        "completed_at": {"$gte": week_start.isoformat()}
-    }, {"_id": 0, "amount": 1}).to_list(None)
-    week_total = sum([f.get("amount", 0) for f in week_fees])
-    
-    # This month's earnings
-    month_fees = await db.fee_payments.find({
-        "status": "completed",
-        "type": "creation_fee",
-        "completed_at": {"$gte": month_start.isoformat()}
-    }, {"_id": 0, "amount": 1}).to_list(None)
-    month_total = sum([f.get("amount", 0) for f in month_fees])
-    
-    # All time earnings
-    all_fees = await db.fee_payments.find({
-        "status": "completed",
-        "type": "creation_fee"
-    }, {"_id": 0, "amount": 1}).to_list(None)
-    all_time_total = sum([f.get("amount", 0) for f in all_fees])
-    
-    return {
-        "today": {"total": today_total, "count": len(today_fees)},
-        "week": {"total": week_total, "count": len(week_fees)},
-        "month": {"total": month_total, "count": len(month_fees)},
-        "all_time": {"total": all_time_total, "count": len(all_fees)}
+    starts = parse_earnings_windows(windows, datetime.now(timezone.utc))
+    match = {"status": "completed", "type": "creation_fee"}
+    if all(start is not None for start in starts.values()):
+        match["completed_at"] = {"$gte": min(starts.values()).isoformat()}
+    
+    def window_total(start: Optional[datetime]) -> list:
+        stages = [] if start is None else [{"$match": {"completed_at": {"$gte": start.isoformat()}}}]
+        return stages + [{"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}]
+    
+    result = await db.fee_payments.aggregate([
+        {"$match": match},
+        {"$project": {"_id": 0, "amount": 1, "completed_at": 1}},
+        {"$facet": {name: window_total(start) for name, start in starts.items()}}
+    ]).to_list(1)
+    facets = result[0] if result else {}
+    summary = {
+        name: {
+            "total": facets[name][0]["total"] if facets.get(name) else 0,
+            "count": facets[name][0]["count"] if facets.get(name) else 0
+        }
+        for name in starts
     }
+    
+    return {name: summary[name] for name in starts}
 
 @api_router.get("/admin/users-by-reviews")
 async def get_users_by_reviews(
@@ -2225,6 +3929,7 @@ async def get_all_users(
     sort_order: str = "desc",
     page: int = 1,
     per_page: int = 10,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     """Get all users with filters"""
@@ -2250,16 +3955,18 @@ async def get_all_users(
     total = await db.users.count_documents(query)
     
     sort_direction = -1 if sort_order == "desc" else 1
-    skip = (page - 1) * per_page
     
-    users = await db.users.find(query, {"_id": 0, "password": 0}).sort(sort_by, sort_direction).skip(skip).limit(per_page).to_list(per_page)
+    users, next_cursor = await keyset_page(
+        db.users, query, {"_id": 0, "password": 0}, sort_by, sort_direction, per_page, cursor, page
+    )
     
     return {
         "data": [parse_from_mongo(u) for u in users],
         "total": total,
         "page": page,
         "per_page": per_page,
-        "total_pages": (total + per_page - 1) // per_page
+        "total_pages": (total + per_page - 1) // per_page,
+        "next_cursor": next_cursor
     }
 
 # ============================================
@@ -2296,10 +4003,6 @@ async def get_user_detail(user_id: str, current_user: User = Depends(get_current
     else:
         user["avg_rating"] = None
     
-    # Get followers/following counts
-    user["followers_count"] = len(user.get("followers", []))
-    user["following_count"] = len(user.get("following", []))
-    
     return user
 
 @api_router.get("/admin/user/{user_id}/messages")
@@ -2382,6 +4085,132 @@ async def get_user_registration_history(
     }
 
 # Messaging System
+
+# The inbox is served from `conversations`: one summary per (owner, other
+# participant) holding the owner's last visible message and unread count.
+# Sending and reading update it incrementally; archiving changes which
+# messages are visible, so the owner's summary is recomputed from messages.
+
+MESSAGES_MAX_LIMIT = 100
+
+def conversation_key(user_a: str, user_b: str) -> str:
+    """Canonical id of the conversation between two users, whatever the direction"""
+    return ":".join(sorted((user_a, user_b)))
+
+def _message_preview(message: dict) -> dict:
+    return {
+        key: message.get(key)
+        for key in ("id", "from_user_id", "to_user_id", "subject", "content", "read", "created_at")
+    }
+
+async def record_sent_message(doc: dict):
+    """Update both participants' conversation summaries for a new message"""
+    sender_id, recipient_id = doc["from_user_id"], doc["to_user_id"]
+    preview = _message_preview(doc)
+    await db.conversations.bulk_write([
+        UpdateOne(
+            {"id": f"{sender_id}:{recipient_id}"},
+            {
+                "$set": {"last_message": preview, "last_message_at": doc["created_at"]},
+                "$setOnInsert": {"owner_id": sender_id, "other_user_id": recipient_id, "unread_count": 0}
+            },
+            upsert=True
+        ),
+        UpdateOne(
+            {"id": f"{recipient_id}:{sender_id}"},
+            {
+                "$set": {"last_message": preview, "last_message_at": doc["created_at"]},
+                "$setOnInsert": {"owner_id": recipient_id, "other_user_id": sender_id},
+                "$inc": {"unread_count": 1}
+            },
+            upsert=True
+        )
+    ], ordered=False)
+
+async def refresh_conversation(owner_id: str, other_user_id: str):
+    """Recompute one owner's conversation summary from their visible messages"""
+    visible = {"conversation_id": conversation_key(owner_id, other_user_id), "archived_by": {"$ne": owner_id}}
+    last = await db.messages.find_one(visible, {"_id": 0}, sort=[("created_at", -1), ("id", -1)])
+    if not last:
+        await db.conversations.delete_one({"id": f"{owner_id}:{other_user_id}"})
+        return
+    
+    unread = await db.messages.count_documents({
+        "from_user_id": other_user_id,
+        "to_user_id": owner_id,
+        "read": False,
+        "archived_by": {"$ne": owner_id}
+    })
+    await db.conversations.replace_one(
+        {"id": f"{owner_id}:{other_user_id}"},
+        {
+            "id": f"{owner_id}:{other_user_id}",
+            "owner_id": owner_id,
+            "other_user_id": other_user_id,
+            "last_message": _message_preview(last),
+            "last_message_at": last["created_at"],
+            "unread_count": unread
+        },
+        upsert=True
+    )
+
+async def backfill_conversation_ids():
+    """Stamp conversation_id on messages sent before it existed"""
+    await db.messages.update_many(
+        {"conversation_id": {"$exists": False}},
+        [{"$set": {"conversation_id": {"$cond": [
+            {"$lt": ["$from_user_id", "$to_user_id"]},
+            {"$concat": ["$from_user_id", ":", "$to_user_id"]},
+            {"$concat": ["$to_user_id", ":", "$from_user_id"]}
+        ]}}}]
+    )
+
+async def backfill_conversations():
+    """Build conversation summaries for messages sent before they existed"""
+    def side(owner, other, unread):
+        return {
+            "owner": owner,
+            "other": other,
+            "unread": unread,
+            "archived": {"$in": [owner, {"$ifNull": ["$archived_by", []]}]}
+        }
+    
+    summaries = db.messages.aggregate([
+        {"$sort": {"created_at": -1}},
+        {"$project": {
+            "_id": 0,
+            "message": "$$ROOT",
+            "sides": [
+                side("$from_user_id", "$to_user_id", 0),
+                side("$to_user_id", "$from_user_id", {"$cond": [{"$eq": ["$read", False]}, 1, 0]})
+            ]
+        }},
+        {"$unwind": "$sides"},
+        {"$match": {"sides.archived": False}},
+        {"$group": {
+            "_id": {"owner": "$sides.owner", "other": "$sides.other"},
+            "last": {"$first": "$message"},
+            "unread": {"$sum": "$sides.unread"}
+        }}
+    ], allowDiskUse=True)
+    
+    batch = []
+    async for summary in summaries:
+        owner_id, other_user_id = summary["_id"]["owner"], summary["_id"]["other"]
+        batch.append(ReplaceOne({"id": f"{owner_id}:{other_user_id}"}, {
+            "id": f"{owner_id}:{other_user_id}",
+            "owner_id": owner_id,
+            "other_user_id": other_user_id,
+            "last_message": _message_preview(summary["last"]),
+            "last_message_at": summary["last"].get("created_at"),
+            "unread_count": summary["unread"]
+        }, upsert=True))
+        if len(batch) >= NOTIFICATION_BATCH_SIZE:
+            await db.conversations.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.conversations.bulk_write(batch, ordered=False)
+
 @api_router.post("/messages")
 async def send_message(message_data: MessageCreate, current_user: User = Depends(get_current_user)):
     # Check if recipient exists and get their settings
@@ -2414,11 +4243,16 @@ async def send_message(message_data: MessageCreate, current_user: User = Depends
         to_user_id=message_data.to_user_id,
         subject=message_data.subject,
         content=message_data.content,
-        parent_id=message_data.parent_id
+        parent_id=message_data.parent_id,
+        conversation_id=conversation_key(current_user.id, message_data.to_user_id)
     )
     
     doc = prepare_for_mongo(message.model_dump())
+    doc["counted"] = True
     await db.messages.insert_one(doc)
+    await record_sent_message(doc)
+    await adjust_counters("unread_messages", {doc["to_user_id"]: 1})
+    await publish_event([doc["to_user_id"], doc["from_user_id"]], "message", _message_preview(doc))
     
     # Create notification for recipient only if notifications enabled
     if recipient.get("notifications_enabled", True):
@@ -2431,32 +4265,57 @@ async def send_message(message_data: MessageCreate, current_user: User = Depends
     
     return message
 
+@api_router.get("/messages/inbox")
+async def get_inbox(per_page: int = 20, cursor: Optional[str] = None, current_user: TokenPrincipal = Depends(get_token_principal)):
+    """Get the current user's conversations, most recent first"""
+    conversations, next_cursor = await keyset_page(
+        db.conversations,
+        {"owner_id": current_user.id},
+        {"_id": 0},
+        "last_message_at", -1, per_page, cursor
+    )
+    users = await get_creator_cards(c["other_user_id"] for c in conversations)
+    for conversation in conversations:
+        conversation["other_user"] = users.get(conversation["other_user_id"])
+    
+    return {
+        "conversations": conversations,
+        "has_more": next_cursor is not None,
+        "next_cursor": next_cursor
+    }
+
 @api_router.get("/messages")
-async def get_messages(current_user: User = Depends(get_current_user)):
-    # Find all messages where user is sender or receiver
-    messages = await db.messages.find(
-        {"$or": [{"from_user_id": current_user.id}, {"to_user_id": current_user.id}]},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(None)
+async def get_messages(limit: int = 50, cursor: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Get one page of the current user's messages, newest first.
+    
+    Conversation lists should use /messages/inbox; this stays for API clients.
+    """
+    limit = max(1, min(limit, MESSAGES_MAX_LIMIT))
+    messages, next_cursor = await keyset_page(
+        db.messages,
+        {
+            "$or": [{"from_user_id": current_user.id}, {"to_user_id": current_user.id}],
+            "archived_by": {"$ne": current_user.id}
+        },
+        {"_id": 0},
+        "created_at", -1, limit, cursor
+    )
     
-    # Get sender/receiver names and filter archived
-    filtered_messages = []
+    # Get sender/receiver names
+    users = await get_creator_cards(
+        user_id for msg in messages for user_id in (msg["from_user_id"], msg["to_user_id"])
+    )
     for msg in messages:
-        # Skip if archived by current user
-        if current_user.id in msg.get("archived_by", []):
-            continue
-            
-        from_user = await db.users.find_one({"id": msg["from_user_id"]}, {"_id": 0, "full_name": 1})
-        to_user = await db.users.find_one({"id": msg["to_user_id"]}, {"_id": 0, "full_name": 1})
-        
-        if from_user:
-            msg["from_user_name"] = from_user["full_name"]
-        if to_user:
-            msg["to_user_name"] = to_user["full_name"]
-        
-        filtered_messages.append(msg)
+        if msg["from_user_id"] in users:
+            msg["from_user_name"] = users[msg["from_user_id"]]["full_name"]
+        if msg["to_user_id"] in users:
+            msg["to_user_name"] = users[msg["to_user_id"]]["full_name"]
     
-    return [parse_from_mongo(m) for m in filtered_messages]
+    return {
+        "messages": [parse_from_mongo(m) for m in messages],
+        "has_more": next_cursor is not None,
+        "next_cursor": next_cursor
+    }
 
 @api_router.get("/messages/archived")
 async def get_archived_messages(current_user: User = Depends(get_current_user)):
@@ -2482,42 +4341,59 @@ async def get_archived_messages(current_user: User = Depends(get_current_user)):
     return [parse_from_mongo(m) for m in messages]
 
 @api_router.get("/messages/conversation/{other_user_id}")
-async def get_conversation(other_user_id: str, current_user: User = Depends(get_current_user)):
-    """Get all messages between current user and another user"""
-    messages = await db.messages.find(
-        {
-            "$or": [
-                {"from_user_id": current_user.id, "to_user_id": other_user_id},
-                {"from_user_id": other_user_id, "to_user_id": current_user.id}
-            ]
-        },
-        {"_id": 0}
-    ).sort("created_at", 1).to_list(None)
+async def get_conversation(
+    other_user_id: str,
+    limit: int = 50,
+    before: Optional[str] = None,
+    current_user: TokenPrincipal = Depends(get_token_principal)
+):
+    """Get messages between current user and another user, newest page first.
+    
+    Pass `before` (the previous page's `before_cursor`) to load older
+    messages. Messages within a page are oldest first, ready to render.
+    """
+    messages, before_cursor = await keyset_page(
+        db.messages,
+        {"conversation_id": conversation_key(current_user.id, other_user_id)},
+        {"_id": 0},
+        "created_at", -1, limit, before
+    )
+    messages.reverse()
     
     # Get other user info
     other_user = await db.users.find_one({"id": other_user_id}, {"_id": 0, "full_name": 1, "email": 1})
     
     return {
         "messages": [parse_from_mongo(m) for m in messages],
-        "other_user": other_user
+        "other_user": other_user,
+        "has_more": before_cursor is not None,
+        "before_cursor": before_cursor
     }
 
 @api_router.post("/messages/{message_id}/archive")
 async def archive_message(message_id: str, current_user: User = Depends(get_current_user)):
     """Archive a message for current user"""
-    await db.messages.update_one(
+    message = await db.messages.find_one_and_update(
         {"id": message_id},
-        {"$addToSet": {"archived_by": current_user.id}}
+        {"$addToSet": {"archived_by": current_user.id}},
+        projection={"_id": 0, "from_user_id": 1, "to_user_id": 1}
     )
+    if message:
+        other_user_id = message["to_user_id"] if message["from_user_id"] == current_user.id else message["from_user_id"]
+        await refresh_conversation(current_user.id, other_user_id)
     return {"message": "Mensaje archivado"}
 
 @api_router.post("/messages/{message_id}/unarchive")
 async def unarchive_message(message_id: str, current_user: User = Depends(get_current_user)):
     """Unarchive a message for current user"""
-    await db.messages.update_one(
+    message = await db.messages.find_one_and_update(
         {"id": message_id},
-        {"$pull": {"archived_by": current_user.id}}
+        {"$pull": {"archived_by": current_user.id}},
+        projection={"_id": 0, "from_user_id": 1, "to_user_id": 1}
     )
+    if message:
+        other_user_id = message["to_user_id"] if message["from_user_id"] == current_user.id else message["from_user_id"]
+        await refresh_conversation(current_user.id, other_user_id)
     return {"message": "Mensaje desarchivado"}
 
 @api_router.delete("/messages/{message_id}")
@@ -2526,10 +4402,14 @@ async def delete_message(message_id: str, current_user: User = Depends(get_curre
     if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
         raise HTTPException(status_code=403, detail="Solo los administradores pueden eliminar mensajes")
     
-    result = await db.messages.delete_one({"id": message_id})
-    if result.deleted_count == 0:
+    message = await db.messages.find_one_and_delete({"id": message_id}, projection={"_id": 0})
+    if not message:
         raise HTTPException(status_code=404, detail="Mensaje no encontrado")
     
+    await refresh_conversation(message["from_user_id"], message["to_user_id"])
+    await refresh_conversation(message["to_user_id"], message["from_user_id"])
+    if message.get("read") is False and message.get("counted"):
+        await adjust_counters("unread_messages", {message["to_user_id"]: -1})
     return {"message": "Mensaje eliminado"}
 
 @api_router.get("/admin/messages/all")
@@ -2577,16 +4457,24 @@ async def get_user_messages(user_id: str, current_user: User = Depends(get_curre
 
 @api_router.post("/messages/{message_id}/read")
 async def mark_message_read(message_id: str, current_user: User = Depends(get_current_user)):
-    await db.messages.update_one(
-        {"id": message_id, "to_user_id": current_user.id},
-        {"$set": {"read": True}}
+    message = await db.messages.find_one_and_update(
+        {"id": message_id, "to_user_id": current_user.id, "read": False},
+        {"$set": {"read": True}},
+        projection={"_id": 0, "from_user_id": 1, "archived_by": 1, "counted": 1}
     )
+    if message and message.get("counted"):
+        await adjust_counters("unread_messages", {current_user.id: -1})
+    if message and current_user.id not in message.get("archived_by", []):
+        await db.conversations.update_one(
+            {"id": f"{current_user.id}:{message['from_user_id']}", "unread_count": {"$gt": 0}},
+            {"$inc": {"unread_count": -1}}
+        )
     return {"message": "Mensaje marcado como leído"}
 
 @api_router.get("/messages/unread-count")
-async def get_unread_messages_count(current_user: User = Depends(get_current_user)):
-    count = await db.messages.count_documents({"to_user_id": current_user.id, "read": False})
-    return {"count": count}
+async def get_unread_messages_count(current_user: TokenPrincipal = Depends(get_token_principal)):
+    counters = await get_counters(current_user.id)
+    return {"count": counters["unread_messages"]}
 
 
 # ============================================
@@ -2693,47 +4581,69 @@ async def handle_transaction_completed(data: dict):
         print(f"Transaction {transaction_id} not found in DB (simulated)")
         return
     
-    # Actualizar estado
-    await db.paddle_transactions.update_one(
-        {"paddle_transaction_id": transaction_id},
+    # Actualizar estado (una sola vez aunque Paddle reenvíe el webhook)
+    claimed = await db.paddle_transactions.update_one(
+        {"paddle_transaction_id": transaction_id, "paddle_status": {"$ne": "completed"}},
         {"$set": {"paddle_status": "completed"}}
     )
+    if not claimed.modified_count:
+        print(f"Transaction {transaction_id} already processed")
+        return
     
-    # Crear tickets
-    for ticket_number in paddle_tx["ticket_numbers"]:
-        # Verificar que el ticket no esté ya vendido
-        existing_ticket = await db.tickets.find_one({
-            "raffle_id": paddle_tx["raffle_id"],
-            "ticket_number": ticket_number
+    raffle = await db.raffles.find_one({"id": paddle_tx["raffle_id"]}, {"_id": 0})
+    if not raffle:
+        print(f"Raffle {paddle_tx['raffle_id']} not found for transaction {transaction_id}")
+        return
+    
+    # Crear tickets (solo los números que sigan libres)
+    requested = paddle_tx["ticket_numbers"]
+    ticket_price = paddle_tx["amount"] / len(requested)
+    claimed_numbers = await claim_ticket_numbers(raffle["id"], raffle["ticket_range"], requested)
+    issued = []
+    if claimed_numbers:
+        try:
+            await write_tickets(
+                raffle,
+                paddle_tx["user_id"],
+                claimed_numbers,
+                ticket_price,
+                payment_method="paddle",
+                paddle_transaction_id=transaction_id
+            )
+            issued = claimed_numbers
+        except HTTPException:
+            # write_tickets already removed the partial order and released the numbers
+            pass
+    
+    # Los números vendidos a otro comprador se registran para reembolsarlos
+    issued_set = set(issued)
+    missing = [n for n in requested if n not in issued_set]
+    issued_share = len(issued) / len(requested)
+    update = {"issued_ticket_numbers": issued}
+    if missing:
+        update.update({
+            "missing_ticket_numbers": missing,
+            "refund_due": ticket_price * len(missing),
+            "refund_status": "pending"
         })
-        
-        if not existing_ticket:
-            ticket = {
-                "id": str(uuid.uuid4()),
-                "raffle_id": paddle_tx["raffle_id"],
-                "user_id": paddle_tx["user_id"],
-                "ticket_number": ticket_number,
-                "purchase_date": datetime.now(timezone.utc).isoformat(),
-                "price_paid": paddle_tx["amount"] / len(paddle_tx["ticket_numbers"])
-            }
-            await db.tickets.insert_one(ticket)
+        logger.warning(f"Transaction {transaction_id}: {len(missing)} ticket(s) already sold, refund of {ticket_price * len(missing)} pending")
+    await db.paddle_transactions.update_one({"paddle_transaction_id": transaction_id}, {"$set": update})
     
     # Actualizar estadísticas de la rifa
-    await db.raffles.update_one(
-        {"id": paddle_tx["raffle_id"]},
-        {
-            "$inc": {
-                "tickets_sold": len(paddle_tx["ticket_numbers"]),
-                "total_raised": paddle_tx["creator_amount"]
-            }
-        }
-    )
+    if issued:
+        await db.raffles.update_one(
+            {"id": paddle_tx["raffle_id"]},
+            {"$inc": {"total_raised": paddle_tx["creator_amount"] * issued_share}}
+        )
     
     # Crear notificación
+    message = f"Has comprado {len(issued)} tickets exitosamente"
+    if missing:
+        message += f". {len(missing)} ticket(s) ya estaban vendidos y se te reembolsarán"
     await create_notification(
         paddle_tx["user_id"],
-        "Compra Exitosa",
-        f"Has comprado {len(paddle_tx['ticket_numbers'])} tickets exitosamente",
+        "Compra Exitosa" if issued else "Compra No Completada",
+        message,
         "ticket_purchase"
     )
 
@@ -2874,14 +4784,17 @@ async def paddle_fee_webhook(request: Request):
             
             if raffle_id:
                 # Update fee payment record
-                await db.fee_payments.update_one(
+                fee_payment = await db.fee_payments.find_one_and_update(
                     {"raffle_id": raffle_id, "status": "pending"},
                     {"$set": {
                         "status": "completed",
                         "paddle_transaction_id": transaction_id,
                         "completed_at": datetime.now(timezone.utc).isoformat()
-                    }}
+                    }},
+                    return_document=ReturnDocument.AFTER
                 )
+                if fee_payment and fee_payment.get("type") == "creation_fee":
+                    await record_metrics(fee_payment["completed_at"], fee_metrics(fee_payment.get("amount", 0)))
                 
                 # Activate the raffle
                 await db.raffles.update_one(
@@ -2891,25 +4804,21 @@ async def paddle_fee_webhook(request: Request):
                         "payment_confirmed_at": datetime.now(timezone.utc).isoformat()
                     }}
                 )
+                await commit_draw_seed(raffle_id)
                 
                 # Get raffle and creator info for notification
                 raffle = await db.raffles.find_one({"id": raffle_id}, {"_id": 0})
                 if raffle:
+                    await timeline_add("raffle", raffle)
                     creator = await db.users.find_one({"id": raffle["creator_id"]}, {"_id": 0})
                     
                     # Notify followers
-                    followers = await db.users.find(
-                        {"following": raffle["creator_id"]}, 
-                        {"_id": 0, "id": 1}
-                    ).to_list(None)
-                    
-                    for follower in followers:
-                        await create_notification(
-                            follower['id'],
-                            "Nueva Rifa Disponible",
-                            f"{creator['full_name'] if creator else 'Un creador'} ha creado una nueva rifa: {raffle['title']}",
-                            "new_raffle"
-                        )
+                    await enqueue_follower_notifications(
+                        raffle["creator_id"],
+                        "Nueva Rifa Disponible",
+                        f"{creator['full_name'] if creator else 'Un creador'} ha creado una nueva rifa: {raffle['title']}",
+                        "new_raffle"
+                    )
                 
                 print(f"✅ Raffle {raffle_id} activated after fee payment")
                 return {"status": "ok", "message": "Raffle activated"}
@@ -2936,93 +4845,143 @@ async def paddle_fee_webhook(request: Request):
 # SOCIAL FEED SYSTEM
 # ============================================
 
+# The feed is served from a materialized `timeline` collection with one entry
+# per visible post/story and active raffle. Entries are written when content
+# is published, removed when it is deleted or drawn, and re-ranked when a
+# creator is featured or unfeatured, and dropped while the creator is
+# deactivated or suspended. `sort_key` ("<featured 0|1>|<created_at>")
+# orders featured creators first and then by date, so a page is one range
+# read on the (sort_key, id) index. Story entries carry `expires_at` and are
+# purged by a TTL index; `written_at` lets a rebuild tell rows it did not
+# rewrite apart from ones written live while it ran.
+
+def _timeline_entry(item_type: str, item: dict, is_featured: bool) -> dict:
+    created_at = item["created_at"]
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    expires_at = item.get("expires_at")
+    if isinstance(expires_at, str):
+        expires_at = datetime.fromisoformat(expires_at)
+    return {
+        "id": f"{item_type}:{item['id']}",
+        "item_type": item_type,
+        "item_id": item["id"],
+        "creator_id": item["creator_id"],
+        "is_featured": is_featured,
+        "created_at": created_at,
+        "expires_at": expires_at,
+        "sort_key": f"{1 if is_featured else 0}|{created_at}",
+        "written_at": datetime.now(timezone.utc)
+    }
+
+async def timeline_add(item_type: str, item: dict):
+    """Publish a post or an active raffle to the feed timeline"""
+    creator = (await get_creator_cards([item["creator_id"]])).get(item["creator_id"], {})
+    entry = _timeline_entry(item_type, item, creator.get("is_featured", False))
+    await db.timeline.replace_one({"id": entry["id"]}, entry, upsert=True)
+
+async def timeline_remove(item_type: str, item_ids: List[str]):
+    await db.timeline.delete_many({"item_type": item_type, "item_id": {"$in": item_ids}})
+
+async def timeline_remove_creator(creator_id: str):
+    """Take every entry of a deactivated, suspended or deleted creator off the feed"""
+    await db.timeline.delete_many({"creator_id": creator_id})
+
+async def timeline_set_featured(creator_id: str, is_featured: bool):
+    """Re-rank every timeline entry of a creator after (un)featuring them"""
+    await db.timeline.update_many(
+        {"creator_id": creator_id},
+        [{"$set": {
+            "is_featured": is_featured,
+            "sort_key": {"$concat": ["1|" if is_featured else "0|", "$created_at"]}
+        }}]
+    )
+
+async def rebuild_timeline(creator_id: Optional[str] = None) -> int:
+    """Regenerate the timeline (or one creator's entries) from posts and active raffles.
+    
+    Entries are upserted in batches and the ones written before the rebuild
+    started are removed afterwards, so the feed never goes empty and entries
+    published while it runs are kept.
+    """
+    started_at = datetime.now(timezone.utc)
+    scope = {"creator_id": creator_id} if creator_id else {}
+    featured_ids = set(await db.users.distinct("id", {"role": "creator", "is_featured": True}))
+    inactive_ids = set(await db.users.distinct("id", {"is_active": False}))
+    count = 0
+    
+    sources = [
+        ("post", db.posts.find(scope, {"_id": 0, "id": 1, "creator_id": 1, "created_at": 1, "expires_at": 1})),
+        ("raffle", db.raffles.find({**scope, "status": RaffleStatus.ACTIVE}, {"_id": 0, "id": 1, "creator_id": 1, "created_at": 1}))
+    ]
+    for item_type, cursor in sources:
+        batch = []
+        async for item in cursor:
+            if item["creator_id"] in inactive_ids:
+                continue
+            entry = _timeline_entry(item_type, item, item["creator_id"] in featured_ids)
+            if entry["expires_at"] and entry["expires_at"] <= started_at:
+                continue
+            batch.append(ReplaceOne({"id": entry["id"]}, entry, upsert=True))
+            if len(batch) >= NOTIFICATION_BATCH_SIZE:
+                await db.timeline.bulk_write(batch, ordered=False)
+                count += len(batch)
+                batch = []
+        if batch:
+            await db.timeline.bulk_write(batch, ordered=False)
+            count += len(batch)
+    
+    await db.timeline.delete_many({**scope, "written_at": {"$not": {"$gte": started_at}}})
+    return count
+
 @api_router.get("/feed")
-async def get_feed(page: int = 1, per_page: int = 10):
+async def get_feed(page: int = 1, per_page: int = 10, cursor: Optional[str] = None):
     """Get social feed with posts and raffles mixed - Featured creators first"""
-    skip = (page - 1) * per_page
-    
-    # Get featured creators first
-    featured_creators = await db.users.find(
-        {"role": "creator", "is_featured": True, "is_active": True},
-        {"_id": 0, "id": 1}
-    ).to_list(None)
-    featured_ids = [c["id"] for c in featured_creators]
-    
-    # Get posts from featured creators
-    featured_posts = await db.posts.find(
-        {"creator_id": {"$in": featured_ids}, "$or": [{"is_story": False}, {"expires_at": {"$gt": datetime.now(timezone.utc)}}]},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(per_page // 2).to_list(per_page // 2)
-    
-    # Get active raffles from featured creators
-    featured_raffles = await db.raffles.find(
-        {"creator_id": {"$in": featured_ids}, "status": "active"},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(per_page // 2).to_list(per_page // 2)
+    now = datetime.now(timezone.utc)
     
-    # Get posts from other creators
-    other_posts = await db.posts.find(
-        {"creator_id": {"$nin": featured_ids}, "$or": [{"is_story": False}, {"expires_at": {"$gt": datetime.now(timezone.utc)}}]},
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(per_page).to_list(per_page)
+    entries, next_cursor = await keyset_page(
+        db.timeline,
+        {"$or": [{"expires_at": None}, {"expires_at": {"$gt": now}}]},
+        {"_id": 0},
+        "sort_key", -1, per_page, cursor, page
+    )
     
-    # Get raffles from other creators
-    other_raffles = await db.raffles.find(
-        {"creator_id": {"$nin": featured_ids}, "status": "active"},
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(per_page).to_list(per_page)
+    # Hydrate the page: one $in per item type plus one batch of creator cards
+    post_ids = [e["item_id"] for e in entries if e["item_type"] == "post"]
+    raffle_ids = [e["item_id"] for e in entries if e["item_type"] == "raffle"]
+    posts = await db.posts.find({"id": {"$in": post_ids}}, {"_id": 0}).to_list(None) if post_ids else []
+    raffles = await db.raffles.find({"id": {"$in": raffle_ids}}, {"_id": 0}).to_list(None) if raffle_ids else []
+    items_by_id = {("post", p["id"]): p for p in posts}
+    items_by_id.update({("raffle", r["id"]): r for r in raffles})
+    creators = await get_creator_cards(e["creator_id"] for e in entries)
     
-    # Combine and enrich with creator info
     feed_items = []
-    
-    # Process featured content first
-    for post in featured_posts:
-        post = parse_from_mongo(post)
-        creator = await db.users.find_one({"id": post["creator_id"]}, {"_id": 0, "password": 0})
-        if creator:
-            post["creator"] = parse_from_mongo(creator)
-            post["type"] = "post"
-            post["is_featured_creator"] = True
-            feed_items.append(post)
-    
-    for raffle in featured_raffles:
-        raffle = parse_from_mongo(raffle)
-        creator = await db.users.find_one({"id": raffle["creator_id"]}, {"_id": 0, "password": 0})
-        if creator:
-            raffle["creator"] = parse_from_mongo(creator)
-            raffle["type"] = "raffle"
-            raffle["is_featured_creator"] = True
-            feed_items.append(raffle)
-    
-    # Then add other content
-    for post in other_posts:
-        post = parse_from_mongo(post)
-        creator = await db.users.find_one({"id": post["creator_id"]}, {"_id": 0, "password": 0})
-        if creator:
-            post["creator"] = parse_from_mongo(creator)
-            post["type"] = "post"
-            post["is_featured_creator"] = False
-            feed_items.append(post)
-    
-    for raffle in other_raffles:
-        raffle = parse_from_mongo(raffle)
-        creator = await db.users.find_one({"id": raffle["creator_id"]}, {"_id": 0, "password": 0})
-        if creator:
-            raffle["creator"] = parse_from_mongo(creator)
-            raffle["type"] = "raffle"
-            raffle["is_featured_creator"] = False
-            feed_items.append(raffle)
-    
-    # Sort by featured first, then by date
-    feed_items.sort(key=lambda x: (not x.get("is_featured_creator", False), x.get("created_at", "")), reverse=False)
-    feed_items.sort(key=lambda x: x.get("is_featured_creator", False), reverse=True)
+    for entry in entries:
+        item = items_by_id.get((entry["item_type"], entry["item_id"]))
+        creator = creators.get(entry["creator_id"])
+        if item and creator:
+            item = parse_from_mongo(item)
+            item["creator"] = creator
+            item["type"] = entry["item_type"]
+            item["is_featured_creator"] = entry["is_featured"]
+            feed_items.append(item)
     
     return {
-        "items": feed_items[:per_page * 2],
+        "items": feed_items,
         "page": page,
-        "has_more": len(feed_items) >= per_page
+        "has_more": next_cursor is not None,
+        "next_cursor": next_cursor
     }
 
+@api_router.post("/admin/timeline/rebuild")
+async def rebuild_timeline_endpoint(current_user: User = Depends(get_current_user)):
+    """Regenerate the feed timeline from scratch"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    
+    count = await rebuild_timeline()
+    return {"message": "Timeline regenerado", "entries": count}
+
 @api_router.post("/posts")
 async def create_post(
     content: str = Form(""), 
@@ -3086,6 +5045,7 @@ async def create_post(
     }
     
     await db.posts.insert_one(post_data)
+    await timeline_add("post", post_data)
     
     # Remove _id before returning
     post_data.pop("_id", None)
@@ -3099,9 +5059,9 @@ async def get_post(post_id: str):
         raise HTTPException(status_code=404, detail="Post no encontrado")
     
     post = parse_from_mongo(post)
-    creator = await db.users.find_one({"id": post["creator_id"]}, {"_id": 0, "password": 0})
+    creator = (await get_creator_cards([post["creator_id"]])).get(post["creator_id"])
     if creator:
-        post["creator"] = parse_from_mongo(creator)
+        post["creator"] = creator
     
     return post
 
@@ -3116,37 +5076,39 @@ async def delete_post(post_id: str, current_user: User = Depends(get_current_use
         raise HTTPException(status_code=403, detail="No autorizado")
     
     await db.posts.delete_one({"id": post_id})
+    await timeline_remove("post", [post_id])
     await db.likes.delete_many({"target_id": post_id})
     await db.comments.delete_many({"target_id": post_id})
     
     return {"message": "Post eliminado"}
 
 @api_router.get("/creators/{creator_id}/posts")
-async def get_creator_posts(creator_id: str, page: int = 1, per_page: int = 20):
+async def get_creator_posts(creator_id: str, page: int = 1, per_page: int = 20, cursor: Optional[str] = None):
     """Get all posts from a creator"""
-    skip = (page - 1) * per_page
-    
-    posts = await db.posts.find(
+    posts, next_cursor = await keyset_page(
+        db.posts,
         {"creator_id": creator_id, "$or": [{"is_story": False}, {"expires_at": {"$gt": datetime.now(timezone.utc)}}]},
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(per_page).to_list(per_page)
+        {"_id": 0},
+        "created_at", -1, per_page, cursor, page
+    )
     
     total = await db.posts.count_documents({"creator_id": creator_id})
     
-    creator = await db.users.find_one({"id": creator_id}, {"_id": 0, "password": 0})
+    creator = (await get_creator_cards([creator_id])).get(creator_id)
     
     enriched_posts = []
     for post in posts:
         post = parse_from_mongo(post)
         if creator:
-            post["creator"] = parse_from_mongo(creator)
+            post["creator"] = creator
         enriched_posts.append(post)
     
     return {
         "posts": enriched_posts,
         "total": total,
         "page": page,
-        "has_more": skip + len(posts) < total
+        "has_more": next_cursor is not None,
+        "next_cursor": next_cursor
     }
 
 @api_router.get("/creators/{creator_id}/stories")
@@ -3186,7 +5148,7 @@ async def toggle_like(target_type: str, target_id: str, current_user: User = Dep
         return {"liked": True, "message": "Like agregado"}
 
 @api_router.get("/like/{target_type}/{target_id}/status")
-async def get_like_status(target_type: str, target_id: str, current_user: User = Depends(get_current_user)):
+async def get_like_status(target_type: str, target_id: str, current_user: TokenPrincipal = Depends(get_token_principal)):
     """Check if user has liked a post/raffle"""
     existing = await db.likes.find_one({"user_id": current_user.id, "target_id": target_id, "target_type": target_type})
     return {"liked": existing is not None}
@@ -3211,6 +5173,8 @@ async def create_comment(target_type: str, target_id: str, comment: CommentCreat
     # Update count
     collection = db.posts if target_type == "post" else db.raffles
     await collection.update_one({"id": target_id}, {"$inc": {"comments_count": 1}})
+    if comment.parent_id:
+        await db.comments.update_one({"id": comment.parent_id}, {"$inc": {"replies_count": 1}})
     
     # Add user info
     result = new_comment.model_dump()
@@ -3222,50 +5186,112 @@ async def create_comment(target_type: str, target_id: str, comment: CommentCreat
     
     return parse_from_mongo(result)
 
+COMMENT_REPLIES_PREVIEW = 5
+
+# Must be registered before /comments/{target_type}/{target_id}, which would match it
+@api_router.get("/comments/{comment_id}/replies")
+async def get_comment_replies(comment_id: str, per_page: int = 20, cursor: Optional[str] = None):
+    """Get replies to a comment, oldest first"""
+    replies, next_cursor = await keyset_page(
+        db.comments, {"parent_id": comment_id}, {"_id": 0}, "created_at", 1, per_page, cursor
+    )
+    users = await get_creator_cards(reply["user_id"] for reply in replies)
+    
+    enriched = []
+    for reply in replies:
+        reply = parse_from_mongo(reply)
+        if reply["user_id"] in users:
+            reply["user"] = users[reply["user_id"]]
+        enriched.append(reply)
+    
+    return {
+        "replies": enriched,
+        "has_more": next_cursor is not None,
+        "next_cursor": next_cursor
+    }
+
 @api_router.get("/comments/{target_type}/{target_id}")
-async def get_comments(target_type: str, target_id: str, page: int = 1, per_page: int = 20):
+async def get_comments(target_type: str, target_id: str, page: int = 1, per_page: int = 20, cursor: Optional[str] = None):
     """Get comments for a post or raffle"""
-    skip = (page - 1) * per_page
+    query = {"target_id": target_id, "target_type": target_type, "parent_id": None}
+    total = await db.comments.count_documents(query)
     
-    comments = await db.comments.find(
-        {"target_id": target_id, "target_type": target_type, "parent_id": None},
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(per_page).to_list(per_page)
+    skip = 0
+    if cursor:
+        query = {"$and": [query, keyset_filter("created_at", -1, cursor)]}
+    else:
+        skip = (page - 1) * per_page
+    
+    # The page of comments and the first replies of each in one round trip
+    comments = await db.comments.aggregate([
+        {"$match": query},
+        {"$sort": {"created_at": -1, "id": -1}},
+        {"$skip": skip},
+        {"$limit": per_page + 1},
+        {"$lookup": {
+            "from": "comments",
+            "localField": "id",
+            "foreignField": "parent_id",
+            "pipeline": [
+                {"$sort": {"created_at": 1, "id": 1}},
+                {"$limit": COMMENT_REPLIES_PREVIEW},
+                {"$project": {"_id": 0}}
+            ],
+            "as": "replies"
+        }},
+        {"$project": {"_id": 0}}
+    ]).to_list(per_page + 1)
+    
+    next_cursor = None
+    if len(comments) > per_page:
+        comments = comments[:per_page]
+        next_cursor = encode_cursor(comments[-1]["created_at"], comments[-1]["id"])
+    
+    users = await get_creator_cards(
+        c["user_id"] for comment in comments for c in [comment, *comment["replies"]]
+    )
     
-    # Enrich with user info and replies
     enriched = []
     for comment in comments:
         comment = parse_from_mongo(comment)
-        user = await db.users.find_one({"id": comment["user_id"]}, {"_id": 0, "id": 1, "full_name": 1, "profile_image": 1})
-        if user:
-            comment["user"] = parse_from_mongo(user)
-        
-        # Get replies
-        replies = await db.comments.find(
-            {"parent_id": comment["id"]},
-            {"_id": 0}
-        ).sort("created_at", 1).limit(5).to_list(5)
+        if comment["user_id"] in users:
+            comment["user"] = users[comment["user_id"]]
         
         enriched_replies = []
-        for reply in replies:
+        for reply in comment["replies"]:
             reply = parse_from_mongo(reply)
-            reply_user = await db.users.find_one({"id": reply["user_id"]}, {"_id": 0, "id": 1, "full_name": 1, "profile_image": 1})
-            if reply_user:
-                reply["user"] = parse_from_mongo(reply_user)
+            if reply["user_id"] in users:
+                reply["user"] = users[reply["user_id"]]
             enriched_replies.append(reply)
         
         comment["replies"] = enriched_replies
+        comment.setdefault("replies_count", len(enriched_replies))
+        comment["has_more_replies"] = comment["replies_count"] > len(enriched_replies)
+        if comment["has_more_replies"]:
+            last = enriched_replies[-1]
+            comment["replies_cursor"] = encode_cursor(last["created_at"], last["id"])
         enriched.append(comment)
     
-    total = await db.comments.count_documents({"target_id": target_id, "target_type": target_type, "parent_id": None})
-    
     return {
         "comments": enriched,
         "total": total,
         "page": page,
-        "has_more": skip + len(comments) < total
+        "has_more": next_cursor is not None,
+        "next_cursor": next_cursor
     }
 
+async def backfill_reply_counts():
+    """Denormalize replies_count on comments created before it existed"""
+    counts = await db.comments.aggregate([
+        {"$match": {"parent_id": {"$ne": None}}},
+        {"$group": {"_id": "$parent_id", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    for batch in _chunks(counts, NOTIFICATION_BATCH_SIZE):
+        await db.comments.bulk_write([
+            UpdateOne({"id": c["_id"]}, {"$set": {"replies_count": c["count"]}}) for c in batch
+        ], ordered=False)
+    await db.comments.update_many({"replies_count": {"$exists": False}}, {"$set": {"replies_count": 0}})
+
 @api_router.delete("/comments/{comment_id}")
 async def delete_comment(comment_id: str, current_user: User = Depends(get_current_user)):
     """Delete a comment"""
@@ -3276,12 +5302,14 @@ async def delete_comment(comment_id: str, current_user: User = Depends(get_curre
     if comment["user_id"] != current_user.id and current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
         raise HTTPException(status_code=403, detail="No autorizado")
     
-    # Update count
-    collection = db.posts if comment["target_type"] == "post" else db.raffles
-    await collection.update_one({"id": comment["target_id"]}, {"$inc": {"comments_count": -1}})
-    
     # Delete comment and replies
-    await db.comments.delete_many({"$or": [{"id": comment_id}, {"parent_id": comment_id}]})
+    result = await db.comments.delete_many({"$or": [{"id": comment_id}, {"parent_id": comment_id}]})
+    
+    # Update counts
+    collection = db.posts if comment["target_type"] == "post" else db.raffles
+    await collection.update_one({"id": comment["target_id"]}, {"$inc": {"comments_count": -result.deleted_count}})
+    if comment.get("parent_id"):
+        await db.comments.update_one({"id": comment["parent_id"]}, {"$inc": {"replies_count": -1}})
     
     return {"message": "Comentario eliminado"}
 
@@ -3298,6 +5326,8 @@ async def toggle_featured_creator(creator_id: str, current_user: User = Depends(
     
     new_status = not creator.get("is_featured", False)
     await db.users.update_one({"id": creator_id}, {"$set": {"is_featured": new_status}})
+    invalidate_user_caches(creator_id)
+    await timeline_set_featured(creator_id, new_status)
     
     return {"is_featured": new_status, "message": f"Creador {'destacado' if new_status else 'quitado de destacados'}"}
 
@@ -3312,6 +5342,267 @@ async def get_featured_creators():
     return [parse_from_mongo(c) for c in creators]
 
 
+# ============================================
+# DATABASE INDEXES
+# ============================================
+
+# Declarative index registry: collection -> [(keys, options)]. Applied
+# idempotently at startup (INDEX_BOOTSTRAP=apply, the default); with
+# INDEX_BOOTSTRAP=report startup only logs the diff against the database,
+# which is also available at GET /admin/indexes/report. Indexes marked
+# `required` enforce correctness (unique ticket numbers, single inventory or
+# seed per raffle, hold expiry) and are created whatever the mode.
+INDEX_BOOTSTRAP = os.environ.get('INDEX_BOOTSTRAP', 'apply')
+
+INDEX_REGISTRY = {
+    "users": [
+        ([("id", 1)], {"unique": True}),
+        ([("email", 1)], {"unique": True}),
+        ([("role", 1), ("is_active", 1), ("is_featured", 1)], {}),
+        ([("role", 1), ("created_at", -1), ("id", -1)], {}),
+        ([("created_at", -1), ("id", -1)], {}),
+        ([("consecutive_negative_reviews", 1)], {}),
+    ],
+    "raffles": [
+        ([("id", 1)], {"unique": True}),
+        ([("creator_id", 1), ("raffle_date", 1)], {}),
+        ([("creator_id", 1), ("status", 1)], {}),
+        ([("creator_id", 1), ("created_at", -1)], {}),
+        ([("status", 1), ("raffle_date", 1)], {}),
+        ([("status", 1), ("created_at", -1), ("id", -1)], {}),
+        ([("raffle_date", 1)], {}),
+        ([("created_at", -1), ("id", -1)], {}),
+    ],
+    "tickets": [
+        ([("id", 1)], {"unique": True}),
+        ([("raffle_id", 1), ("ticket_number", 1)], {"unique": True, "required": True}),
+        ([("user_id", 1), ("raffle_id", 1)], {}),
+        ([("user_id", 1), ("creator_id", 1)], {}),
+        ([("creator_id", 1), ("purchased_at", 1)], {}),
+        ([("purchased_at", 1)], {}),
+        ([("order_id", 1)], {"sparse": True}),
+    ],
+    "follows": [
+        ([("following_id", 1), ("follower_id", 1)], {"unique": True, "required": True}),
+        ([("following_id", 1), ("created_at", -1), ("id", -1)], {}),
+        ([("follower_id", 1), ("created_at", -1), ("id", -1)], {}),
+    ],
+    "ticket_inventory": [
+        ([("raffle_id", 1)], {"unique": True, "required": True}),
+    ],
+    "ticket_holds": [
+        ([("order_id", 1)], {"unique": True, "required": True}),
+        ([("status", 1), ("expires_at", 1)], {}),
+        ([("purge_at", 1)], {"expireAfterSeconds": 0, "required": True}),
+    ],
+    "pending_orders": [
+        ([("id", 1)], {"unique": True}),
+        ([("status", 1), ("capturing_since", 1)], {}),
+    ],
+    "notifications": [
+        ([("id", 1)], {"unique": True}),
+        ([("user_id", 1), ("created_at", -1)], {}),
+        ([("fanout_job_id", 1), ("user_id", 1)], {"sparse": True}),
+        ([("expires_at", 1)], {"expireAfterSeconds": int(NOTIFICATION_TTL_GRACE.total_seconds())}),
+    ],
+    "fanout_jobs": [
+        ([("id", 1)], {"unique": True}),
+        ([("status", 1), ("created_at", 1)], {}),
+    ],
+    "messages": [
+        ([("id", 1)], {"unique": True}),
+        ([("from_user_id", 1), ("created_at", -1)], {}),
+        ([("to_user_id", 1), ("created_at", -1)], {}),
+        ([("to_user_id", 1), ("read", 1)], {}),
+        ([("conversation_id", 1), ("created_at", -1), ("id", -1)], {}),
+    ],
+    "conversations": [
+        ([("id", 1)], {"unique": True}),
+        ([("owner_id", 1), ("last_message_at", -1), ("id", -1)], {}),
+        ([("other_user_id", 1)], {}),
+    ],
+    "ratings": [
+        ([("creator_id", 1)], {}),
+        ([("user_id", 1), ("creator_id", 1)], {}),
+        ([("rated_user_id", 1)], {}),
+    ],
+    "posts": [
+        ([("id", 1)], {"unique": True}),
+        ([("creator_id", 1), ("created_at", -1), ("id", -1)], {}),
+    ],
+    "likes": [
+        ([("user_id", 1), ("target_id", 1), ("target_type", 1)], {}),
+        ([("target_id", 1)], {}),
+    ],
+    "comments": [
+        ([("id", 1)], {"unique": True}),
+        ([("target_id", 1), ("target_type", 1), ("parent_id", 1), ("created_at", -1), ("id", -1)], {}),
+        ([("parent_id", 1), ("created_at", 1), ("id", 1)], {}),
+    ],
+    "fee_payments": [
+        ([("status", 1), ("type", 1), ("completed_at", -1), ("id", -1)], {}),
+        ([("raffle_id", 1), ("status", 1)], {}),
+    ],
+    "payments": [
+        ([("raffle_id", 1)], {}),
+    ],
+    "paddle_transactions": [
+        ([("paddle_transaction_id", 1)], {}),
+        ([("user_id", 1), ("created_at", -1)], {}),
+    ],
+    "timeline": [
+        ([("id", 1)], {"unique": True}),
+        ([("sort_key", -1), ("id", -1)], {}),
+        ([("item_type", 1), ("item_id", 1)], {}),
+        ([("creator_id", 1)], {}),
+        ([("written_at", 1)], {}),
+        ([("expires_at", 1)], {"expireAfterSeconds": 0, "partialFilterExpression": {"expires_at": {"$type": "date"}}}),
+    ],
+    "events": [
+        ([("created_at", 1)], {"expireAfterSeconds": PUSH_EVENT_RETENTION_SECONDS}),
+    ],
+    "draw_seeds": [
+        ([("raffle_id", 1)], {"unique": True, "required": True}),
+    ],
+    "draw_runs": [
+        ([("started_at", -1)], {}),
+    ],
+}
+
+# Index options that make two indexes on the same keys different
+INDEX_COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+async def ensure_indexes(required_only: bool = False):
+    """Create every declared index (or only the required ones); existing identical indexes are a no-op"""
+    for collection, indexes in INDEX_REGISTRY.items():
+        for keys, options in indexes:
+            if required_only and not options.get("required"):
+                continue
+            options = {opt: value for opt, value in options.items() if opt != "required"}
+            try:
+                await db[collection].create_indexes([IndexModel(keys, **options)])
+            except Exception as e:
+                # A conflicting existing index or duplicate data must not stop the app
+                logger.error(f"Could not create index {collection} {keys}: {e}")
+
+async def index_report() -> dict:
+    """Diff declared indexes against the ones that exist in the database"""
+    report = {}
+    for collection, indexes in INDEX_REGISTRY.items():
+        existing = await db[collection].index_information()
+        existing_by_keys = {
+            tuple((field, direction if isinstance(direction, str) else int(direction)) for field, direction in info["key"]): (name, info)
+            for name, info in existing.items()
+            if name != "_id_"
+        }
+        
+        missing, mismatched = [], []
+        for keys, options in indexes:
+            key = tuple(keys)
+            if key not in existing_by_keys:
+                missing.append({"keys": keys, "options": options})
+                continue
+            name, info = existing_by_keys.pop(key)
+            differences = {
+                opt: {"declared": options.get(opt), "existing": info.get(opt)}
+                for opt in INDEX_COMPARED_OPTIONS
+                if options.get(opt) != info.get(opt) and (options.get(opt) or info.get(opt))
+            }
+            if differences:
+                mismatched.append({"name": name, "keys": keys, "differences": differences})
+        
+        undeclared = [
+            {"name": name, "keys": list(key)} for key, (name, info) in existing_by_keys.items()
+        ]
+        report[collection] = {"missing": missing, "mismatched": mismatched, "undeclared": undeclared}
+    return report
+
+@api_router.get("/admin/indexes/report")
+async def get_index_report(current_user: User = Depends(get_current_user)):
+    """Compare the declared index registry with the database"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    
+    return await index_report()
+
+
+# ============================================
+# DATA MIGRATIONS
+# ============================================
+
+# One-time backfills, run in order by a worker whenever it becomes scheduler
+# leader (and retried every few minutes while any is pending). Each is
+# recorded in `schema_migrations` once it completes; migrations must be
+# idempotent since a worker dying mid-run means it runs again. A failed
+# migration is recorded with its error and does not hold back the others.
+MIGRATIONS = [
+    ("comments_replies_count", backfill_reply_counts),
+    ("messages_conversation_id", backfill_conversation_ids),
+    ("conversations_summary", backfill_conversations),
+    ("user_counters", backfill_user_counters),
+    ("notifications_expires_at", backfill_notification_expiry),
+    ("follows_edges", migrate_follow_arrays),
+    ("daily_metrics", rebuild_daily_metrics),
+    ("sales_counters", backfill_sales_counters),
+]
+
+MIGRATION_RETRY_MINUTES = int(os.environ.get('MIGRATION_RETRY_MINUTES', 5))
+migrations_lock = asyncio.Lock()
+
+async def pending_migrations() -> List[str]:
+    done = set(await db.schema_migrations.distinct("_id", {"completed_at": {"$exists": True}}))
+    return [name for name, _ in MIGRATIONS if name not in done]
+
+async def run_pending_migrations():
+    if migrations_lock.locked():
+        return
+    async with migrations_lock:
+        pending = await pending_migrations()
+        if not pending:
+            return
+        for name, migrate in MIGRATIONS:
+            if name not in pending:
+                continue
+            logger.info(f"Running migration {name}")
+            try:
+                await migrate()
+            except Exception as e:
+                logger.error(f"Migration {name} failed: {type(e).__name__}: {e}")
+                await db.schema_migrations.update_one(
+                    {"_id": name},
+                    {"$set": {"last_error": f"{type(e).__name__}: {e}", "failed_at": datetime.now(timezone.utc)},
+                     "$inc": {"attempts": 1}},
+                    upsert=True
+                )
+                continue
+            await db.schema_migrations.update_one(
+                {"_id": name},
+                {"$set": {"completed_at": datetime.now(timezone.utc)}, "$unset": {"last_error": ""}},
+                upsert=True
+            )
+            logger.info(f"Migration {name} completed")
+        
+        still_pending = await pending_migrations()
+        if still_pending:
+            logger.error(f"MIGRATIONS PENDING: {', '.join(still_pending)} - data read by this release is incomplete")
+
+@api_router.get("/admin/migrations")
+async def get_migrations(current_user: User = Depends(get_current_user)):
+    """Status of the data migrations"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    
+    records = {r["_id"]: r for r in await db.schema_migrations.find({}).to_list(None)}
+    return [
+        {
+            "name": name,
+            "completed_at": records.get(name, {}).get("completed_at"),
+            "attempts": records.get(name, {}).get("attempts", 0),
+            "last_error": records.get(name, {}).get("last_error")
+        }
+        for name, _ in MIGRATIONS
+    ]
+
 # Include router
 app.include_router(api_router)
 
@@ -3329,23 +5620,199 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ============================================
+# SCHEDULER LEADER ELECTION
+# ============================================
+
+# Every worker runs the scheduler, but cron jobs only execute on the worker
+# holding the `scheduler` lease in Mongo. The leader renews it every
+# heartbeat; if it dies, another worker takes over once the lease expires
+# (SCHEDULER_LEASE_SECONDS) and the fencing token is incremented.
+SCHEDULER_LEASE_SECONDS = int(os.environ.get('SCHEDULER_LEASE_SECONDS', 15))
+SCHEDULER_HEARTBEAT_SECONDS = int(os.environ.get('SCHEDULER_HEARTBEAT_SECONDS', 5))
+
+class LeaderLease:
+    def __init__(self, name: str):
+        self.name = name
+        self.fencing_token = None
+        self._valid_until = 0.0
+        self._acquire_callbacks = []
+        self._tasks = set()
+    
+    def on_acquire(self, callback):
+        """Run `callback()` in the background every time this worker becomes leader"""
+        self._acquire_callbacks.append(callback)
+    
+    @property
+    def is_leader(self) -> bool:
+        # Leadership lapses locally a heartbeat before the lease can be taken over
+        return self.fencing_token is not None and time.monotonic() < self._valid_until
+    
+    async def acquire_or_renew(self) -> bool:
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=SCHEDULER_LEASE_SECONDS)
+        try:
+            lease = await db.scheduler_leases.find_one_and_update(
+                {"_id": self.name, "owner": WORKER_ID},
+                {"$set": {"expires_at": expires_at, "renewed_at": now}},
+                return_document=ReturnDocument.AFTER
+            )
+            if not lease:
+                # Take over a missing, released or expired lease
+                lease = await db.scheduler_leases.find_one_and_update(
+                    {"_id": self.name, "$or": [{"owner": None}, {"expires_at": {"$lt": now}}]},
+                    {
+                        "$set": {"owner": WORKER_ID, "expires_at": expires_at, "acquired_at": now, "renewed_at": now},
+                        "$inc": {"fencing_token": 1}
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                logger.info(f"Worker {WORKER_ID} is now scheduler leader (token {lease['fencing_token']})")
+        except DuplicateKeyError:
+            # Held by another worker
+            lease = None
+        except Exception as e:
+            logger.error(f"Scheduler lease error: {type(e).__name__}: {e}")
+            lease = None
+        
+        if lease:
+            acquired = lease["fencing_token"] != self.fencing_token
+            self.fencing_token = lease["fencing_token"]
+            self._valid_until = time.monotonic() + SCHEDULER_LEASE_SECONDS - SCHEDULER_HEARTBEAT_SECONDS
+            if acquired:
+                for callback in self._acquire_callbacks:
+                    task = asyncio.create_task(callback())
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+        else:
+            if self.fencing_token is not None:
+                logger.warning(f"Worker {WORKER_ID} lost scheduler leadership")
+            self.fencing_token = None
+        return self.is_leader
+    
+    async def current_token(self) -> Optional[int]:
+        """Fencing token of the lease as currently stored, whoever holds it"""
+        lease = await db.scheduler_leases.find_one({"_id": self.name}, {"fencing_token": 1})
+        return lease.get("fencing_token") if lease else None
+    
+    async def release(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self.fencing_token is None:
+            return
+        await db.scheduler_leases.update_one(
+            {"_id": self.name, "owner": WORKER_ID},
+            {"$set": {"owner": None, "expires_at": datetime.now(timezone.utc)}}
+        )
+        self.fencing_token = None
+    
+    async def heartbeat(self):
+        while True:
+            await self.acquire_or_renew()
+            await asyncio.sleep(SCHEDULER_HEARTBEAT_SECONDS)
+
+scheduler_lease = LeaderLease("scheduler")
+
+async def on_scheduler_leadership():
+    """One-off work a new leader owes the cluster: during a rolling deploy the
+    new release's workers may only become leader long after they started"""
+    # A draw tick that fired during the failover was skipped by leader_only
+    await catch_up_daily_draw(scheduler_lease.fencing_token)
+    # First boot with the materialized feed: build the timeline once
+    if not await db.timeline.find_one({}, {"_id": 1}):
+        await rebuild_timeline()
+    await run_pending_migrations()
+
+scheduler_lease.on_acquire(on_scheduler_leadership)
+
+def leader_only(job, fenced: bool = False):
+    """Wrap a scheduler job so it only runs on the lease holder.
+    
+    Fenced jobs receive the lease's fencing token to include in their writes.
+    """
+    @functools.wraps(job)
+    async def run(*args, **kwargs):
+        if not scheduler_lease.is_leader:
+            return None
+        if fenced:
+            kwargs["fencing_token"] = scheduler_lease.fencing_token
+        return await job(*args, **kwargs)
+    return run
+
 # Initialize scheduler
 scheduler = AsyncIOScheduler()
+background_tasks = []
 
 @app.on_event("startup")
 async def startup_event():
+    # Correctness indexes are always created; the mode governs the rest
+    await ensure_indexes(required_only=INDEX_BOOTSTRAP != "apply")
+    if INDEX_BOOTSTRAP == "report":
+        for collection, diff in (await index_report()).items():
+            if any(diff.values()):
+                logger.warning(f"Index diff for {collection}: {diff}")
+    
+    # Elect the worker that runs the cron jobs; the leader runs the pending
+    # migrations (on_scheduler_leadership)
+    await scheduler_lease.acquire_or_renew()
+    background_tasks.append(asyncio.create_task(scheduler_lease.heartbeat()))
+    pending = await pending_migrations()
+    if pending:
+        logger.warning(f"Migrations pending: {', '.join(pending)} (run by the scheduler leader)")
+    
     # Schedule daily draw at 6:00 PM (18:00)
     scheduler.add_job(
-        run_daily_draw,
-        CronTrigger(hour=18, minute=0, timezone='UTC'),
+        leader_only(run_daily_draw, fenced=True),
+        CronTrigger(hour=DAILY_DRAW_HOUR, minute=0, timezone='UTC'),
         id='daily_raffle_draw',
         name='Daily Raffle Draw at 6 PM',
         replace_existing=True
     )
+    # Release expired ticket holds every minute
+    scheduler.add_job(
+        leader_only(sweep_expired_ticket_holds),
+        IntervalTrigger(minutes=1),
+        id='ticket_hold_sweeper',
+        name='Release expired ticket holds',
+        replace_existing=True
+    )
+    # Recompute recent rollup rows from raw data every night
+    scheduler.add_job(
+        leader_only(reconcile_daily_metrics),
+        CronTrigger(hour=3, minute=30, timezone='UTC'),
+        id='daily_metrics_reconcile',
+        name='Reconcile daily metrics rollups',
+        replace_existing=True
+    )
+    # Retry migrations that failed or were skipped
+    scheduler.add_job(
+        leader_only(run_pending_migrations),
+        IntervalTrigger(minutes=MIGRATION_RETRY_MINUTES),
+        id='pending_migrations',
+        name='Run pending data migrations',
+        replace_existing=True
+    )
+    # Enforce notification retention every hour
+    scheduler.add_job(
+        leader_only(trim_notifications),
+        IntervalTrigger(hours=1),
+        id='notification_trimmer',
+        name='Delete expired notifications',
+        replace_existing=True
+    )
     scheduler.start()
-    logger.info("Scheduler started - Daily draw scheduled at 18:00 UTC")
+    logger.info(f"Scheduler started - Daily draw scheduled at {DAILY_DRAW_HOUR:02d}:00 UTC")
+    
+    background_tasks.append(asyncio.create_task(fanout_worker()))
+    if PUSH_BACKEND == "mongo":
+        background_tasks.append(asyncio.create_task(event_relay()))
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     scheduler.shutdown()
+    for task in background_tasks:
+        task.cancel()
+    await scheduler_lease.release()
+    password_hasher.shutdown()
     client.close()
\ No newline at end of file
@@ -2,6 +2,7 @@ import { useState, useEffect, useRef } from 'react';
 import { Link } from 'react-router-dom';
 import axios from 'axios';
 import { API } from '../App';
+import { usePushEvents } from '../hooks/use-push-events';
 import { Bell, X, Check, Ticket, MessageSquare, Trophy, Star, UserPlus, Gift } from 'lucide-react';
 
 const NotificationBell = ({ user }) => {
@@ -25,15 +26,21 @@ const NotificationBell = ({ user }) => {
     }
   };
 
-  // Initial fetch and polling
+  // New notifications are pushed while the event stream is connected
+  const pushConnected = usePushEvents(user, ['notification'], (type, notification) => {
+    setNotifications(prev => [notification, ...prev.filter(n => n.id !== notification.id)].slice(0, 50));
+  });
+
+  // Initial fetch, then poll every 30 seconds while the event stream is down.
+  // A slow poll keeps running while connected in case an event never reaches
+  // this worker's stream.
   useEffect(() => {
     if (user) {
       fetchNotifications();
-      // Poll every 30 seconds for new notifications
-      const interval = setInterval(fetchNotifications, 30000);
+      const interval = setInterval(fetchNotifications, pushConnected ? 300000 : 30000);
       return () => clearInterval(interval);
     }
-  }, [user]);
+  }, [user, pushConnected]);
 
   // Close dropdown when clicking outside
   useEffect(() => {
@@ -62,8 +69,7 @@ const NotificationBell = ({ user }) => {
   // Mark all as read
   const markAllAsRead = async () => {
     try {
-      const unreadIds = notifications.filter(n => !n.read).map(n => n.id);
-      await Promise.all(unreadIds.map(id => axios.post(`${API}/notifications/${id}/read`)));
+      await axios.post(`${API}/notifications/read-all`);
       setNotifications(prev => prev.map(n => ({ ...n, read: true })));
     } catch (error) {
       console.error('Error marking all as read:', error);
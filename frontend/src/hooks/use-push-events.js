@@ -0,0 +1,66 @@
+import { useEffect, useRef, useState } from 'react';
+import axios from 'axios';
+import { API } from '../App';
+
+const RECONNECT_DELAY = 5000;
+
+// Subscribes to the server's real-time event stream (Server-Sent Events).
+// `onEvent(type, data)` is called for each event of the given types.
+// Returns whether the stream is connected, so callers can poll less often.
+//
+// The stream is opened with a short-lived stream token (never the session
+// JWT), so every reconnect asks for a fresh one.
+export function usePushEvents(user, types, onEvent) {
+  const [connected, setConnected] = useState(false);
+  const handlerRef = useRef(onEvent);
+  handlerRef.current = onEvent;
+  const typesKey = types.join(',');
+
+  useEffect(() => {
+    if (!user || !localStorage.getItem('token') || typeof EventSource === 'undefined') return;
+
+    let source = null;
+    let retryTimer = null;
+    let closed = false;
+
+    const scheduleReconnect = () => {
+      if (!closed) retryTimer = setTimeout(connect, RECONNECT_DELAY);
+    };
+
+    const connect = async () => {
+      let token;
+      try {
+        const res = await axios.post(`${API}/events/token`);
+        token = res.data.token;
+      } catch (error) {
+        scheduleReconnect();
+        return;
+      }
+      if (closed) return;
+
+      source = new EventSource(`${API}/events/stream?token=${encodeURIComponent(token)}`);
+      source.onopen = () => setConnected(true);
+      // The token is only good for opening the stream: reconnect with a new one
+      source.onerror = () => {
+        source.close();
+        setConnected(false);
+        scheduleReconnect();
+      };
+
+      typesKey.split(',').forEach(type => {
+        source.addEventListener(type, (event) => handlerRef.current(type, JSON.parse(event.data)));
+      });
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      if (source) source.close();
+      setConnected(false);
+    };
+  }, [user, typesKey]);
+
+  return connected;
+}
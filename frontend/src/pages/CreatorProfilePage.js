@@ -51,7 +51,8 @@ const CreatorProfilePage = ({ user }) => {
       setStories(storiesRes.data || []);
       
       if (user) {
-        setIsFollowing(creatorRes.data.followers?.includes(user.id));
+        const followRes = await axios.get(`${API}/users/${creatorId}/follow-status`);
+        setIsFollowing(followRes.data.following);
         
         // Check if user can rate
         try {
@@ -106,11 +107,11 @@ const CreatorProfilePage = ({ user }) => {
       if (isFollowing) {
         await axios.post(`${API}/users/${creatorId}/unfollow`);
         setIsFollowing(false);
-        setCreator(prev => ({ ...prev, followers: prev.followers?.filter(f => f !== user.id) }));
+        setCreator(prev => ({ ...prev, followers_count: Math.max((prev.followers_count || 0) - 1, 0) }));
       } else {
         await axios.post(`${API}/users/${creatorId}/follow`);
         setIsFollowing(true);
-        setCreator(prev => ({ ...prev, followers: [...(prev.followers || []), user.id] }));
+        setCreator(prev => ({ ...prev, followers_count: (prev.followers_count || 0) + 1 }));
       }
     } catch (error) {
       console.error('Error toggling follow:', error);
@@ -236,11 +237,11 @@ const CreatorProfilePage = ({ user }) => {
                   <p className="text-xs text-slate-500">Posts</p>
                 </div>
                 <div>
-                  <p className="text-lg font-bold text-slate-900">{creator.followers?.length || 0}</p>
+                  <p className="text-lg font-bold text-slate-900">{creator.followers_count || 0}</p>
                   <p className="text-xs text-slate-500">{t('profile.followers')}</p>
                 </div>
                 <div>
-                  <p className="text-lg font-bold text-slate-900">{creator.following?.length || 0}</p>
+                  <p className="text-lg font-bold text-slate-900">{creator.following_count || 0}</p>
                   <p className="text-xs text-slate-500">{t('profile.following')}</p>
                 </div>
               </div>
@@ -3,6 +3,7 @@ import { useNavigate, Link, useLocation } from 'react-router-dom';
 import { useTranslation } from 'react-i18next';
 import axios from 'axios';
 import { API } from '../App';
+import { usePushEvents } from '../hooks/use-push-events';
 import { Mail, Send, Archive, Trash2, ArrowLeft, X, User as UserIcon, Search, ArchiveRestore, CheckSquare } from 'lucide-react';
 
 const MessagesPage = ({ user, onLogout }) => {
@@ -18,8 +19,24 @@ const MessagesPage = ({ user, onLogout }) => {
   const [searchQuery, setSearchQuery] = useState('');
   const [selectedMessages, setSelectedMessages] = useState([]);
   const [bulkDeleteMode, setBulkDeleteMode] = useState(false);
+  const [inboxCursor, setInboxCursor] = useState(null);
+  const [loadingMoreConversations, setLoadingMoreConversations] = useState(false);
+  const [conversationBeforeCursor, setConversationBeforeCursor] = useState(null);
+  const [loadingOlderMessages, setLoadingOlderMessages] = useState(false);
   const messagesEndRef = useRef(null);
   const pollingIntervalRef = useRef(null);
+  const inboxExpandedRef = useRef(false);
+  const conversationExpandedRef = useRef(false);
+  const keepScrollRef = useRef(false);
+
+  // Refresh when a message is pushed instead of polling
+  const pushConnected = usePushEvents(user, ['message'], (type, message) => {
+    loadMessages();
+    const otherId = message.from_user_id === user.id ? message.to_user_id : message.from_user_id;
+    if (selectedConversation && selectedConversation.userId === otherId) {
+      loadConversation(otherId, true);
+    }
+  });
 
   useEffect(() => {
     loadMessages();
@@ -31,35 +48,80 @@ const MessagesPage = ({ user, onLogout }) => {
       window.history.replaceState({}, document.title);
     }
     
-    // Auto-refresh every 10 seconds
+    // Auto-refresh every 10 seconds while the event stream is down, and
+    // slowly while it is up in case a pushed event is missed
     pollingIntervalRef.current = setInterval(() => {
       loadMessages();
       if (selectedConversation) {
         loadConversation(selectedConversation.userId, true); // silent reload
       }
-    }, 10000);
+    }, pushConnected ? 60000 : 10000);
     
     return () => {
       if (pollingIntervalRef.current) {
         clearInterval(pollingIntervalRef.current);
+        pollingIntervalRef.current = null;
       }
     };
-  }, [selectedConversation, showArchived]);
+  }, [selectedConversation, showArchived, pushConnected]);
   
   useEffect(() => {
+    // Prepending older history should not jump back to the newest message
+    if (keepScrollRef.current) {
+      keepScrollRef.current = false;
+      return;
+    }
     scrollToBottom();
   }, [conversationMessages]);
 
+  const toConversation = (conv) => ({
+    userId: conv.other_user_id,
+    userName: conv.other_user?.full_name || '',
+    lastMessage: conv.last_message,
+    unreadCount: conv.unread_count
+  });
+
+  const loadInbox = async (cursor = null) => {
+    const response = await axios.get(`${API}/messages/inbox`, { params: { cursor } });
+    const page = response.data.conversations.map(toConversation);
+    const pageIds = new Set(page.map(conv => conv.userId));
+    
+    if (cursor) {
+      inboxExpandedRef.current = true;
+      setConversations(prev => [...prev.filter(conv => !pageIds.has(conv.userId)), ...page]);
+      setInboxCursor(response.data.next_cursor);
+    } else if (inboxExpandedRef.current) {
+      // Refresh the first page without dropping older pages already loaded
+      setConversations(prev => [...page, ...prev.filter(conv => !pageIds.has(conv.userId))]);
+    } else {
+      setConversations(page);
+      setInboxCursor(response.data.next_cursor);
+    }
+  };
+
+  const loadMoreConversations = async () => {
+    if (loadingMoreConversations || !inboxCursor) return;
+    setLoadingMoreConversations(true);
+    
+    try {
+      await loadInbox(inboxCursor);
+    } catch (error) {
+      console.error('Error loading more conversations:', error);
+    } finally {
+      setLoadingMoreConversations(false);
+    }
+  };
+
   const loadMessages = async () => {
     try {
-      // Get messages endpoint based on role and archived filter
-      let endpoint = showArchived ? `${API}/messages/archived` : `${API}/messages`;
-      
-      if (user.role === 'admin' && !showArchived) {
-        // Admin can see all messages
-        endpoint = `${API}/admin/messages/all`;
+      if (!showArchived && user.role !== 'admin') {
+        await loadInbox();
+        return;
       }
       
+      // Admin can see all messages; everyone can list their archived ones
+      const endpoint = showArchived ? `${API}/messages/archived` : `${API}/admin/messages/all`;
+      
       const response = await axios.get(endpoint);
       const messages = response.data;
       
@@ -108,7 +170,21 @@ const MessagesPage = ({ user, onLogout }) => {
   const loadConversation = async (userId, silent = false) => {
     try {
       const response = await axios.get(`${API}/messages/conversation/${userId}`);
-      setConversationMessages(response.data.messages);
+      const page = response.data.messages;
+      
+      if (silent && conversationExpandedRef.current) {
+        // Refresh the newest page and keep the older history already loaded
+        const pageIds = new Set(page.map(m => m.id));
+        const oldest = page.length ? page[0].created_at : null;
+        setConversationMessages(prev => [
+          ...prev.filter(m => !pageIds.has(m.id) && oldest && m.created_at < oldest),
+          ...page
+        ]);
+      } else {
+        conversationExpandedRef.current = false;
+        setConversationMessages(page);
+        setConversationBeforeCursor(response.data.before_cursor);
+      }
       
       if (!silent) {
         setSelectedConversation({
@@ -119,7 +195,7 @@ const MessagesPage = ({ user, onLogout }) => {
       }
       
       // Mark messages as read
-      const unreadMessages = response.data.messages.filter(m => 
+      const unreadMessages = page.filter(m => 
         m.to_user_id === user.id && !m.read
       );
       
@@ -135,6 +211,28 @@ const MessagesPage = ({ user, onLogout }) => {
     }
   };
   
+  const loadOlderMessages = async () => {
+    if (loadingOlderMessages || !conversationBeforeCursor || !selectedConversation) return;
+    setLoadingOlderMessages(true);
+    
+    try {
+      const response = await axios.get(`${API}/messages/conversation/${selectedConversation.userId}`, {
+        params: { before: conversationBeforeCursor }
+      });
+      conversationExpandedRef.current = true;
+      keepScrollRef.current = true;
+      setConversationMessages(prev => {
+        const loadedIds = new Set(prev.map(m => m.id));
+        return [...response.data.messages.filter(m => !loadedIds.has(m.id)), ...prev];
+      });
+      setConversationBeforeCursor(response.data.before_cursor);
+    } catch (error) {
+      console.error('Error loading older messages:', error);
+    } finally {
+      setLoadingOlderMessages(false);
+    }
+  };
+  
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
@@ -219,14 +317,19 @@ const MessagesPage = ({ user, onLogout }) => {
   
   const toggleArchiveView = () => {
     setShowArchived(!showArchived);
+    setConversations([]);
+    setInboxCursor(null);
+    inboxExpandedRef.current = false;
     setSelectedConversation(null);
     setConversationMessages([]);
+    setConversationBeforeCursor(null);
+    conversationExpandedRef.current = false;
     setSearchQuery('');
   };
   
   // Filter conversations by search query
   const filteredConversations = conversations.filter(conv =>
-    conv.userName.toLowerCase().includes(searchQuery.toLowerCase())
+    (conv.userName || '').toLowerCase().includes(searchQuery.toLowerCase())
   );
 
   if (loading) {
@@ -391,6 +494,15 @@ const MessagesPage = ({ user, onLogout }) => {
                   </button>
                 ))
               )}
+              {inboxCursor && !showArchived && (
+                <button
+                  onClick={loadMoreConversations}
+                  disabled={loadingMoreConversations}
+                  className="w-full p-3 text-sm font-medium text-sky-700 hover:bg-slate-50 disabled:opacity-50"
+                >
+                  {t('feed.loadMore')}
+                </button>
+              )}
             </div>
           </div>
 
@@ -447,6 +559,17 @@ const MessagesPage = ({ user, onLogout }) => {
 
                 {/* Messages */}
                 <div className="flex-1 overflow-y-auto p-4 space-y-4">
+                  {conversationBeforeCursor && (
+                    <div className="text-center">
+                      <button
+                        onClick={loadOlderMessages}
+                        disabled={loadingOlderMessages}
+                        className="px-3 py-1 text-sm text-sky-700 border border-slate-300 rounded-lg hover:bg-slate-50 disabled:opacity-50"
+                      >
+                        Cargar mensajes anteriores
+                      </button>
+                    </div>
+                  )}
                   {conversationMessages.map((msg) => (
                     <div
                       key={msg.id}
@@ -49,8 +49,7 @@ const NotificationsPage = ({ user }) => {
   // Mark all as read
   const markAllAsRead = async () => {
     try {
-      const unreadIds = notifications.filter(n => !n.read).map(n => n.id);
-      await Promise.all(unreadIds.map(id => axios.post(`${API}/notifications/${id}/read`)));
+      await axios.post(`${API}/notifications/read-all`);
       setNotifications(prev => prev.map(n => ({ ...n, read: true })));
     } catch (error) {
       console.error('Error marking all as read:', error);
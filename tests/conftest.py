@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+import pytest_asyncio
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "rafflywin_test")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A fresh in-memory database swapped in for the server's"""
+    database = AsyncMongoMockClient()["rafflywin_test"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "_sales_counters_ready", False)
+    server.principal_cache.clear()
+    server.creator_card_cache.clear()
+    return database
+
+
+@pytest_asyncio.fixture
+async def raffle(db):
+    raffle = {
+        "id": "raffle-1",
+        "creator_id": "creator-1",
+        "title": "Rifa de prueba",
+        "ticket_price": 2.0,
+        "ticket_range": 20,
+        "status": "active",
+        "tickets_sold": 0
+    }
+    await db.raffles.insert_one(dict(raffle))
+    await db.users.insert_one({
+        "id": "creator-1",
+        "email": "creator@example.com",
+        "full_name": "Creador",
+        "role": "creator",
+        "paypal_email": "creator@example.com"
+    })
+    return raffle
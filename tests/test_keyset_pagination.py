@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.asyncio
+
+OWNER = server.TokenPrincipal(id="owner", email="owner@example.com", role=server.UserRole.USER)
+BASE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def at(minutes: int) -> str:
+    return (BASE + timedelta(minutes=minutes)).isoformat()
+
+
+async def insert_conversations(db, minutes: list):
+    await db.conversations.insert_many([
+        {
+            "id": f"owner:user-{i}",
+            "owner_id": "owner",
+            "other_user_id": f"user-{i}",
+            "last_message": {"content": f"hola {i}", "created_at": at(minute)},
+            "last_message_at": at(minute),
+            "unread_count": 0
+        }
+        for i, minute in enumerate(minutes)
+    ])
+
+
+async def read_inbox(per_page: int) -> list:
+    pages, cursor = [], None
+    while True:
+        page = await server.get_inbox(per_page=per_page, cursor=cursor, current_user=OWNER)
+        pages.append(page)
+        assert page["has_more"] == (page["next_cursor"] is not None)
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+async def test_inbox_pages_cover_ties_exactly_once(db):
+    # Three conversations share a timestamp, so the id breaks the tie
+    await insert_conversations(db, [5, 3, 3, 3, 1])
+    
+    pages = await read_inbox(per_page=2)
+    
+    ids = [c["id"] for page in pages for c in page["conversations"]]
+    assert sorted(ids) == sorted(f"owner:user-{i}" for i in range(5))
+    assert len(ids) == len(set(ids))
+    keys = [(c["last_message_at"], c["id"]) for page in pages for c in page["conversations"]]
+    assert keys == sorted(keys, reverse=True)
+
+
+async def test_inbox_full_last_page_has_no_next_cursor(db):
+    await insert_conversations(db, [4, 3, 2, 1])
+    
+    pages = await read_inbox(per_page=2)
+    
+    assert [len(page["conversations"]) for page in pages] == [2, 2]
+    assert pages[-1]["has_more"] is False
+
+
+async def test_inbox_only_lists_the_owners_conversations(db):
+    await insert_conversations(db, [2, 1])
+    await db.conversations.insert_one({"id": "other:owner", "owner_id": "other", "other_user_id": "owner", "last_message_at": at(3)})
+    
+    pages = await read_inbox(per_page=10)
+    
+    assert [c["other_user_id"] for c in pages[0]["conversations"]] == ["user-0", "user-1"]
+
+
+async def insert_messages(db, minutes: list):
+    await db.messages.insert_many([
+        {
+            "id": f"msg-{i:02d}",
+            "conversation_id": server.conversation_key("owner", "friend"),
+            "from_user_id": "owner" if i % 2 else "friend",
+            "to_user_id": "friend" if i % 2 else "owner",
+            "content": f"mensaje {i}",
+            "read": True,
+            "created_at": at(minute)
+        }
+        for i, minute in enumerate(minutes)
+    ])
+
+
+async def read_history(limit: int) -> list:
+    pages, before = [], None
+    while True:
+        page = await server.get_conversation("friend", limit=limit, before=before, current_user=OWNER)
+        pages.append(page)
+        before = page["before_cursor"]
+        if before is None:
+            return pages
+
+
+async def test_conversation_history_walks_back_without_gaps(db):
+    await insert_messages(db, [1, 2, 2, 2, 3, 4, 5])
+    
+    pages = await read_history(limit=3)
+    
+    # Each page is oldest first; prepending the older pages rebuilds the thread
+    history = [m for page in reversed(pages) for m in page["messages"]]
+    keys = [(m["created_at"], m["id"]) for m in history]
+    assert keys == sorted(keys)
+    assert [m["id"] for m in history] == sorted(m["id"] for m in history)
+    assert len(history) == 7
+
+
+async def test_conversation_first_page_is_the_newest(db):
+    await insert_messages(db, [1, 2, 3, 4])
+    
+    page = await server.get_conversation("friend", limit=2, current_user=OWNER)
+    
+    assert [m["id"] for m in page["messages"]] == ["msg-02", "msg-03"]
+    assert page["has_more"] is True
+
+
+async def test_conversation_exact_multiple_ends_without_cursor(db):
+    await insert_messages(db, [1, 2, 3, 4])
+    
+    pages = await read_history(limit=2)
+    
+    assert [len(page["messages"]) for page in pages] == [2, 2]
+    assert pages[-1]["has_more"] is False
+
+
+async def test_malformed_cursor_is_rejected(db):
+    with pytest.raises(HTTPException) as exc:
+        await server.get_conversation("friend", before="not-a-cursor", current_user=OWNER)
+    assert exc.value.status_code == 400
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.asyncio
+
+DRAW_SLOT = datetime(2026, 1, 15, server.DAILY_DRAW_HOUR, tzinfo=timezone.utc)
+
+
+async def expire_lease(db, name: str):
+    await db.scheduler_leases.update_one(
+        {"_id": name},
+        {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+    )
+
+
+async def test_live_lease_is_not_taken_over(db, monkeypatch):
+    leader = server.LeaderLease("scheduler")
+    assert await leader.acquire_or_renew()
+    
+    monkeypatch.setattr(server, "WORKER_ID", "worker-b")
+    follower = server.LeaderLease("scheduler")
+    assert not await follower.acquire_or_renew()
+    assert follower.fencing_token is None
+
+
+async def test_takeover_of_an_expired_lease_bumps_the_fencing_token(db, monkeypatch):
+    old_leader = server.LeaderLease("scheduler")
+    assert await old_leader.acquire_or_renew()
+    assert old_leader.fencing_token == 1
+    await expire_lease(db, "scheduler")
+    
+    worker_a = server.WORKER_ID
+    monkeypatch.setattr(server, "WORKER_ID", "worker-b")
+    new_leader = server.LeaderLease("scheduler")
+    assert await new_leader.acquire_or_renew()
+    assert new_leader.fencing_token == 2
+    
+    # The old leader wakes up and finds the lease gone
+    monkeypatch.setattr(server, "WORKER_ID", worker_a)
+    assert not await old_leader.acquire_or_renew()
+    assert old_leader.fencing_token is None
+    assert await old_leader.current_token() == 2
+
+
+async def insert_due_raffle(db, **fields):
+    await db.raffles.insert_one({
+        "id": "raffle-1",
+        "creator_id": "creator-1",
+        "title": "Rifa de prueba",
+        "ticket_range": 10,
+        "status": "active",
+        "raffle_date": (DRAW_SLOT - timedelta(hours=18)).isoformat(),
+        **fields
+    })
+
+
+async def test_stale_fencing_token_cannot_complete_a_draw(db):
+    # A newer leader (token 2) already claimed this raffle
+    await insert_due_raffle(db, draw_fencing_token=2)
+    
+    stats = await server.run_daily_draw(fencing_token=1, cutoff=DRAW_SLOT)
+    
+    assert stats["due_raffles"] == 1
+    assert stats["raffles_drawn"] == 0
+    raffle = await db.raffles.find_one({"id": "raffle-1"})
+    assert raffle["status"] == "active"
+    assert raffle["draw_fencing_token"] == 2
+    assert await db.notifications.count_documents({}) == 0
+
+
+async def test_current_fencing_token_completes_the_draw(db):
+    await insert_due_raffle(db, draw_fencing_token=1)
+    
+    stats = await server.run_daily_draw(fencing_token=2, cutoff=DRAW_SLOT)
+    
+    raffle = await db.raffles.find_one({"id": "raffle-1"})
+    assert raffle["status"] == "completed"
+    assert raffle["draw_fencing_token"] == 2
+    assert raffle["draw_run_id"] == stats["id"]
@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.asyncio
+
+BUYER = server.User(id="buyer-1", email="buyer@example.com", full_name="Comprador")
+
+
+async def allocated_count(db) -> int:
+    inventory = await db.ticket_inventory.find_one({"raffle_id": "raffle-1"})
+    return inventory["allocated_count"]
+
+
+async def create_order(quantity: int = 3) -> dict:
+    return await server.create_paypal_ticket_order(
+        server.PayPalTicketPurchase(raffle_id="raffle-1", quantity=quantity), current_user=BUYER
+    )
+
+
+async def expire_hold(db, order_id: str):
+    await db.ticket_holds.update_one(
+        {"order_id": order_id},
+        {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+    )
+
+
+async def test_sweeper_releases_only_expired_holds(db, raffle):
+    expired = await create_order()
+    active = await create_order()
+    await expire_hold(db, expired["order_id"])
+    
+    await server.sweep_expired_ticket_holds()
+    
+    assert (await db.ticket_holds.find_one({"order_id": expired["order_id"]}))["status"] == "expired"
+    assert (await db.ticket_holds.find_one({"order_id": active["order_id"]}))["status"] == "active"
+    assert await allocated_count(db) == 3
+
+
+async def test_capture_sells_the_held_numbers(db, raffle):
+    order = await create_order()
+    
+    result = await server.capture_paypal_ticket_order(order["order_id"], "PAYPAL-1", current_user=BUYER)
+    
+    assert sorted(result["tickets"]) == sorted(order["ticket_numbers"])
+    tickets = await db.tickets.find({"order_id": order["order_id"]}).to_list(None)
+    assert sorted(t["ticket_number"] for t in tickets) == sorted(order["ticket_numbers"])
+    assert (await db.ticket_holds.find_one({"order_id": order["order_id"]}))["status"] == "converted"
+    pending = await db.pending_orders.find_one({"id": order["order_id"]})
+    assert pending["status"] == "completed"
+    assert "capturing_since" not in pending
+    
+    # A converted hold is not released by the sweeper
+    await expire_hold(db, order["order_id"])
+    await server.sweep_expired_ticket_holds()
+    assert await allocated_count(db) == 3
+
+
+async def test_capture_after_hold_expiry_assigns_free_numbers(db, raffle):
+    order = await create_order()
+    await expire_hold(db, order["order_id"])
+    await server.sweep_expired_ticket_holds()
+    
+    result = await server.capture_paypal_ticket_order(order["order_id"], "PAYPAL-1", current_user=BUYER)
+    
+    assert len(result["tickets"]) == 3
+    assert await allocated_count(db) == 3
+
+
+async def test_failed_capture_releases_the_numbers_and_reopens_the_order(db, raffle, monkeypatch):
+    order = await create_order()
+    
+    async def broken_write_tickets(*args, **kwargs):
+        raise RuntimeError("connection reset")
+    
+    monkeypatch.setattr(server, "write_tickets", broken_write_tickets)
+    with pytest.raises(RuntimeError):
+        await server.capture_paypal_ticket_order(order["order_id"], "PAYPAL-1", current_user=BUYER)
+    
+    pending = await db.pending_orders.find_one({"id": order["order_id"]})
+    assert pending["status"] == "pending"
+    assert await allocated_count(db) == 0
+
+
+async def test_stale_capture_is_rolled_back_by_the_sweeper(db, raffle):
+    order = await create_order()
+    # The worker died right after converting the hold
+    await server.convert_ticket_hold(order["order_id"])
+    await db.pending_orders.update_one(
+        {"id": order["order_id"]},
+        {"$set": {
+            "status": "capturing",
+            "capturing_since": datetime.now(timezone.utc) - timedelta(seconds=server.TICKET_CAPTURE_LEASE_SECONDS + 1)
+        }}
+    )
+    
+    await server.sweep_expired_ticket_holds()
+    
+    assert (await db.pending_orders.find_one({"id": order["order_id"]}))["status"] == "pending"
+    assert (await db.ticket_holds.find_one({"order_id": order["order_id"]}))["status"] == "released"
+    assert await allocated_count(db) == 0
+    
+    # Settling again must not release the numbers twice
+    await server.sweep_expired_ticket_holds()
+    assert await allocated_count(db) == 0
+
+
+async def test_stale_capture_with_all_tickets_written_is_completed(db, raffle):
+    order = await create_order()
+    await server.convert_ticket_hold(order["order_id"])
+    await server.write_tickets(raffle, BUYER.id, order["ticket_numbers"], raffle["ticket_price"], order_id=order["order_id"])
+    await db.pending_orders.update_one(
+        {"id": order["order_id"]},
+        {"$set": {
+            "status": "capturing",
+            "capturing_since": datetime.now(timezone.utc) - timedelta(seconds=server.TICKET_CAPTURE_LEASE_SECONDS + 1),
+            "capture_numbers": order["ticket_numbers"]
+        }}
+    )
+    
+    await server.sweep_expired_ticket_holds()
+    
+    assert (await db.pending_orders.find_one({"id": order["order_id"]}))["status"] == "completed"
+    assert await allocated_count(db) == 3
+
+
+async def test_live_capture_is_left_to_its_worker(db, raffle):
+    order = await create_order()
+    await db.pending_orders.update_one(
+        {"id": order["order_id"]},
+        {"$set": {"status": "capturing", "capturing_since": datetime.now(timezone.utc)}}
+    )
+    
+    await server.sweep_expired_ticket_holds()
+    
+    assert (await db.pending_orders.find_one({"id": order["order_id"]}))["status"] == "capturing"
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from bson import Binary
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_concurrent_allocations_never_share_a_number(db):
+    batches = await asyncio.gather(*(server.allocate_ticket_numbers("raffle-1", 50, 5) for _ in range(10)))
+    numbers = [n for batch in batches for n in batch]
+    
+    assert sorted(numbers) == list(range(1, 51))
+    inventory = await db.ticket_inventory.find_one({"raffle_id": "raffle-1"})
+    assert inventory["allocated_count"] == 50
+    
+    with pytest.raises(HTTPException) as exc:
+        await server.allocate_ticket_numbers("raffle-1", 50, 1)
+    assert exc.value.status_code == 400
+
+
+async def test_cas_conflict_is_retried_against_the_new_version(db, monkeypatch):
+    real_get = server.get_ticket_inventory
+    reads = []
+    
+    async def racing_get(raffle_id, ticket_range):
+        inventory = await real_get(raffle_id, ticket_range)
+        reads.append(inventory["version"])
+        if len(reads) == 1:
+            # Another buyer takes number 1 between our read and our write
+            bitmap = bytearray(inventory["bitmap"])
+            server._set_bit(bitmap, 1)
+            await db.ticket_inventory.update_one(
+                {"raffle_id": raffle_id},
+                {"$set": {"bitmap": Binary(bytes(bitmap))}, "$inc": {"allocated_count": 1, "version": 1}}
+            )
+        return inventory
+    
+    monkeypatch.setattr(server, "get_ticket_inventory", racing_get)
+    claimed = await server.claim_ticket_numbers("raffle-1", 10, [1, 2])
+    
+    assert claimed == [2]
+    assert reads == [0, 1]
+    inventory = await db.ticket_inventory.find_one({"raffle_id": "raffle-1"})
+    assert inventory["allocated_count"] == 2
+    assert inventory["version"] == 2
+
+
+async def test_contention_past_the_time_budget_raises_409(db, monkeypatch):
+    real_get = server.get_ticket_inventory
+    
+    async def always_stale(raffle_id, ticket_range):
+        inventory = await real_get(raffle_id, ticket_range)
+        await db.ticket_inventory.update_one({"raffle_id": raffle_id}, {"$inc": {"version": 1}})
+        return inventory
+    
+    monkeypatch.setattr(server, "get_ticket_inventory", always_stale)
+    monkeypatch.setattr(server, "TICKET_ALLOCATION_TIMEOUT_SECONDS", 0.05)
+    
+    with pytest.raises(HTTPException) as exc:
+        await server.allocate_ticket_numbers("raffle-1", 10, 1)
+    assert exc.value.status_code == 409
+
+
+async def test_released_numbers_can_be_allocated_again(db):
+    numbers = await server.allocate_ticket_numbers("raffle-1", 3, 3)
+    await server.release_ticket_numbers("raffle-1", 3, numbers[:1])
+    
+    assert await server.allocate_ticket_numbers("raffle-1", 3, 1) == numbers[:1]
+
+
+async def test_inventory_is_built_from_tickets_sold_before_it_existed(db):
+    await db.tickets.insert_many([
+        {"raffle_id": "raffle-1", "ticket_number": n} for n in (1, 2, 3)
+    ])
+    
+    assert sorted(await server.claim_ticket_numbers("raffle-1", 5, [2, 3, 4, 5])) == [4, 5]